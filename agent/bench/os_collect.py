@@ -0,0 +1,63 @@
+"""Micro-benchmark: OS status collection time per heartbeat.
+
+Compares the previous implementation (eight ``bash -lc`` forks per beat) with
+``OsStatusCollector`` (static facts read once, cached background probes).
+
+    python agent/bench/os_collect.py --beats 20
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from heartbeat import OsStatusCollector  # noqa: E402
+
+
+LEGACY_COMMANDS = [
+    "bash -lc 'apt list --upgradable 2>/dev/null'",
+    "bash -lc 'lsb_release -ds 2>/dev/null'",
+    "bash -lc 'cat /etc/os-release 2>/dev/null'",
+    "bash -lc 'uname -m'",
+    "bash -lc 'uname -r'",
+    "bash -lc 'hostname'",
+    "bash -lc 'cat /proc/uptime 2>/dev/null'",
+    "bash -lc 'sudo -n apt -v >/dev/null 2>&1'",
+]
+
+
+def legacy_collect() -> None:
+    for cmd in LEGACY_COMMANDS:
+        subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=30)
+
+
+def _time(fn, beats: int) -> list[float]:
+    out = []
+    for _ in range(beats):
+        t0 = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t0) * 1000)
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--beats", type=int, default=20)
+    args = ap.parse_args()
+
+    legacy = _time(legacy_collect, args.beats)
+    collector = OsStatusCollector()
+    t0 = time.perf_counter()
+    collector.prime()  # done in a thread before the first beat by the agent
+    collector.collect()
+    first = (time.perf_counter() - t0) * 1000
+    cached = _time(collector.collect, args.beats)
+    print(f"legacy (bash -lc x8): median {statistics.median(legacy):9.3f} ms/beat")
+    print(f"collector first beat: {first:9.3f} ms")
+    print(f"collector steady    : median {statistics.median(cached):9.3f} ms/beat")
+
+
+if __name__ == "__main__":
+    main()
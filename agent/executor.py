@@ -1,5 +1,8 @@
+import asyncio
+import os
+import signal
 import subprocess
-from typing import List
+from typing import List, Optional
 
 
 def run_commands(commands: List[str], timeout: int = 600) -> tuple[int, List[str]]:
@@ -19,16 +22,61 @@ def run_commands(commands: List[str], timeout: int = 600) -> tuple[int, List[str
     return code, outputs
 
 
-def stream_command(cmd: str, timeout: int = 600):
-    p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+# seconds a stopped step gets to exit on SIGTERM (apt/dpkg finish the current
+# package and leave a consistent state) before the group is SIGKILLed
+KILL_GRACE = 30
+
+
+def _signal(p: asyncio.subprocess.Process, sig: int) -> None:
+    try:
+        os.killpg(p.pid, sig)
+    except ProcessLookupError:
+        pass
+    except PermissionError:
+        # group holds processes of another user (sudo): signal at least the shell
+        p.send_signal(sig)
+
+
+async def _kill(p: asyncio.subprocess.Process, grace: float = KILL_GRACE) -> None:
+    _signal(p, signal.SIGTERM)
+    try:
+        async with asyncio.timeout(grace):
+            await p.wait()
+        return
+    except TimeoutError:
+        pass
+    _signal(p, signal.SIGKILL)
+    await p.wait()
+
+
+async def stream_command(cmd: str, timeout: Optional[float] = None):
+    """Run ``cmd`` as an asyncio subprocess and yield its output line by line.
+
+    The event loop keeps running while the command does (heartbeats, chunk
+    flushes). Output is decoded leniently so binary noise cannot abort a run.
+    Like the blocking version, a step is not stopped for running long unless
+    the caller passes ``timeout`` (seconds); it is still stopped when the
+    consumer goes away (agent shutdown).
+    """
+    # own process group: a timeout or cancellation also stops what the shell started
+    p = await asyncio.create_subprocess_shell(cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT, start_new_session=True)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout if timeout else None
     try:
-        for line in iter(p.stdout.readline, ''):
+        while True:
+            async with asyncio.timeout_at(deadline):
+                line = await p.stdout.readline()
             if not line:
                 break
-            yield line
-        rc = p.wait(timeout=timeout)
-    except subprocess.TimeoutExpired:
-        p.kill()
+            yield line.decode("utf-8", errors="replace")
+        async with asyncio.timeout_at(deadline and max(deadline, loop.time() + 0.1)):
+            rc = await p.wait()
+    except TimeoutError:
+        await _kill(p)
         yield "[TIMEOUT]\n"
         rc = -1
+    finally:
+        if p.returncode is None:
+            # consumer stopped early (error/cancellation): do not leave it running
+            await _kill(p)
     yield f"[EXIT {rc}]\n"
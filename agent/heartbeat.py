@@ -1,8 +1,152 @@
-from typing import Dict
+from typing import Any, Dict, Optional
+import asyncio
+import os
+import signal
+import platform
+import socket
 import subprocess
+import threading
+import time
+
+
+class AppCheck:
+    """Last result of one app's health/version probes."""
+
+    def __init__(self, cfg: dict, default_interval: float, default_timeout: float) -> None:
+        self.name = cfg.get("name") or "app"
+        self.type = cfg.get("type")
+        self.health_cmd: Optional[str] = cfg.get("health_check")
+        self.version_cmd: Optional[str] = cfg.get("version_check")
+        self.interval = float(cfg.get("check_interval") or default_interval)
+        self.timeout = float(cfg.get("check_timeout") or default_timeout)
+        self.status = "unknown"
+        self.health = "unknown"
+        self.version: Optional[str] = None
+        self.checked_at = 0.0  # monotonic, 0 = never
+
+    def state(self, now: float) -> dict:
+        st: Dict[str, Any] = {"type": self.type, "status": self.status, "health": self.health}
+        if self.version:
+            st["current"] = self.version
+        if self.health_cmd or self.version_cmd:
+            # overdue results are reported as stale, never waited on
+            st["stale"] = self.checked_at == 0 or now - self.checked_at > 2 * self.interval + self.timeout
+        return st
+
+
+class AppStateCollector:
+    """Runs each app's ``health_check``/``version_check`` in the background.
+
+    Every app is refreshed on its own ``check_interval`` with its own
+    ``check_timeout``; at most ``max_concurrent`` probes run at once across
+    all apps. ``collect`` only reads the cached results, so a slow or hung
+    check never delays a heartbeat.
+    """
+
+    def __init__(self, config_apps: list[dict], max_concurrent: int = 4, default_interval: float = 60, default_timeout: float = 20) -> None:
+        self.apps = [AppCheck(a, default_interval, default_timeout) for a in config_apps]
+        self._sem = asyncio.Semaphore(max_concurrent)
+        self._tasks: list[asyncio.Task] = []
+        self._first_round: Optional[asyncio.Future] = None
+
+    def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        firsts = []
+        for app in self.apps:
+            if app.health_cmd or app.version_cmd:
+                done = loop.create_future()
+                firsts.append(done)
+                self._tasks.append(asyncio.create_task(self._loop(app, done)))
+        self._first_round = asyncio.gather(*firsts)
+
+    async def prime(self, max_wait: float) -> None:
+        """Wait (bounded) for the first round of checks so the first heartbeat is informative."""
+        if self._first_round is None:
+            return
+        try:
+            async with asyncio.timeout(max_wait):
+                await asyncio.shield(self._first_round)
+        except asyncio.TimeoutError:
+            pass
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _run(self, cmd: str, timeout: float) -> tuple[Optional[int], str]:
+        """(exit code, first output line); exit code None on timeout."""
+        async with self._sem:
+            # own process group, so a timeout also kills what the shell spawned
+            proc = await asyncio.create_subprocess_shell(
+                cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL, start_new_session=True
+            )
+            try:
+                async with asyncio.timeout(timeout):
+                    out, _ = await proc.communicate()
+            except asyncio.TimeoutError:
+                return None, ""
+            finally:
+                if proc.returncode is None:
+                    try:
+                        os.killpg(proc.pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                    await proc.wait()
+            text = out.decode(errors="replace").strip()
+            return proc.returncode, text.splitlines()[0] if text else ""
+
+    async def _check(self, app: AppCheck) -> None:
+        if app.health_cmd:
+            try:
+                rc, _ = await self._run(app.health_cmd, app.timeout)
+            except OSError:
+                rc = -1
+            if rc is None:
+                app.status, app.health = "timeout", "unhealthy"
+            elif rc == 0:
+                app.status, app.health = "running", "ok"
+            else:
+                app.status, app.health = "failed", "unhealthy"
+        if app.version_cmd:
+            try:
+                rc, line = await self._run(app.version_cmd, app.timeout)
+            except OSError:
+                rc, line = -1, ""
+            if rc == 0 and line:
+                app.version = line[:128]
+        app.checked_at = time.monotonic()
+
+    async def _loop(self, app: AppCheck, first: asyncio.Future) -> None:
+        while True:
+            try:
+                await self._check(app)
+            except Exception as e:
+                print(f"app check error ({app.name}): {e}")
+            if not first.done():
+                first.set_result(None)
+            await asyncio.sleep(app.interval)
+
+    def collect(self) -> Dict[str, dict]:
+        now = time.monotonic()
+        return {app.name: app.state(now) for app in self.apps}
+
+
+_apps_collector: Optional[AppStateCollector] = None
+
+
+def start_apps_collector(config_apps: list[dict], max_concurrent: int = 4) -> AppStateCollector:
+    """Start background app checks (needs a running event loop)."""
+    global _apps_collector
+    _apps_collector = AppStateCollector(config_apps, max_concurrent=max_concurrent)
+    _apps_collector.start()
+    return _apps_collector
 
 
 def collect_apps_state(config_apps: list[dict]) -> Dict[str, dict]:
+    if _apps_collector is not None:
+        return _apps_collector.collect()
     state: Dict[str, dict] = {}
     for app in config_apps:
         name = app.get("name") or "app"
@@ -14,53 +158,152 @@ def collect_apps_state(config_apps: list[dict]) -> Dict[str, dict]:
     return state
 
 
-def collect_os_update_status() -> dict:
-    try:
-        # Count upgradable packages (Debian/Ubuntu)
-        p = subprocess.run("bash -lc 'apt list --upgradable 2>/dev/null'", shell=True, capture_output=True, text=True, timeout=30)
-        lines = [ln for ln in p.stdout.splitlines() if ln.strip()]
-        # First line may be a header; count rest
-        count = max(0, len(lines) - 1) if lines else 0
-        # Try to collect OS version (Debian/Ubuntu)
-        osv = ""
+def _read_os_version() -> str:
+    # Same source lsb_release uses on Debian/Ubuntu, without forking it
+    for path in ("/etc/os-release", "/usr/lib/os-release"):
         try:
-            pv = subprocess.run("bash -lc 'lsb_release -ds 2>/dev/null'", shell=True, capture_output=True, text=True, timeout=10)
-            osv = (pv.stdout or "").strip().strip('"')
-            if not osv:
-                pv2 = subprocess.run("bash -lc 'cat /etc/os-release 2>/dev/null'", shell=True, capture_output=True, text=True, timeout=10)
-                for ln in pv2.stdout.splitlines():
+            with open(path, "r", encoding="utf-8") as f:
+                for ln in f:
                     if ln.startswith("PRETTY_NAME="):
-                        osv = ln.split("=",1)[1].strip().strip('"')
-                        break
-        except Exception:
-            pass
-        # Collect additional OS metadata
-        arch = ""
-        kernel = ""
-        hostname = ""
-        uptime_seconds = 0
+                        return ln.split("=", 1)[1].strip().strip('"')
+        except OSError:
+            continue
+    return ""
+
+
+def _read_uptime() -> int:
+    try:
+        with open("/proc/uptime", "r", encoding="utf-8") as f:
+            return int(float(f.read().split()[0]))
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _mtime(path: str) -> float:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return 0.0
+
+
+def _probe_upgrades() -> int:
+    p = subprocess.run(["apt", "list", "--upgradable"], capture_output=True, text=True, timeout=30)
+    lines = [ln for ln in p.stdout.splitlines() if ln.strip()]
+    # First line may be a header; count rest
+    return max(0, len(lines) - 1) if lines else 0
+
+
+def _probe_sudo() -> bool:
+    # Check sudoers allows apt without password
+    p = subprocess.run(["sudo", "-n", "apt", "-v"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10)
+    return p.returncode == 0
+
+
+class CachedProbe:
+    """Expensive probe refreshed in the background on a TTL.
+
+    The cached value is served immediately; when it is older than ``ttl`` or
+    one of the ``watch`` paths changed mtime, a refresh starts in a daemon
+    thread and the next call picks up the new value.
+    """
+
+    def __init__(self, fn, ttl: float, default, watch: tuple[str, ...] = ()) -> None:
+        self.fn = fn
+        self.ttl = ttl
+        self.value = default
+        self.watch = watch
+        self._checked_at = 0.0
+        self._mtimes: tuple[float, ...] = ()
+        self._lock = threading.Lock()
+        self._running = False
+
+    def _stale(self) -> bool:
+        if time.monotonic() - self._checked_at >= self.ttl:
+            return True
+        return bool(self.watch) and tuple(_mtime(p) for p in self.watch) != self._mtimes
+
+    def _refresh(self) -> None:
+        mtimes = tuple(_mtime(p) for p in self.watch)
         try:
-            arch = subprocess.run("bash -lc 'uname -m'", shell=True, capture_output=True, text=True, timeout=5).stdout.strip()
-            kernel = subprocess.run("bash -lc 'uname -r'", shell=True, capture_output=True, text=True, timeout=5).stdout.strip()
-            hostname = subprocess.run("bash -lc 'hostname'", shell=True, capture_output=True, text=True, timeout=5).stdout.strip()
-            up = subprocess.run("bash -lc 'cat /proc/uptime 2>/dev/null'", shell=True, capture_output=True, text=True, timeout=5).stdout.strip()
-            if up:
-                uptime_seconds = int(float(up.split()[0]))
+            self.value = self.fn()
         except Exception:
             pass
-        # Check sudoers allows apt without password
-        sp = subprocess.run("bash -lc 'sudo -n apt -v >/dev/null 2>&1'", shell=True)
-        sudo_ok = (sp.returncode == 0)
-        return {
+        finally:
+            self._mtimes = mtimes
+            self._checked_at = time.monotonic()
+            self._running = False
+
+    def get(self, block: bool = False):
+        with self._lock:
+            start = not self._running and self._stale()
+            if start:
+                self._running = True
+        if start:
+            if block:
+                self._refresh()
+            else:
+                threading.Thread(target=self._refresh, daemon=True).start()
+        return self.value
+
+
+class OsStatusCollector:
+    """OS update status for heartbeats without forking shells on the hot path.
+
+    Static facts are read once, uptime comes straight from /proc, and the apt
+    and sudo probes are cached and invalidated when apt lists or the dpkg
+    status database change. ``collect`` never waits on a probe; ``prime``
+    runs them up front (from a thread, see ``prime_os_status``).
+    """
+
+    APT_WATCH = ("/var/lib/apt/lists", "/var/lib/dpkg/status")
+
+    def __init__(self, upgrades_ttl: float = 900, sudo_ttl: float = 3600) -> None:
+        self.static = {
             "pkg_manager": "apt",
+            "os_version": _read_os_version(),
+            "arch": platform.machine(),
+            "kernel": platform.release(),
+            "hostname": socket.gethostname(),
+        }
+        self.upgrades = CachedProbe(_probe_upgrades, upgrades_ttl, -1, self.APT_WATCH)
+        self.sudo = CachedProbe(_probe_sudo, sudo_ttl, False, ("/etc/sudoers", "/etc/sudoers.d"))
+
+    def prime(self) -> None:
+        """Run both probes now (blocking, up to ~40s) so the first heartbeat is accurate."""
+        self.upgrades.get(block=True)
+        self.sudo.get(block=True)
+
+    def collect(self) -> dict:
+        count = self.upgrades.get()
+        sudo_ok = self.sudo.get()
+        return {
+            **self.static,
             "upgrades": count,
-            "status": ("outdated" if count > 0 else "up_to_date"),
+            "status": ("unknown" if count < 0 else "outdated" if count > 0 else "up_to_date"),
             "sudo_apt_ok": sudo_ok,
-            "os_version": osv,
-            "arch": arch,
-            "kernel": kernel,
-            "hostname": hostname,
-            "uptime_seconds": uptime_seconds,
+            "uptime_seconds": _read_uptime(),
         }
-    except Exception:
-        return {"pkg_manager": "apt", "upgrades": -1, "status": "unknown", "sudo_apt_ok": False, "os_version": "", "arch": "", "kernel": "", "hostname": "", "uptime_seconds": 0}
+
+
+_collector: Optional[OsStatusCollector] = None
+
+
+def os_status_collector() -> OsStatusCollector:
+    global _collector
+    if _collector is None:
+        _collector = OsStatusCollector()
+    return _collector
+
+
+async def prime_os_status(max_wait: float) -> None:
+    """Prime the OS probes in a thread, waiting (bounded) without blocking the event loop."""
+    done = asyncio.ensure_future(asyncio.to_thread(os_status_collector().prime))
+    try:
+        async with asyncio.timeout(max_wait):
+            await asyncio.shield(done)
+    except asyncio.TimeoutError:
+        pass  # still running: later heartbeats pick the values up
+
+
+def collect_os_update_status() -> dict:
+    return os_status_collector().collect()
@@ -1,12 +1,14 @@
 import os
-import json
 import asyncio
+import signal
 from typing import Any
 import httpx
 import yaml
 from pydantic import BaseModel
-from heartbeat import collect_apps_state, collect_os_update_status
+from heartbeat import collect_apps_state, collect_os_update_status, prime_os_status, start_apps_collector
 from crypto_hmac import sign_bytes
+from streaming import ChunkBatcher
+from wire import wire
 
 
 class AgentSettings(BaseModel):
@@ -14,6 +16,11 @@ class AgentSettings(BaseModel):
     server_url: str
     poll_interval: int = 30
     psk: str
+    max_concurrent_checks: int = 4
+    # commands running at the same time; commands for the same app never overlap
+    max_concurrent_commands: int = 2
+    # "auto": compress / binary-encode requests as advertised by the server; "json": never
+    wire_encoding: str = "auto"
 
 
 def load_config(path: str) -> tuple[AgentSettings, list[dict]]:
@@ -21,53 +28,198 @@ def load_config(path: str) -> tuple[AgentSettings, list[dict]]:
         data = yaml.safe_load(f)
     a = data.get("agent", {})
     apps = data.get("apps", [])
-    settings = AgentSettings(id=a["id"], server_url=a["server_url"], poll_interval=a.get("poll_interval", 30), psk=a["psk"])
+    settings = AgentSettings(id=a["id"], server_url=a["server_url"], poll_interval=a.get("poll_interval", 30), psk=a["psk"], max_concurrent_checks=a.get("max_concurrent_checks", 4), max_concurrent_commands=a.get("max_concurrent_commands", 2), wire_encoding=a.get("wire_encoding", "auto"))
     return settings, apps
 
 
-async def send_heartbeat(client: httpx.AsyncClient, settings: AgentSettings, apps_cfg: list[dict]) -> None:
+# os_update keys that change on every beat: they ride along with real changes
+# and periodic full beats instead of forcing a delta on their own
+VOLATILE_OS_KEYS = {"uptime_seconds"}
+FULL_BEAT_EVERY = 20
+
+
+class HeartbeatState:
+    """State last acknowledged by the server, used to build delta heartbeats."""
+
+    def __init__(self) -> None:
+        self.hash: str | None = None
+        self.apps: dict[str, dict] = {}
+        self.os_update: dict[str, Any] = {}
+        self.beats_since_full = 0
+
+
+async def send_heartbeat(client: httpx.AsyncClient, settings: AgentSettings, apps_cfg: list[dict], hb_state: HeartbeatState | None = None) -> dict:
+    apps = collect_apps_state(apps_cfg)
+    os_update = collect_os_update_status()
     payload: dict[str, Any] = {
         "agent_id": settings.id,
-        "apps": collect_apps_state(apps_cfg),
         "logs": [],
     }
     # Agent software version (prefer env override, else module/package version)
     agent_version = os.environ.get("AGENT_VERSION") or "1.0.0"
     payload["agent_version"] = agent_version
-    payload["os_update"] = collect_os_update_status()
-    body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
-    sig = sign_bytes(body, settings.psk)
-    headers = {"X-Agent-Id": settings.id, "X-Signature": sig, "Content-Type": "application/json"}
+    payload["poll_interval"] = settings.poll_interval
+    full = (
+        hb_state is None
+        or hb_state.hash is None
+        or hb_state.beats_since_full >= FULL_BEAT_EVERY
+        or any(k not in os_update for k in hb_state.os_update)
+    )
+    os_changed: dict[str, Any] = {}
+    if full:
+        payload["apps"] = apps
+        payload["os_update"] = os_update
+    else:
+        # delta against the acknowledged state; nothing changed -> liveness-only beat
+        payload["base"] = hb_state.hash
+        apps_changed = {k: v for k, v in apps.items() if hb_state.apps.get(k) != v}
+        apps_removed = [k for k in hb_state.apps if k not in apps]
+        os_changed = {k: v for k, v in os_update.items() if k not in VOLATILE_OS_KEYS and hb_state.os_update.get(k) != v}
+        if apps_changed:
+            payload["apps_changed"] = apps_changed
+        if apps_removed:
+            payload["apps_removed"] = apps_removed
+        if os_changed:
+            os_changed.update({k: os_update[k] for k in VOLATILE_OS_KEYS if k in os_update})
+            payload["os_update_changed"] = os_changed
+    body, headers = wire.encode(payload)
+    headers.update({"X-Agent-Id": settings.id, "X-Signature": sign_bytes(body, settings.psk)})
     url = settings.server_url.rstrip("/") + "/api/heartbeat"
     r = await client.post(url, content=body, headers=headers, timeout=20)
+    if r.status_code == 415 and not wire.plain:
+        # server can no longer decode what it advertised (downgrade): back to JSON
+        wire.reset()
+        return await send_heartbeat(client, settings, apps_cfg, hb_state)
     r.raise_for_status()
+    try:
+        ack = r.json()
+    except ValueError:
+        ack = {}
+    wire.negotiate(ack.get("accept"))
+    if hb_state is not None:
+        if ack.get("status") == "resync":
+            # server lost or never had our base state: send everything now
+            hb_state.hash = None
+            return await send_heartbeat(client, settings, apps_cfg, hb_state)
+        hb_state.hash = ack.get("state")  # None for servers without delta support
+        hb_state.apps = apps
+        if full or os_changed:
+            hb_state.os_update = os_update
+        hb_state.beats_since_full = 0 if full else hb_state.beats_since_full + 1
+    return ack
 
 
-async def main():
-    cfg_path = os.environ.get("AGENT_CONFIG", os.path.join(os.path.dirname(__file__), "config.example.yaml"))
-    settings, apps_cfg = load_config(cfg_path)
-    async with httpx.AsyncClient() as client:
+async def poll_command(client: httpx.AsyncClient, settings: AgentSettings, wait: int = 0) -> dict | None:
+    url = settings.server_url.rstrip("/") + f"/api/agents/{settings.id}/next-command"
+    sig = sign_bytes(b"{}", settings.psk)
+    params = {"wait": wait} if wait > 0 else None
+    r = await client.get(url, params=params, headers={"X-Agent-Id": settings.id, "X-Signature": sig}, timeout=20 + wait)
+    r.raise_for_status()
+    return r.json().get("command")
+
+
+# commands of these types share a lock like app deploys do (one dpkg at a time)
+SYSTEM_LOCKS = {"apt_upgrade": "apt"}
+
+
+class AgentRuntime:
+    """Heartbeats, command polling and command execution as independent tasks.
+
+    Heartbeats keep their ``poll_interval`` cadence whatever runs. The poller
+    only claims a command when one of ``max_concurrent_commands`` slots is
+    free (a claim starts the server-side lease); each command then runs in
+    its own task, holding the lock of its app (``apps`` entries of the YAML)
+    so two deploys of one app never overlap.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, settings: AgentSettings, apps_cfg: list[dict]) -> None:
+        self.client = client
+        self.settings = settings
+        self.apps_cfg = apps_cfg
+        self.hb_state = HeartbeatState()
+        # Long-poll hold advertised by the server in heartbeat responses (0 = plain polling)
+        self.long_poll = 0
+        self._first_beat = asyncio.Event()
+        self._slots = asyncio.Semaphore(max(1, settings.max_concurrent_commands))
+        self._locks: dict[str, asyncio.Lock] = {a.get("name") or "app": asyncio.Lock() for a in apps_cfg}
+        self._locks.update({key: asyncio.Lock() for key in SYSTEM_LOCKS.values()})
+        self.running: dict[str, asyncio.Task] = {}
+
+    def _lock_for(self, cmd: dict) -> asyncio.Lock | None:
+        return self._locks.get(SYSTEM_LOCKS.get(cmd.get("command"), cmd.get("app")))
+
+    async def heartbeats(self) -> None:
+        loop = asyncio.get_running_loop()
         while True:
+            start = loop.time()
             try:
-                await send_heartbeat(client, settings, apps_cfg)
+                ack = await send_heartbeat(self.client, self.settings, self.apps_cfg, self.hb_state)
+                self.long_poll = int(ack.get("long_poll") or 0)
             except Exception as e:
                 print(f"heartbeat error: {e}")
-            # poll for command
+            self._first_beat.set()
+            await asyncio.sleep(max(0.0, self.settings.poll_interval - (loop.time() - start)))
+
+    async def commands(self) -> None:
+        await self._first_beat.wait()  # learn the long-poll hold first
+        while True:
+            await self._slots.acquire()
             try:
-                url = settings.server_url.rstrip("/") + f"/api/agents/{settings.id}/next-command"
-                sig = sign_bytes(b"{}", settings.psk)
-                r = await client.get(url, headers={"X-Agent-Id": settings.id, "X-Signature": sig}, timeout=20)
-                r.raise_for_status()
-                data = r.json()
-                cmd = data.get("command")
-                if cmd:
-                    await execute_command(client, settings, cmd)
+                # with long-poll the request itself waits for work
+                cmd = await poll_command(self.client, self.settings, self.long_poll)
             except Exception as e:
+                self._slots.release()
                 print(f"command poll error: {e}")
-            await asyncio.sleep(settings.poll_interval)
+                await asyncio.sleep(self.settings.poll_interval)
+                continue
+            if not cmd:
+                self._slots.release()
+                if not self.long_poll:
+                    await asyncio.sleep(self.settings.poll_interval)
+                continue
+            command_id = cmd.get("command_id") or "unknown"
+            self.running[command_id] = asyncio.create_task(self._execute(command_id, cmd))
 
+    async def _execute(self, command_id: str, cmd: dict) -> None:
+        try:
+            lock = self._lock_for(cmd)
+            if lock is None:
+                await execute_command(self.client, self.settings, cmd)
+            else:
+                async with lock:
+                    await execute_command(self.client, self.settings, cmd)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"command {command_id} error: {e}")
+        finally:
+            self.running.pop(command_id, None)
+            self._slots.release()
 
- 
+    async def run(self) -> None:
+        tasks = [asyncio.create_task(self.heartbeats()), asyncio.create_task(self.commands())]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # shutdown: stop claiming, cancel running commands (each reports "cancelled")
+            for t in tasks + list(self.running.values()):
+                t.cancel()
+            await asyncio.gather(*tasks, *self.running.values(), return_exceptions=True)
+
+
+async def main():
+    cfg_path = os.environ.get("AGENT_CONFIG", os.path.join(os.path.dirname(__file__), "config.example.yaml"))
+    settings, apps_cfg = load_config(cfg_path)
+    wire.enabled = settings.wire_encoding != "json"
+    # SIGTERM (systemd stop) shuts down like Ctrl-C: running commands are cancelled and reported
+    main_task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+    # app checks and OS probes run in the background; the first heartbeat waits briefly for them
+    collector = start_apps_collector(apps_cfg, max_concurrent=settings.max_concurrent_checks)
+    max_wait = min(5.0, settings.poll_interval)
+    await asyncio.gather(collector.prime(max_wait=max_wait), prime_os_status(max_wait=max_wait))
+    async with httpx.AsyncClient() as client:
+        await AgentRuntime(client, settings, apps_cfg).run()
 
 
 async def execute_command(client: httpx.AsyncClient, settings: AgentSettings, cmd: dict):
@@ -84,29 +236,50 @@ async def execute_command(client: httpx.AsyncClient, settings: AgentSettings, cm
         commands = [
             "sudo -n apt -v || true",
         ]
+    # whole command, all steps; none unless the payload sets one (an upgrade may take long)
+    timeout = int(cmd["timeout"]) if cmd.get("timeout") else None
     start = asyncio.get_event_loop().time()
     outputs: list[str] = []
     status = "success"
-    for c in commands:
-        try:
-            async def post_chunk(text: str):
-                payload = {"command_id": command_id, "chunk": text}
-                body = json.dumps(payload).encode("utf-8")
-                s = sign_bytes(body, settings.psk)
-                await client.post(settings.server_url.rstrip("/") + "/api/command-chunk", content=body, headers={"Content-Type":"application/json","X-Agent-Id": settings.id, "X-Signature": s}, timeout=30)
-
-            await post_chunk(f"$ {c}\n")
-            for line in stream_command(c):
-                outputs.append(line)
-                await post_chunk(line)
-        except Exception as e:
-            status = "failed"
-            err = f"[ERROR] {e}\n"
-            outputs.append(err)
-            body = json.dumps({"command_id": command_id, "chunk": err}).encode("utf-8")
-            s = sign_bytes(body, settings.psk)
-            await client.post(settings.server_url.rstrip("/") + "/api/command-chunk", content=body, headers={"Content-Type":"application/json","X-Agent-Id": settings.id, "X-Signature": s}, timeout=30)
-            break
+    exit_code = None
+    cancelled = False
+    batcher = ChunkBatcher(client, settings, command_id, cmd.get("attempt"))
+    batcher.start()
+    try:
+        async with asyncio.timeout(timeout):
+            for c in commands:
+                try:
+                    batcher.write(f"$ {c}\n")
+                    async for line in stream_command(c):
+                        outputs.append(line)
+                        batcher.write(line)
+                        if line.startswith("[EXIT "):
+                            exit_code = int(line[6:].rstrip().rstrip("]"))
+                    if exit_code:
+                        # like run_commands: a failing step stops the sequence
+                        status = "failed"
+                        break
+                except Exception as e:
+                    status = "failed"
+                    err = f"[ERROR] {e}\n"
+                    outputs.append(err)
+                    batcher.write(err)
+                    break
+    except TimeoutError:
+        # the running step was stopped (SIGTERM, then SIGKILL) by stream_command on cancellation
+        status = "timeout"
+        msg = f"[TIMEOUT] command exceeded {timeout}s\n"
+        outputs.append(msg)
+        batcher.write(msg)
+    except asyncio.CancelledError:
+        # agent shutting down: still report the outcome, then let the cancellation through
+        asyncio.current_task().uncancel()
+        cancelled = True
+        status = "cancelled"
+        outputs.append("[CANCELLED]\n")
+        batcher.write("[CANCELLED]\n")
+    finally:
+        await batcher.close()
 
     duration = int(asyncio.get_event_loop().time() - start)
     result_payload = {
@@ -114,11 +287,14 @@ async def execute_command(client: httpx.AsyncClient, settings: AgentSettings, cm
         "status": status,
         "output": outputs,
         "duration": duration,
+        "exit_code": exit_code,
         "logs": "".join(outputs)[-4000:],
     }
-    body = json.dumps(result_payload).encode("utf-8")
-    s = sign_bytes(body, settings.psk)
-    await client.post(settings.server_url.rstrip("/") + "/api/command-result", content=body, headers={"Content-Type":"application/json","X-Agent-Id": settings.id, "X-Signature": s}, timeout=60)
+    body, headers = wire.encode(result_payload)
+    headers.update({"X-Agent-Id": settings.id, "X-Signature": sign_bytes(body, settings.psk)})
+    await client.post(settings.server_url.rstrip("/") + "/api/command-result", content=body, headers=headers, timeout=10 if cancelled else 60)
+    if cancelled:
+        raise asyncio.CancelledError
 
 if __name__ == "__main__":
     asyncio.run(main())
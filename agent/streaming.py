@@ -0,0 +1,105 @@
+import asyncio
+from typing import Any
+import httpx
+from crypto_hmac import sign_bytes
+from wire import wire
+
+
+class ChunkBatcher:
+    """Buffers command output and ships it in signed, sequenced batches.
+
+    A batch is flushed once ``max_bytes`` are buffered or ``max_delay``
+    seconds after its first line, whichever comes first. Chunks that fail to
+    send are kept (up to ``max_pending``) and resent with the next batch; the
+    server ignores sequence numbers it already stored for this ``attempt``
+    (the claim being run, as returned by next-command).
+    """
+
+    def __init__(self, client: httpx.AsyncClient, settings: Any, command_id: str, attempt: int | None = None, max_bytes: int = 64 * 1024, max_delay: float = 0.2, max_pending: int = 256) -> None:
+        self.client = client
+        self.settings = settings
+        self.command_id = command_id
+        self.attempt = attempt
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.batch_endpoint = True  # falls back to /api/command-chunk on older servers
+        self.requests = 0
+        self._buf: list[str] = []
+        self._size = 0
+        self._seq = 0
+        self._pending: list[dict[str, Any]] = []
+        self._has_data = asyncio.Event()
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def write(self, text: str) -> None:
+        self._buf.append(text)
+        self._size += len(text)
+        self._has_data.set()
+        if self._size >= self.max_bytes:
+            self._full.set()
+
+    async def _run(self) -> None:
+        while True:
+            await self._has_data.wait()
+            try:
+                async with asyncio.timeout(self.max_delay):
+                    await self._full.wait()
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"chunk flush error: {e}")
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"chunk flush error: {e}")
+
+    async def flush(self) -> None:
+        async with self._lock:
+            self._has_data.clear()
+            self._full.clear()
+            if self._buf:
+                self._seq += 1
+                self._pending.append({"seq": self._seq, "chunk": "".join(self._buf)})
+                self._buf, self._size = [], 0
+                if len(self._pending) > self.max_pending:
+                    del self._pending[: len(self._pending) - self.max_pending]
+            if not self._pending:
+                return
+            if self.batch_endpoint:
+                batch: dict[str, Any] = {"command_id": self.command_id, "chunks": self._pending}
+                if self.attempt is not None:
+                    batch["attempt"] = self.attempt
+                r = await self._post("/api/command-chunks", batch)
+                if r.status_code == 404:
+                    self.batch_endpoint = False
+                else:
+                    r.raise_for_status()
+                    self._pending.clear()
+                    return
+            while self._pending:
+                r = await self._post("/api/command-chunk", {"command_id": self.command_id, "chunk": self._pending[0]["chunk"]})
+                r.raise_for_status()
+                self._pending.pop(0)
+
+    async def _post(self, path: str, payload: dict) -> httpx.Response:
+        body, headers = wire.encode(payload)
+        headers.update({"X-Agent-Id": self.settings.id, "X-Signature": sign_bytes(body, self.settings.psk)})
+        self.requests += 1
+        return await self.client.post(self.settings.server_url.rstrip("/") + path, content=body, headers=headers, timeout=30)
@@ -0,0 +1,105 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import main as agent_main
+from main import FULL_BEAT_EVERY, AgentSettings, HeartbeatState, send_heartbeat
+
+
+class FakeServer:
+    """Records heartbeat bodies and answers with a scripted ack."""
+
+    def __init__(self) -> None:
+        self.bodies: list[dict] = []
+        self.resync_next = False
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.bodies.append(json.loads(request.content))
+        if self.resync_next:
+            self.resync_next = False
+            return httpx.Response(200, json={"status": "resync"})
+        return httpx.Response(200, json={"status": "ok", "state": f"h{len(self.bodies)}"})
+
+
+@pytest.fixture
+def reported(monkeypatch):
+    state = {
+        "apps": {"web": {"current": "a1", "health": "ok"}, "api": {"current": "b1", "health": "ok"}},
+        "os_update": {"upgrades": 0, "uptime_seconds": 10},
+    }
+    monkeypatch.setattr(agent_main, "collect_apps_state", lambda cfg: json.loads(json.dumps(state["apps"])))
+    monkeypatch.setattr(agent_main, "collect_os_update_status", lambda: dict(state["os_update"]))
+    return state
+
+
+@pytest.fixture
+def server():
+    return FakeServer()
+
+
+def beat(server: FakeServer, hb: HeartbeatState) -> dict:
+    settings = AgentSettings(id="agent-1", server_url="http://server", psk="k", poll_interval=30)
+
+    async def run() -> dict:
+        async with httpx.AsyncClient(transport=httpx.MockTransport(server)) as client:
+            await send_heartbeat(client, settings, [], hb)
+        return server.bodies[-1]
+
+    return asyncio.run(run())
+
+
+def test_first_beat_is_full_then_deltas(reported, server):
+    hb = HeartbeatState()
+    first = beat(server, hb)
+    assert first["apps"] == reported["apps"] and "base" not in first
+    assert hb.hash == "h1"
+
+    second = beat(server, hb)
+    assert second["base"] == "h1"
+    assert "apps" not in second and "apps_changed" not in second and "os_update_changed" not in second
+
+
+def test_volatile_os_keys_ride_along_with_real_changes(reported, server):
+    hb = HeartbeatState()
+    beat(server, hb)
+    reported["os_update"]["uptime_seconds"] = 20
+    assert "os_update_changed" not in beat(server, hb)
+
+    reported["os_update"]["upgrades"] = 3
+    body = beat(server, hb)
+    assert body["os_update_changed"] == {"upgrades": 3, "uptime_seconds": 20}
+
+
+def test_apps_removed_and_changed(reported, server):
+    hb = HeartbeatState()
+    beat(server, hb)
+    del reported["apps"]["api"]
+    reported["apps"]["web"]["current"] = "a2"
+    body = beat(server, hb)
+    assert body["apps_removed"] == ["api"]
+    assert body["apps_changed"] == {"web": {"current": "a2", "health": "ok"}}
+    assert hb.apps == reported["apps"]
+
+
+def test_resync_resends_a_full_beat(reported, server):
+    hb = HeartbeatState()
+    beat(server, hb)
+    server.resync_next = True
+    last = beat(server, hb)
+    assert "base" in server.bodies[-2]
+    assert last["apps"] == reported["apps"] and "base" not in last
+    assert hb.hash == f"h{len(server.bodies)}"
+    assert hb.beats_since_full == 0
+
+
+def test_periodic_full_beat(reported, server):
+    hb = HeartbeatState()
+    beat(server, hb)
+    for _ in range(FULL_BEAT_EVERY):
+        assert "base" in beat(server, hb)
+    assert hb.beats_since_full == FULL_BEAT_EVERY
+    body = beat(server, hb)
+    assert "base" not in body and body["apps"] == reported["apps"]
+    assert hb.beats_since_full == 0
@@ -0,0 +1,68 @@
+import gzip
+import json
+from typing import Any
+
+try:  # optional: compact binary encoding
+    import msgpack
+except ImportError:  # pragma: no cover - depends on environment
+    msgpack = None
+
+try:  # optional: faster and smaller than gzip
+    import zstandard
+except ImportError:  # pragma: no cover - depends on environment
+    zstandard = None
+
+
+class WireFormat:
+    """Encoding of request bodies sent to the server.
+
+    Plain JSON until the server advertises what it can decode (``accept`` in
+    the heartbeat ack); then the most compact format and encoding both sides
+    support. Bodies under ``min_compress`` bytes are not compressed. The
+    HMAC is computed by the caller over the returned (encoded) bytes.
+    """
+
+    def __init__(self, enabled: bool = True, min_compress: int = 1024) -> None:
+        self.enabled = enabled
+        self.min_compress = min_compress
+        self.format = "json"
+        self.encoding = "identity"
+
+    def negotiate(self, accept: Any) -> None:
+        if not self.enabled or not isinstance(accept, dict):
+            return
+        formats = accept.get("formats") or []
+        encodings = accept.get("encodings") or []
+        self.format = "msgpack" if msgpack is not None and "msgpack" in formats else "json"
+        if zstandard is not None and "zstd" in encodings:
+            self.encoding = "zstd"
+        elif "gzip" in encodings:
+            self.encoding = "gzip"
+        else:
+            self.encoding = "identity"
+
+    @property
+    def plain(self) -> bool:
+        return self.format == "json" and self.encoding == "identity"
+
+    def reset(self) -> None:
+        """Back to plain JSON (e.g. the server rejected an encoded body)."""
+        self.format, self.encoding = "json", "identity"
+
+    def encode(self, payload: Any) -> tuple[bytes, dict[str, str]]:
+        if self.format == "msgpack":
+            body = msgpack.packb(payload, use_bin_type=True)
+            headers = {"Content-Type": "application/msgpack"}
+        else:
+            body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+            headers = {"Content-Type": "application/json"}
+        if self.encoding != "identity" and len(body) >= self.min_compress:
+            if self.encoding == "zstd":
+                body = zstandard.ZstdCompressor(level=3).compress(body)
+            else:
+                body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = self.encoding
+        return body, headers
+
+
+wire = WireFormat()
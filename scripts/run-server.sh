@@ -34,4 +34,9 @@ pip install --upgrade pip >/dev/null
 pip install -r server/requirements.txt
 
 export PYTHONPATH=server
+# WEB_CONCURRENCY>1 runs several workers (uvicorn reads it); they share events
+# through BUS_URL (default: a SQLite bus next to the database). --reload is single-process only.
+if [ "${WEB_CONCURRENCY:-1}" -gt 1 ]; then
+  exec uvicorn app.main:app --host 0.0.0.0 --port 8000
+fi
 exec uvicorn app.main:app --reload --host 0.0.0.0 --port 8000
@@ -13,6 +13,56 @@ class Settings(BaseModel):
     jwt_secret: str = os.getenv("JWT_SECRET", "")
     desired_state_repo: str | None = os.getenv("DESIRED_STATE_REPO")
     desired_state_path: str = os.getenv("DESIRED_STATE_PATH", "desired/state.json")
+    # Command queue: a claimed command goes back to pending if the agent
+    # neither streams output nor reports a result before the lease expires.
+    command_lease_seconds: int = int(os.getenv("COMMAND_LEASE_SECONDS", "1800"))
+    command_lease_sweep_seconds: int = int(os.getenv("COMMAND_LEASE_SWEEP_SECONDS", "60"))
+    # Long-poll hold time for next-command (0 disables; advertised to agents)
+    long_poll_seconds: int = int(os.getenv("LONG_POLL_SECONDS", "25"))
+    # Write-behind heartbeat ingestion: flush every N ms or M agents, buffer bounded
+    heartbeat_flush_ms: int = int(os.getenv("HEARTBEAT_FLUSH_MS", "500"))
+    heartbeat_flush_batch: int = int(os.getenv("HEARTBEAT_FLUSH_BATCH", "500"))
+    heartbeat_buffer_max: int = int(os.getenv("HEARTBEAT_BUFFER_MAX", "10000"))
+    # Dashboard WebSocket fan-out: per-client queue bound and lag budget before disconnect
+    ws_max_queue: int = int(os.getenv("WS_MAX_QUEUE", "10000"))
+    ws_lag_budget_seconds: float = float(os.getenv("WS_LAG_BUDGET_SECONDS", "30"))
+    # Database: connection pool size (also the number of DB worker threads used
+    # by async handlers) and the SQLite profile applied to every connection
+    db_pool_size: int = int(os.getenv("DB_POOL_SIZE", "8"))
+    # threads running sync (def) handlers; each may hold one more connection
+    db_sync_threads: int = int(os.getenv("DB_SYNC_THREADS", "40"))
+    sqlite_busy_timeout_ms: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    sqlite_cache_mb: int = int(os.getenv("SQLITE_CACHE_MB", "64"))
+    sqlite_mmap_mb: int = int(os.getenv("SQLITE_MMAP_MB", "256"))
+    # Command history retention, opt-in: the job runs only with an interval > 0,
+    # and then only archives unless a delete rule is set (0 disables a rule).
+    # Finished commands older than KEEP_DAYS or beyond MAX_PER_AGENT are deleted,
+    # except the last KEEP_PER_TYPE of each command type per agent; output is
+    # compressed into archives ARCHIVE_AFTER_HOURS after completion.
+    retention_interval_seconds: int = int(os.getenv("RETENTION_INTERVAL_SECONDS", "0"))
+    retention_keep_days: int = int(os.getenv("RETENTION_KEEP_DAYS", "0"))
+    retention_max_per_agent: int = int(os.getenv("RETENTION_MAX_PER_AGENT", "0"))
+    retention_keep_per_type: int = int(os.getenv("RETENTION_KEEP_PER_TYPE", "5"))
+    retention_archive_after_hours: int = int(os.getenv("RETENTION_ARCHIVE_AFTER_HOURS", "24"))
+    retention_codec: str = os.getenv("RETENTION_CODEC", "")  # zstd | gzip; empty = zstd if installed
+    # Agent request bodies: cap on the decompressed size (gzip/zstd Content-Encoding)
+    agent_max_body_bytes: int = int(os.getenv("AGENT_MAX_BODY_BYTES", str(16 * 1024 * 1024)))
+    # Offline detection: an agent is offline once no heartbeat arrived for
+    # max(OFFLINE_MIN_SECONDS, OFFLINE_AFTER_INTERVALS x its reported poll interval)
+    offline_after_intervals: float = float(os.getenv("OFFLINE_AFTER_INTERVALS", "3"))
+    offline_min_seconds: int = int(os.getenv("OFFLINE_MIN_SECONDS", "60"))
+    agent_default_poll_interval: int = int(os.getenv("AGENT_DEFAULT_POLL_INTERVAL", "30"))  # agents not reporting one
+    # Cross-worker event bus: "local" (single worker), "sqlite:///path" (workers on
+    # one host) or "redis://[:password@]host[:port][/db]" (any Redis-protocol server).
+    # Empty: local, or a SQLite bus next to the database when WEB_CONCURRENCY > 1.
+    bus_url: str = os.getenv("BUS_URL", "")
+    # Hot-path instrumentation (route/DB timing histograms, event-loop lag), served by
+    # /api/metrics/instrumentation; off by default, nothing is hooked when disabled
+    instrumentation: bool = os.getenv("INSTRUMENTATION", "").lower() in ("1", "true", "yes")
+    # On-demand sampling profiler (/api/debug/profile)
+    profiler_enabled: bool = os.getenv("PROFILER_ENABLED", "").lower() in ("1", "true", "yes")
+    # Optional static bearer token for Prometheus scrapes of /api/metrics/prometheus
+    metrics_token: str | None = os.getenv("METRICS_TOKEN")
 
 
 settings = Settings()
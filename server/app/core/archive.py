@@ -0,0 +1,75 @@
+import gzip
+import json
+import threading
+from collections import OrderedDict
+from typing import Optional
+from sqlmodel import Session, select
+from ..db.models import CommandArchive
+
+try:  # optional: better ratio and much faster than gzip
+    import zstandard
+except ImportError:  # pragma: no cover - depends on environment
+    zstandard = None
+
+Chunk = tuple[int, str]
+
+
+def default_codec() -> str:
+    return "zstd" if zstandard is not None else "gzip"
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd codec requires the 'zstandard' package")
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    if codec == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    raise ValueError(f"unknown codec: {codec}")
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd codec requires the 'zstandard' package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "gzip":
+        return gzip.decompress(data)
+    raise ValueError(f"unknown codec: {codec}")
+
+
+def pack(chunks: list[Chunk], codec: str) -> tuple[bytes, int]:
+    raw = json.dumps(chunks).encode("utf-8")
+    return compress(raw, codec), len(raw)
+
+
+class ArchiveReader:
+    """Decoded archives of recently read commands (a stream pages through one)."""
+
+    def __init__(self, max_cached: int = 8) -> None:
+        self.max_cached = max_cached
+        self._cache: OrderedDict[str, list[Chunk]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, session: Session, command_id: str) -> Optional[list[Chunk]]:
+        with self._lock:
+            hit = self._cache.get(command_id)
+            if hit is not None:
+                self._cache.move_to_end(command_id)
+                return hit
+        row = session.exec(select(CommandArchive.codec, CommandArchive.data).where(CommandArchive.command_id == command_id)).first()
+        if row is None:
+            return None
+        chunks = [(seq, data) for seq, data in json.loads(decompress(row[1], row[0]))]
+        with self._lock:
+            self._cache[command_id] = chunks
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+        return chunks
+
+    def forget(self, command_id: str) -> None:
+        with self._lock:
+            self._cache.pop(command_id, None)
+
+
+archive_reader = ArchiveReader()
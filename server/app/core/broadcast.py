@@ -0,0 +1,107 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+from fastapi import WebSocket
+
+
+class WsClient:
+    """One dashboard connection: a bounded, coalescing send queue and its writer task."""
+
+    def __init__(self, ws: WebSocket) -> None:
+        self.ws = ws
+        # key -> (encoded message, enqueued at); a newer message with the same
+        # key replaces the queued one in place (latest agent state wins)
+        self.queue: OrderedDict[Any, tuple[str, float]] = OrderedDict()
+        self.wake = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.coalesced = 0
+
+
+class WsBroadcaster:
+    """Fan-out of dashboard messages without awaiting any client.
+
+    ``publish`` encodes once and only enqueues; each client is drained by its
+    own writer task, so a slow dashboard never delays the publisher. Clients
+    whose queue exceeds ``max_queue`` or whose oldest queued message is older
+    than ``lag_budget`` seconds are disconnected.
+    """
+
+    def __init__(self, max_queue: int = 10000, lag_budget: float = 30.0) -> None:
+        self.max_queue = max_queue
+        self.lag_budget = lag_budget
+        self.clients: set[WsClient] = set()
+        self.dropped = 0
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self.clients)
+
+    def lag(self, client: WsClient, now: float) -> float:
+        if not client.queue:
+            return 0.0
+        return now - next(iter(client.queue.values()))[1]
+
+    def register(self, ws: WebSocket) -> WsClient:
+        client = WsClient(ws)
+        client.task = asyncio.create_task(self._writer(client))
+        self.clients.add(client)
+        return client
+
+    def unregister(self, client: WsClient) -> None:
+        self.clients.discard(client)
+        if client.task is not None and client.task is not asyncio.current_task():
+            client.task.cancel()
+
+    def publish(self, message: dict, key: Any = None) -> None:
+        if not self.clients:
+            return
+        text = json.dumps(message)
+        if key is None:
+            key = next(self._seq)  # not coalescable
+        now = time.monotonic()
+        for client in list(self.clients):
+            queued = client.queue.get(key)
+            if queued is not None:
+                client.queue[key] = (text, queued[1])
+                client.coalesced += 1
+                continue
+            if len(client.queue) >= self.max_queue or self.lag(client, now) > self.lag_budget:
+                self._drop(client)
+                continue
+            client.queue[key] = (text, now)
+            client.wake.set()
+
+    def _drop(self, client: WsClient) -> None:
+        self.dropped += 1
+        self.unregister(client)
+        asyncio.create_task(self._close(client.ws))
+
+    @staticmethod
+    async def _close(ws: WebSocket) -> None:
+        try:
+            await ws.close(code=1013)  # try again later
+        except Exception:
+            pass
+
+    async def _writer(self, client: WsClient) -> None:
+        try:
+            while True:
+                await client.wake.wait()
+                client.wake.clear()
+                while client.queue and client in self.clients:
+                    _, (text, _) = client.queue.popitem(last=False)
+                    # asyncio.timeout rather than wait_for: the latter can swallow
+                    # our cancellation when the send completes at the same moment
+                    async with asyncio.timeout(self.lag_budget):
+                        await client.ws.send_text(text)
+                    client.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # send failed or timed out: connection is gone or hopeless
+            self.clients.discard(client)
+            await self._close(client.ws)
@@ -0,0 +1,498 @@
+import abc
+import asyncio
+import json
+import sqlite3
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Optional
+from urllib.parse import unquote, urlparse
+
+# handler(channel, data) for events published by other workers
+Handler = Callable[[str, Any], Awaitable[None]]
+
+
+class Bus(abc.ABC):
+    """Cross-worker event bus plus a small expiring key/value store.
+
+    ``publish`` never blocks and may be called from worker threads; events
+    reach every *other* worker's handler (the publisher applies its own
+    change directly). Delivery is best effort: a worker that is down or
+    too far behind misses events, which only costs freshness of in-memory
+    views (agents resync on the next heartbeat). The key/value side backs
+    state that must be shared exactly, such as login rate limits.
+    """
+
+    shared = False  # True when other processes receive what is published
+
+    def __init__(self) -> None:
+        self.origin = uuid.uuid4().hex[:12]
+        self.published = 0
+        self.received = 0
+        self._handler: Optional[Handler] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def start(self, handler: Handler) -> None:
+        self._handler = handler
+        self._loop = asyncio.get_running_loop()
+
+    async def stop(self) -> None:
+        pass
+
+    def publish(self, channel: str, data: Any) -> None:
+        pass
+
+    async def _deliver(self, raw: str | bytes) -> None:
+        try:
+            msg = json.loads(raw)
+            if msg.get("o") == self.origin or self._handler is None:
+                return
+            self.received += 1
+            await self._handler(msg["c"], msg["d"])
+        except Exception as e:
+            print(f"bus event error: {e}")
+
+    # ---- key/value ----
+
+    @abc.abstractmethod
+    async def incr(self, key: str, ttl: float) -> int:
+        """Increment a counter; ``ttl`` starts with the first increment."""
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abc.abstractmethod
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def delete(self, *keys: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def claim(self, key: str, ttl: float) -> bool:
+        """True for exactly one caller until ``key`` expires (run-once jobs across workers)."""
+
+    @abc.abstractmethod
+    async def release(self, key: str) -> None:
+        """Give up a claim held by this worker before it expires (no-op otherwise)."""
+
+
+class LocalBus(Bus):
+    """Single process: nothing to fan out, key/value kept in memory."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._kv: dict[str, tuple[str, float]] = {}
+
+    def _live(self, key: str) -> Optional[str]:
+        item = self._kv.get(key)
+        if item is None:
+            return None
+        if item[1] <= time.time():
+            del self._kv[key]
+            return None
+        return item[0]
+
+    async def incr(self, key: str, ttl: float) -> int:
+        cur = self._live(key)
+        n = int(cur) + 1 if cur is not None else 1
+        expires = self._kv[key][1] if cur is not None else time.time() + ttl
+        self._kv[key] = (str(n), expires)
+        return n
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._live(key)
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        self._kv[key] = (value, time.time() + ttl)
+
+    async def delete(self, *keys: str) -> None:
+        for k in keys:
+            self._kv.pop(k, None)
+
+    async def claim(self, key: str, ttl: float) -> bool:
+        if self._live(key) is not None:
+            return False
+        self._kv[key] = (self.origin, time.time() + ttl)
+        return True
+
+    async def release(self, key: str) -> None:
+        if self._live(key) == self.origin:
+            del self._kv[key]
+
+
+class _OutboxBus(Bus):
+    """Publishing side shared by the remote backends: a bounded outbox drained by one task."""
+
+    shared = True
+
+    def __init__(self, max_pending: int = 10000) -> None:
+        super().__init__()
+        self.dropped = 0
+        self._outbox: deque[str] = deque()
+        self._max_pending = max_pending
+        self._wake = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    def publish(self, channel: str, data: Any) -> None:
+        if self._loop is None:
+            return
+        if len(self._outbox) >= self._max_pending:
+            self._outbox.popleft()
+            self.dropped += 1
+        self._outbox.append(json.dumps({"o": self.origin, "c": channel, "d": data}, separators=(",", ":")))
+        self.published += 1
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wake.set()
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    @abc.abstractmethod
+    async def _send(self, batch: list[str]) -> None:
+        ...
+
+    async def _sender(self) -> None:
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            while self._outbox:
+                batch = [self._outbox.popleft() for _ in range(min(len(self._outbox), 500))]
+                try:
+                    await self._send(batch)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"bus publish error: {e}")
+                    self.dropped += len(batch)
+                    await asyncio.sleep(1.0)
+
+    async def stop(self) -> None:
+        # push out what is queued, then stop listening
+        if self._outbox:
+            batch = list(self._outbox)
+            self._outbox.clear()
+            try:
+                await self._send(batch)
+            except Exception:
+                pass
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+
+class SqliteBus(_OutboxBus):
+    """Workers on one host sharing a small SQLite file (WAL).
+
+    Events are rows read by every worker with an indexed ``id > cursor``
+    poll and pruned after ``retention`` seconds. The file is separate from
+    the application database so the bus never contends for its write lock.
+    """
+
+    def __init__(self, path: str, poll_interval: float = 0.02, retention: float = 60.0) -> None:
+        super().__init__()
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._conn: Optional[sqlite3.Connection] = None
+        # one thread owns the connection; bus I/O never takes a DB pool thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bus")
+        self._cursor = 0
+
+    async def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _open(self) -> int:
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS bus_event (id INTEGER PRIMARY KEY AUTOINCREMENT, created REAL NOT NULL, body TEXT NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_bus_event_created ON bus_event (created)")
+        conn.execute("CREATE TABLE IF NOT EXISTS bus_kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+        self._conn = conn
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM bus_event").fetchone()[0]
+
+    def _insert(self, batch: list[str]) -> None:
+        now = time.time()
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany("INSERT INTO bus_event (created, body) VALUES (?, ?)", [(now, b) for b in batch])
+
+    def _fetch(self, after: int) -> list[tuple[int, str]]:
+        return self._conn.execute("SELECT id, body FROM bus_event WHERE id > ? ORDER BY id LIMIT 1000", (after,)).fetchall()
+
+    def _prune(self) -> None:
+        now = time.time()
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("DELETE FROM bus_event WHERE created < ?", (now - self.retention,))
+            self._conn.execute("DELETE FROM bus_kv WHERE expires <= ?", (now,))
+
+    async def start(self, handler: Handler) -> None:
+        await super().start(handler)
+        self._cursor = await self._run(self._open)  # no replay of older events
+        self._tasks = [asyncio.create_task(self._sender()), asyncio.create_task(self._poller())]
+
+    async def stop(self) -> None:
+        await super().stop()
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+    async def _send(self, batch: list[str]) -> None:
+        await self._run(self._insert, batch)
+
+    async def _poller(self) -> None:
+        pruned = time.monotonic()
+        while True:
+            try:
+                rows = await self._run(self._fetch, self._cursor)
+                for rid, body in rows:
+                    self._cursor = rid
+                    await self._deliver(body)
+                if time.monotonic() - pruned > self.retention / 4:
+                    pruned = time.monotonic()
+                    await self._run(self._prune)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"bus poll error: {e}")
+                rows = []
+            if len(rows) < 1000:
+                await asyncio.sleep(self.poll_interval)
+
+    # ---- key/value ----
+
+    def _kv_incr(self, key: str, ttl: float) -> int:
+        now = time.time()
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            row = self._conn.execute("SELECT value, expires FROM bus_kv WHERE key = ? AND expires > ?", (key, now)).fetchone()
+            n, expires = (int(row[0]) + 1, row[1]) if row else (1, now + ttl)
+            self._conn.execute("INSERT OR REPLACE INTO bus_kv (key, value, expires) VALUES (?, ?, ?)", (key, str(n), expires))
+        return n
+
+    def _kv_get(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM bus_kv WHERE key = ? AND expires > ?", (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def _kv_set(self, key: str, value: str, ttl: float) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO bus_kv (key, value, expires) VALUES (?, ?, ?)", (key, value, time.time() + ttl))
+
+    def _kv_delete(self, keys: tuple[str, ...]) -> None:
+        self._conn.executemany("DELETE FROM bus_kv WHERE key = ?", [(k,) for k in keys])
+
+    def _kv_claim(self, key: str, ttl: float) -> bool:
+        now = time.time()
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            if self._conn.execute("SELECT 1 FROM bus_kv WHERE key = ? AND expires > ?", (key, now)).fetchone():
+                return False
+            self._conn.execute("INSERT OR REPLACE INTO bus_kv (key, value, expires) VALUES (?, ?, ?)", (key, self.origin, now + ttl))
+        return True
+
+    def _kv_release(self, key: str) -> None:
+        self._conn.execute("DELETE FROM bus_kv WHERE key = ? AND value = ?", (key, self.origin))
+
+    async def incr(self, key: str, ttl: float) -> int:
+        return await self._run(self._kv_incr, key, ttl)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._run(self._kv_get, key)
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        await self._run(self._kv_set, key, value, ttl)
+
+    async def delete(self, *keys: str) -> None:
+        await self._run(self._kv_delete, keys)
+
+    async def claim(self, key: str, ttl: float) -> bool:
+        return await self._run(self._kv_claim, key, ttl)
+
+    async def release(self, key: str) -> None:
+        await self._run(self._kv_release, key)
+
+
+class RespError(Exception):
+    pass
+
+
+class RespConnection:
+    """Minimal client for the Redis serialization protocol (RESP2)."""
+
+    def __init__(self, host: str, port: int, password: Optional[str] = None, db: int = 0) -> None:
+        self.host, self.port, self.password, self.db = host, port, password, db
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    async def connect(self) -> None:
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._call("AUTH", self.password)
+        if self.db:
+            await self._call("SELECT", self.db)
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    @staticmethod
+    def encode(*args: Any) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for a in args:
+            b = a if isinstance(a, bytes) else str(a).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(b), b))
+        return b"".join(out)
+
+    async def read(self) -> Any:
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RespError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            n = int(rest)
+            if n < 0:
+                return None
+            data = await self.reader.readexactly(n + 2)
+            return data[:-2]
+        if kind == b"*":
+            n = int(rest)
+            return None if n < 0 else [await self.read() for _ in range(n)]
+        raise RespError(f"unexpected reply: {line!r}")
+
+    async def _call(self, *args: Any) -> Any:
+        self.writer.write(self.encode(*args))
+        await self.writer.drain()
+        return await self.read()
+
+    async def call(self, *args: Any) -> Any:
+        async with self._lock:
+            if self.writer is None:
+                await self.connect()
+            try:
+                return await self._call(*args)
+            except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                self.close()  # reconnect on next call
+                raise
+
+    async def pipeline(self, commands: list[tuple[Any, ...]]) -> list[Any]:
+        async with self._lock:
+            if self.writer is None:
+                await self.connect()
+            try:
+                self.writer.write(b"".join(self.encode(*c) for c in commands))
+                await self.writer.drain()
+                return [await self.read() for _ in commands]
+            except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                self.close()
+                raise
+
+
+class RespBus(_OutboxBus):
+    """Redis-protocol backend: PUBLISH/SUBSCRIBE for events, INCR/SET NX for state.
+
+    Speaks plain RESP, so Redis or any compatible server works, across hosts.
+    """
+
+    def __init__(self, url: str, channel: str = "fleetupdate") -> None:
+        super().__init__()
+        u = urlparse(url)
+        self.channel = channel
+        self.prefix = channel + ":"
+        self._params = (u.hostname or "localhost", u.port or 6379, unquote(u.password) if u.password else None, int((u.path or "/0").lstrip("/") or 0))
+        self._cmd = RespConnection(*self._params)
+
+    async def start(self, handler: Handler) -> None:
+        await super().start(handler)
+        await self._cmd.call("PING")  # fail fast on a wrong URL
+        ready = asyncio.get_running_loop().create_future()
+        self._tasks = [asyncio.create_task(self._sender()), asyncio.create_task(self._subscriber(ready))]
+        await ready
+
+    async def stop(self) -> None:
+        await super().stop()
+        self._cmd.close()
+
+    async def _send(self, batch: list[str]) -> None:
+        await self._cmd.pipeline([("PUBLISH", self.channel, body) for body in batch])
+
+    async def _subscriber(self, ready: asyncio.Future) -> None:
+        backoff = 0.5
+        while True:
+            conn = RespConnection(*self._params)
+            try:
+                await conn.connect()
+                conn.writer.write(conn.encode("SUBSCRIBE", self.channel))
+                await conn.writer.drain()
+                await conn.read()  # subscribe confirmation
+                if not ready.done():
+                    ready.set_result(None)
+                backoff = 0.5
+                while True:
+                    msg = await conn.read()
+                    if isinstance(msg, list) and len(msg) == 3 and msg[0] == b"message":
+                        await self._deliver(msg[2])
+            except asyncio.CancelledError:
+                conn.close()
+                raise
+            except Exception as e:
+                print(f"bus subscribe error: {e}")
+                conn.close()
+                if not ready.done():
+                    ready.set_result(None)  # keep serving; retry in the background
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 10.0)
+
+    # ---- key/value ----
+
+    async def incr(self, key: str, ttl: float) -> int:
+        # one transaction: the counter never exists without its expiry
+        k = self.prefix + key
+        replies = await self._cmd.pipeline([("MULTI",), ("SET", k, 0, "NX", "PX", int(ttl * 1000)), ("INCR", k), ("EXEC",)])
+        return replies[-1][1]
+
+    async def get(self, key: str) -> Optional[str]:
+        v = await self._cmd.call("GET", self.prefix + key)
+        return v.decode() if v is not None else None
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        await self._cmd.call("SET", self.prefix + key, value, "PX", int(ttl * 1000))
+
+    async def delete(self, *keys: str) -> None:
+        if keys:
+            await self._cmd.call("DEL", *(self.prefix + k for k in keys))
+
+    async def claim(self, key: str, ttl: float) -> bool:
+        return await self._cmd.call("SET", self.prefix + key, self.origin, "NX", "PX", int(ttl * 1000)) == "OK"
+
+    async def release(self, key: str) -> None:
+        k = self.prefix + key
+        if await self._cmd.call("GET", k) == self.origin.encode():
+            await self._cmd.call("DEL", k)
+
+
+def make_bus(url: str) -> Bus:
+    """``local`` (single worker), ``sqlite:///path`` (one host) or ``redis://[:password@]host[:port][/db]``."""
+    if not url or url == "local":
+        return LocalBus()
+    if url.startswith("sqlite:///"):
+        return SqliteBus(url[len("sqlite:///"):])
+    if url.startswith("redis://"):
+        return RespBus(url)
+    raise ValueError(f"unsupported BUS_URL: {url}")
@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Iterable, Optional
+
+
+class DesiredState:
+    """Parsed desired state: per-group app targets and agent assignments."""
+
+    def __init__(self, data: dict[str, Any]) -> None:
+        groups = data.get("groups") or {}
+        self.assignments: dict[str, str] = dict(data.get("assignments") or {})
+        self.targets: dict[str, dict[str, Any]] = {g: dict((spec or {}).get("apps") or {}) for g, spec in groups.items()}
+
+    def group_of(self, agent_id: str) -> Optional[str]:
+        return self.assignments.get(agent_id)
+
+    def target_apps(self, group: Optional[str]) -> dict[str, Any]:
+        return self.targets.get(group, {}) if group else {}
+
+
+class DesiredStateFile:
+    """Desired state loaded once and reloaded when the file's mtime/inode/size change.
+
+    ``stat`` is checked at most every ``check_interval`` seconds.
+    """
+
+    def __init__(self, path: str, check_interval: float = 1.0) -> None:
+        self.path = path
+        self.check_interval = check_interval
+        self.current = DesiredState({})
+        self._key: Optional[tuple] = None
+        self._checked = 0.0
+
+    def _stat_key(self) -> Optional[tuple]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def poll(self, force: bool = False) -> Optional[DesiredState]:
+        """Return the new DesiredState if the file changed, else None."""
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_interval:
+            return None
+        self._checked = now
+        key = self._stat_key()
+        if key == self._key:
+            return None
+        data: dict[str, Any] = {}
+        if key is not None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except Exception as e:
+                # keep serving the previous state; retry when the file changes again
+                print(f"desired state load error: {e}")
+                self._key = key
+                return None
+        self._key = key
+        self.current = DesiredState(data)
+        return self.current
+
+
+def compute_drift(desired: DesiredState, agent_id: str, apps: dict[str, Any]) -> dict[str, Any]:
+    group = desired.group_of(agent_id)
+    items = []
+    for name, t in desired.target_apps(group).items():
+        av = apps.get(name)
+        # heartbeats report the deployed version as ``current``
+        if av is None or (av.get("version") or av.get("current")) != t.get("version"):
+            items.append({"app": name, "expected": t, "actual": av})
+    return {"agent": agent_id, "group": group, "items": items}
+
+
+class DriftEngine:
+    """Drift per agent, maintained incrementally.
+
+    A heartbeat recomputes only its own agent; a desired state change
+    recomputes only agents whose assignment or group targets changed.
+    ``drift`` and ``app_drift`` are then plain reads.
+    """
+
+    def __init__(self, source: DesiredStateFile) -> None:
+        self.source = source
+        self.apps: dict[str, dict[str, Any]] = {}
+        self.entries: dict[str, dict[str, Any]] = {}
+        self.drifted: set[str] = set()
+        self.app_drift = 0  # drifted (agent, app) pairs fleet-wide
+        self._lock = threading.Lock()
+
+    def _set(self, agent_id: str) -> None:
+        entry = compute_drift(self.source.current, agent_id, self.apps.get(agent_id) or {})
+        old = self.entries.get(agent_id)
+        self.app_drift += len(entry["items"]) - (len(old["items"]) if old else 0)
+        self.entries[agent_id] = entry
+        if entry["items"]:
+            self.drifted.add(agent_id)
+        else:
+            self.drifted.discard(agent_id)
+
+    def _reload(self, force: bool = False) -> None:
+        old = self.source.current
+        new = self.source.poll(force)
+        if new is None:
+            return
+        groups = set(old.targets) | set(new.targets)
+        changed_groups = {g for g in groups if old.targets.get(g) != new.targets.get(g)}
+        for agent_id in self.entries:
+            before, after = old.group_of(agent_id), new.group_of(agent_id)
+            if before != after or after in changed_groups:
+                self._set(agent_id)
+
+    def load(self, agents: Iterable[tuple[str, Optional[dict[str, Any]]]]) -> None:
+        with self._lock:
+            self.source.poll(force=True)
+            for agent_id, apps in agents:
+                self.apps[agent_id] = apps or {}
+                self._set(agent_id)
+
+    def update(self, agent_id: str, apps: dict[str, Any]) -> None:
+        with self._lock:
+            self._reload()
+            self.apps[agent_id] = apps
+            self._set(agent_id)
+
+    def refresh(self) -> None:
+        with self._lock:
+            self._reload()
+
+    def drift(self, only_drifted: bool = False) -> list[dict[str, Any]]:
+        self.refresh()
+        with self._lock:
+            if only_drifted:
+                return [self.entries[a] for a in self.drifted]
+            return list(self.entries.values())
@@ -0,0 +1,44 @@
+import json
+import uuid
+from typing import Any, Iterable
+from sqlalchemy import func, insert
+from sqlmodel import Session, select
+from ..db.models import Command, FanoutJob
+
+STATUSES = ("pending", "running", "success", "failed")
+
+
+def enqueue_many(session: Session, job_id: str, agent_ids: Iterable[str], payload: dict[str, Any], target: dict[str, Any], user: str | None = None) -> list[str]:
+    """Queue ``payload`` for every agent in one executemany INSERT (caller commits).
+
+    Returns the agent ids actually targeted (deduplicated, order kept).
+    """
+    agents = list(dict.fromkeys(agent_ids))
+    encoded = json.dumps(payload)
+    kind = payload.get("command") or ""
+    session.add(FanoutJob(id=job_id, payload=encoded, target=json.dumps(target), total=len(agents), created_by=user))
+    if agents:
+        session.execute(insert(Command), [
+            {"command_id": str(uuid.uuid4()), "agent_id": a, "payload": encoded, "kind": kind, "job_id": job_id, "status": "pending"}
+            for a in agents
+        ])
+    return agents
+
+
+def job_progress(session: Session, job_id: str) -> dict[str, Any] | None:
+    """Status counts of a fan-out job, aggregated on ix_command_job_status."""
+    job = session.get(FanoutJob, job_id)
+    if job is None:
+        return None
+    counts = dict(session.exec(select(Command.status, func.count()).where(Command.job_id == job_id).group_by(Command.status)).all())
+    progress: dict[str, Any] = {s: counts.pop(s, 0) for s in STATUSES}
+    progress.update(counts)  # any other terminal status reported by agents
+    active = progress["pending"] + progress["running"]
+    return {
+        "job_id": job.id,
+        "created_at": job.created_at.isoformat(),
+        "target": json.loads(job.target),
+        "total": job.total,
+        "counts": progress,
+        "done": active == 0,
+    }
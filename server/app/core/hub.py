@@ -0,0 +1,178 @@
+import asyncio
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Optional, Union
+
+# Markers yielded by CommandHub.follow besides (seq, data) events
+KEEPALIVE = "keepalive"
+END = "end"
+
+Event = tuple[int, str]
+Backfill = Callable[[int], Awaitable[list[Event]]]
+IsFinal = Callable[[], Awaitable[bool]]
+
+
+class CommandStream:
+    """Recent output of one command: a byte-bounded ring of (seq, data)."""
+
+    def __init__(self, max_events: int, max_bytes: int) -> None:
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.ring: deque[Event] = deque()
+        self.bytes = 0
+        self.last_seq = 0
+        self.subscribers = 0
+        self.finished = False
+        self.touched = time.monotonic()
+        self.changed = asyncio.Event()
+
+    def _wake(self) -> None:
+        self.touched = time.monotonic()
+        ev, self.changed = self.changed, asyncio.Event()
+        ev.set()
+
+    def publish(self, seq: int, data: str) -> None:
+        if seq <= self.last_seq:
+            return  # duplicate (agent resend)
+        self.ring.append((seq, data))
+        self.bytes += len(data)
+        self.last_seq = seq
+        while self.ring and (len(self.ring) > self.max_events or self.bytes > self.max_bytes):
+            _, old = self.ring.popleft()
+            self.bytes -= len(old)
+        self._wake()
+
+    def finish(self) -> None:
+        self.finished = True
+        self._wake()
+
+    def since(self, cursor: int) -> tuple[list[Event], bool]:
+        """Events after ``cursor`` and whether some were already evicted from the ring."""
+        if not self.ring or self.ring[-1][0] <= cursor:
+            return [], False
+        gap = self.ring[0][0] > cursor + 1
+        return [e for e in self.ring if e[0] > cursor], gap
+
+
+class CommandHub:
+    """Fan-out of command output to any number of SSE subscribers.
+
+    Publishers never block: each subscriber keeps its own cursor over the
+    stream's ring and catches up from the output store (``backfill``) when
+    it connects late or falls behind the ring. Streams are evicted once
+    finished or idle with nobody listening, so memory stays bounded by
+    ``max_streams`` rings regardless of how many commands ran. Whether a
+    command is over comes from storage (``is_final``), not from the ring
+    alone: a command finished elsewhere or long ago gets no live stream.
+    """
+
+    def __init__(self, max_events: int = 512, max_bytes: int = 256 * 1024, max_streams: int = 1000, finished_ttl: float = 60, idle_ttl: float = 600) -> None:
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.max_streams = max_streams
+        self.finished_ttl = finished_ttl
+        self.idle_ttl = idle_ttl
+        self._streams: dict[str, CommandStream] = {}
+
+    def __len__(self) -> int:
+        return len(self._streams)
+
+    def subscriber_count(self) -> int:
+        return sum(st.subscribers for st in self._streams.values())
+
+    def _stream(self, command_id: str) -> CommandStream:
+        st = self._streams.get(command_id)
+        if st is None:
+            if len(self._streams) >= self.max_streams:
+                self.evict(force=True)
+            st = self._streams[command_id] = CommandStream(self.max_events, self.max_bytes)
+        return st
+
+    def publish(self, command_id: str, seq: int, data: str) -> None:
+        self._stream(command_id).publish(seq, data)
+
+    def finish(self, command_id: str) -> None:
+        st = self._streams.get(command_id)
+        if st is not None:
+            st.finish()
+
+    def evict(self, force: bool = False) -> int:
+        """Drop finished/idle streams without subscribers; ``force`` also drops the oldest idle one."""
+        now = time.monotonic()
+        idle = [(st.touched, cid) for cid, st in self._streams.items() if st.subscribers == 0]
+        dropped = 0
+        for touched, cid in idle:
+            st = self._streams[cid]
+            ttl = self.finished_ttl if st.finished else self.idle_ttl
+            if now - touched >= ttl:
+                del self._streams[cid]
+                dropped += 1
+        if force and not dropped and idle:
+            del self._streams[min(idle)[1]]
+            dropped = 1
+        return dropped
+
+    async def follow(self, command_id: str, after: int, backfill: Backfill, keepalive: float = 15.0, is_final: Optional[IsFinal] = None) -> AsyncIterator[Union[Event, str]]:
+        if is_final is not None and command_id not in self._streams and await is_final():
+            # finished (ring evicted, or finished on another worker) or unknown:
+            # replay what is stored and end, without creating a stream that never finishes
+            cursor = after
+            while True:
+                rows = await backfill(cursor)
+                if not rows:
+                    break
+                for ev in rows:
+                    yield ev
+                    cursor = ev[0]
+            yield END
+            return
+        st = self._stream(command_id)
+        st.subscribers += 1
+        cursor = after
+        try:
+            # initial replay from storage, page by page
+            while True:
+                rows = await backfill(cursor)
+                if not rows:
+                    break
+                for ev in rows:
+                    yield ev
+                    cursor = ev[0]
+            while True:
+                changed = st.changed
+                events, gap = st.since(cursor)
+                if gap:
+                    # fell behind the ring: catch up from storage instead of blocking publishers
+                    rows = await backfill(cursor)
+                    if rows:
+                        for ev in rows:
+                            yield ev
+                            cursor = ev[0]
+                        continue
+                for ev in events:
+                    yield ev
+                    cursor = ev[0]
+                if events:
+                    continue
+                if st.finished:
+                    yield END
+                    return
+                try:
+                    async with asyncio.timeout(keepalive):
+                        await changed.wait()
+                except asyncio.TimeoutError:
+                    if is_final is not None and await is_final():
+                        # the finish event never reached this worker: drain storage, then end
+                        while True:
+                            rows = await backfill(cursor)
+                            if not rows:
+                                break
+                            for ev in rows:
+                                yield ev
+                                cursor = ev[0]
+                        st.finish()
+                        continue
+                    yield KEEPALIVE
+        finally:
+            st.subscribers -= 1
+            st.touched = time.monotonic()
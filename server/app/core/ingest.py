@@ -0,0 +1,172 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Optional
+from sqlalchemy import Engine
+from sqlmodel import Session
+from ..db.models import Agent
+
+
+# os_update keys mirrored into typed, indexed Agent columns
+OS_COLUMNS = {
+    "hostname": str,
+    "os_version": str,
+    "kernel": str,
+    "arch": str,
+    "upgrades": int,
+    "sudo_apt_ok": bool,
+}
+
+
+def os_columns(os_update: Optional[dict[str, Any]]) -> dict[str, Any]:
+    """Typed column values for an os_update report (missing or malformed -> None)."""
+    out: dict[str, Any] = {}
+    for name, typ in OS_COLUMNS.items():
+        v = (os_update or {}).get(name)
+        try:
+            out[name] = typ(v) if v is not None else None
+        except (TypeError, ValueError):
+            out[name] = None
+    return out
+
+
+@dataclass
+class PendingHeartbeat:
+    agent_id: str
+    last_seen: datetime
+    apps_state: Optional[str] = None  # JSON string, only meaningful if has_apps_state
+    os_update: Optional[str] = None  # JSON string, only meaningful if has_os_update
+    os_attrs: Optional[dict[str, Any]] = None  # os_columns(os_update), written along with it
+    has_apps_state: bool = True
+    has_os_update: bool = False
+    poll_interval: Optional[int] = None  # written when reported
+    agent_version: Optional[str] = None  # written when reported
+
+
+class HeartbeatBuffer:
+    """Write-behind buffer for heartbeat ingestion.
+
+    Heartbeats are coalesced per agent (latest state wins) and written in one
+    bulk upsert transaction every ``flush_ms`` or as soon as ``batch_size``
+    agents are pending. When ``max_pending`` agents are buffered, ``submit``
+    waits for a flush instead of growing without bound. Writes go through
+    ``run_db`` (the server's bounded DB executor).
+    """
+
+    def __init__(self, engine: Engine, flush_ms: int = 500, batch_size: int = 500, max_pending: int = 10000, run_db: Callable[..., Awaitable[Any]] = asyncio.to_thread) -> None:
+        self.engine = engine
+        self.run_db = run_db
+        self.flush_ms = flush_ms
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._pending: dict[str, PendingHeartbeat] = {}
+        self._flush_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.flushed_total = 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def get(self, agent_id: str) -> Optional[PendingHeartbeat]:
+        return self._pending.get(agent_id)
+
+    async def submit(self, hb: PendingHeartbeat) -> None:
+        prev = self._pending.get(hb.agent_id)
+        if prev is None and len(self._pending) >= self.max_pending:
+            # bounded buffer: apply backpressure to the caller
+            await self.flush()
+        if prev is not None:
+            # a liveness-only beat must not drop state still waiting to be written
+            if not hb.has_apps_state and prev.has_apps_state:
+                hb.apps_state, hb.has_apps_state = prev.apps_state, True
+            if not hb.has_os_update and prev.has_os_update:
+                hb.os_update, hb.os_attrs, hb.has_os_update = prev.os_update, prev.os_attrs, True
+            if hb.poll_interval is None:
+                hb.poll_interval = prev.poll_interval
+            if hb.agent_version is None:
+                hb.agent_version = prev.agent_version
+        self._pending[hb.agent_id] = hb
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                async with asyncio.timeout(self.flush_ms / 1000):
+                    await self._wake.wait()
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"heartbeat flush error: {e}")
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            try:
+                await self.run_db(write_heartbeats, self.engine, list(batch.values()))
+            except Exception:
+                # put the batch back unless newer beats already replaced it
+                for agent_id, hb in batch.items():
+                    self._pending.setdefault(agent_id, hb)
+                raise
+            self.flushed_total += len(batch)
+            return len(batch)
+
+
+def write_heartbeats(engine: Engine, beats: list[PendingHeartbeat]) -> None:
+    """Upsert a batch of coalesced heartbeats in a single transaction."""
+    # executemany needs homogeneous rows: one statement per column set
+    groups: dict[tuple[str, ...], list[dict[str, Any]]] = {}
+    for hb in beats:
+        row: dict[str, Any] = {"id": hb.agent_id, "last_seen": hb.last_seen, "status": "online"}
+        if hb.has_apps_state:
+            row["apps_state"] = hb.apps_state
+        if hb.has_os_update:
+            row["os_update"] = hb.os_update
+            row.update(hb.os_attrs if hb.os_attrs is not None else os_columns(None))
+        if hb.poll_interval is not None:
+            row["poll_interval"] = hb.poll_interval
+        if hb.agent_version is not None:
+            row["agent_version"] = hb.agent_version
+        groups.setdefault(tuple(row), []).append(row)
+    dialect = engine.dialect.name
+    with Session(engine) as session:
+        if dialect in ("sqlite", "postgresql"):
+            if dialect == "sqlite":
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            for cols, rows in groups.items():
+                stmt = insert(Agent)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[Agent.id],
+                    set_={c: getattr(stmt.excluded, c) for c in cols if c != "id"},
+                )
+                session.execute(stmt, rows)
+        else:
+            for r in (r for rows in groups.values() for r in rows):
+                agent = session.get(Agent, r["id"]) or Agent(id=r["id"])
+                for k, v in r.items():
+                    setattr(agent, k, v)
+                session.add(agent)
+        session.commit()
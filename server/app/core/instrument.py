@@ -0,0 +1,230 @@
+import asyncio
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# upper bounds in seconds (+Inf implied), 0.5 ms .. 10 s
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_STATEMENT = re.compile(r"^\s*(\w+)(?:.*?\b(?:FROM|INTO|UPDATE)\s+\"?(\w+))?", re.IGNORECASE | re.DOTALL)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram: O(log buckets) per sample, constant memory."""
+
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile (max for the overflow bucket)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return BUCKETS[i] if i < len(BUCKETS) else self.max
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "max": round(self.max, 6),
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Instrumentation:
+    """Opt-in timings for the server's hot paths.
+
+    Families of histograms keyed by name: ``http`` (per route template, time
+    to response start, so SSE streams count only until headers are sent),
+    ``db`` (per statement verb and table, from engine events), ``db_on_loop``
+    (statements executed on the event-loop thread, i.e. blocking it),
+    ``loop_lag`` (how late a periodic timer fires) and ``span`` (explicit
+    sections such as ``ws_broadcast``). Gauges are callables evaluated on
+    read. Disabled, nothing is hooked: no middleware, no engine listeners,
+    no monitor task, and ``span`` returns a shared no-op context.
+    """
+
+    def __init__(self, enabled: bool = False, lag_interval: float = 0.25) -> None:
+        self.enabled = enabled
+        self.lag_interval = lag_interval
+        self.histograms: dict[str, dict[str, Histogram]] = {}
+        self.errors: dict[str, int] = {}  # 5xx responses per route
+        self.gauges: dict[str, Callable[[], float]] = {}
+        self._statements: dict[str, str] = {}
+        self._loop_thread: Optional[int] = None
+        self._lock = threading.Lock()  # DB samples come from worker threads
+        self._noop = nullcontext()
+
+    def observe(self, family: str, name: str, seconds: float) -> None:
+        with self._lock:
+            h = self.histograms.setdefault(family, {}).get(name)
+            if h is None:
+                h = self.histograms[family][name] = Histogram()
+            h.observe(seconds)
+
+    def count_error(self, name: str) -> None:
+        with self._lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def span(self, name: str):
+        if not self.enabled:
+            return self._noop
+        return self._span(name)
+
+    @contextmanager
+    def _span(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("span", name, time.perf_counter() - t0)
+
+    def gauge(self, name: str, fn: Callable[[], float]) -> None:
+        self.gauges[name] = fn
+
+    def read_gauges(self) -> dict[str, float]:
+        out = {}
+        for name, fn in self.gauges.items():
+            try:
+                out[name] = fn()
+            except Exception:
+                continue
+        return out
+
+    # --- database ---
+
+    def _statement_key(self, statement: str) -> str:
+        key = self._statements.get(statement)
+        if key is None:
+            m = _STATEMENT.match(statement)
+            key = " ".join(p for p in (m.group(1).upper(), m.group(2)) if p) if m else "?"
+            if len(self._statements) < 1000:  # bounded: statements are mostly fixed SQL text
+                self._statements[statement] = key
+        return key
+
+    def install_db(self, engine: Engine) -> None:
+        if not self.enabled:
+            return
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _before(conn, cursor, statement, parameters, context, executemany) -> None:
+            conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def _after(conn, cursor, statement, parameters, context, executemany) -> None:
+            elapsed = time.perf_counter() - conn.info["query_start"].pop()
+            self.observe("db", self._statement_key(statement), elapsed)
+            if threading.get_ident() == self._loop_thread:
+                self.observe("db_on_loop", self._statement_key(statement), elapsed)
+
+        @event.listens_for(engine, "handle_error")
+        def _error(context) -> None:
+            # a failed statement gets no after_cursor_execute: drop its start so
+            # later timings on this pooled connection pair with their own
+            conn = context.connection
+            starts = conn.info.get("query_start") if conn is not None else None
+            if starts:
+                starts.pop()
+
+    # --- event loop ---
+
+    async def monitor_loop(self) -> None:
+        """Record how late a ``lag_interval`` sleep wakes up (time the loop was busy)."""
+        self._loop_thread = threading.get_ident()
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            self.observe("loop_lag", "loop", max(0.0, time.perf_counter() - t0 - self.lag_interval))
+
+    # --- output ---
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            families = {
+                family: {name: h.summary() for name, h in sorted(hists.items())}
+                for family, hists in self.histograms.items()
+            }
+            errors = dict(self.errors)
+        return {"enabled": self.enabled, "histograms": families, "http_errors": errors, "gauges": self.read_gauges()}
+
+    def prometheus(self) -> str:
+        """Histograms in Prometheus text format (seconds), empty when disabled."""
+        out = []
+        with self._lock:
+            for family, hists in sorted(self.histograms.items()):
+                metric = f"fleet_{family}_seconds"
+                label = "route" if family == "http" else "name"
+                out.append(f"# TYPE {metric} histogram")
+                for name, h in sorted(hists.items()):
+                    cumulative = 0
+                    for bound, n in zip(BUCKETS + ("+Inf",), h.counts):
+                        cumulative += n
+                        out.append(f'{metric}_bucket{{{label}="{name}",le="{bound}"}} {cumulative}')
+                    out.append(f'{metric}_sum{{{label}="{name}"}} {h.sum}')
+                    out.append(f'{metric}_count{{{label}="{name}"}} {h.count}')
+        return "\n".join(out) + "\n" if out else ""
+
+
+class TimingMiddleware:
+    """ASGI middleware recording per-route time to response start.
+
+    Plain ASGI rather than ``BaseHTTPMiddleware``: no extra task per request
+    and streaming responses are left untouched. The route template (not the
+    raw path) keys the histogram, so cardinality stays bounded.
+    """
+
+    def __init__(self, app, recorder: Instrumentation) -> None:
+        self.app = app
+        self.recorder = recorder
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        t0 = time.perf_counter()
+        started = False
+
+        def record(status: int) -> None:
+            route = scope.get("route")
+            name = f'{scope["method"]} {route.path if route is not None else "unmatched"}'
+            self.recorder.observe("http", name, time.perf_counter() - t0)
+            if status >= 500:
+                self.recorder.count_error(name)
+
+        async def timed_send(message) -> None:
+            nonlocal started
+            if message["type"] == "http.response.start" and not started:
+                started = True
+                record(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        except Exception:
+            if not started:
+                record(500)
+            raise
@@ -0,0 +1,76 @@
+import heapq
+from typing import Iterable, Optional
+
+
+class LivenessTracker:
+    """Per-agent heartbeat deadlines in a min-heap.
+
+    An agent is overdue ``max(min_timeout, grace * poll_interval)`` seconds
+    after its last heartbeat, using the interval the agent reports. The heap
+    holds at most one entry per agent: a heartbeat only moves the agent's
+    deadline in ``deadlines`` (O(1)), and an entry that surfaces before its
+    agent's current deadline is pushed back once (O(log n)). Finding expired
+    agents therefore never scans the fleet.
+    """
+
+    def __init__(self, grace: float = 3.0, min_timeout: float = 60.0, default_interval: float = 30.0) -> None:
+        self.grace = grace
+        self.min_timeout = min_timeout
+        self.default_interval = default_interval
+        self.deadlines: dict[str, float] = {}  # tracked (online) agents only
+        self.last_seen: dict[str, float] = {}
+        self.intervals: dict[str, float] = {}
+        self._heap: list[tuple[float, str]] = []
+        self._queued: set[str] = set()  # agents with an entry in the heap
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def timeout(self, agent_id: str) -> float:
+        return max(self.min_timeout, self.grace * self.intervals.get(agent_id, self.default_interval))
+
+    def beat(self, agent_id: str, at: float, interval: Optional[float] = None) -> None:
+        """Record a heartbeat at ``at`` (epoch seconds)."""
+        if interval:
+            self.intervals[agent_id] = interval
+        if at < self.last_seen.get(agent_id, 0.0):
+            return  # late delivery of an older beat (other worker)
+        self.last_seen[agent_id] = at
+        deadline = at + self.timeout(agent_id)
+        if agent_id not in self._queued:
+            heapq.heappush(self._heap, (deadline, agent_id))
+            self._queued.add(agent_id)
+        self.deadlines[agent_id] = deadline
+
+    def forget(self, agent_id: str, seen: float) -> bool:
+        """Stop tracking an agent marked offline elsewhere; False if it beat after ``seen``."""
+        if self.last_seen.get(agent_id, 0.0) > seen:
+            return False
+        self.deadlines.pop(agent_id, None)  # its heap entry is dropped when it surfaces
+        return True
+
+    def seed(self, agents: Iterable[tuple[str, float, Optional[float]]], now: float) -> None:
+        """Track agents believed online at startup; each gets a full timeout from ``now``."""
+        for agent_id, seen, interval in agents:
+            self.beat(agent_id, now, interval)
+            self.last_seen[agent_id] = seen
+
+    def next_deadline(self) -> Optional[float]:
+        return self._heap[0][0] if self._heap else None
+
+    def expired(self, now: float) -> list[tuple[str, float]]:
+        """Pop agents whose deadline passed: [(agent_id, last heartbeat)]; they stop being tracked."""
+        out = []
+        while self._heap and self._heap[0][0] <= now:
+            _, agent_id = heapq.heappop(self._heap)
+            self._queued.discard(agent_id)
+            deadline = self.deadlines.get(agent_id)
+            if deadline is None:
+                continue
+            if deadline > now:
+                heapq.heappush(self._heap, (deadline, agent_id))  # beat since this entry was pushed
+                self._queued.add(agent_id)
+                continue
+            del self.deadlines[agent_id]
+            out.append((agent_id, self.last_seen.get(agent_id, 0.0)))
+        return out
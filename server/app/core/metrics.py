@@ -0,0 +1,111 @@
+import time
+from collections import Counter, deque
+from typing import Iterable, Optional
+
+
+def percentile(sorted_values: list[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+class FleetMetrics:
+    """Incrementally maintained fleet counters.
+
+    Agent status counts are updated on status transitions (heartbeat, liveness)
+    and command outcomes are kept in a sliding window, so ``/api/metrics``
+    never has to scan the Agent or Command tables.
+    """
+
+    WINDOWS = {"5m": 300, "1h": 3600}
+
+    def __init__(self, max_samples: int = 50000) -> None:
+        self.agent_status: dict[str, str] = {}
+        self.status_counts: Counter[str] = Counter()
+        # (finished_at, ok, duration_seconds or None), oldest first
+        self.finished: deque[tuple[float, bool, Optional[float]]] = deque(maxlen=max_samples)
+        self.finished_by_status: Counter[str] = Counter()
+        self.counters: Counter[str] = Counter()
+
+    def seed_agents(self, rows: Iterable[tuple[str, str]]) -> None:
+        self.agent_status = dict(rows)
+        self.status_counts = Counter(self.agent_status.values())
+
+    def set_agent_status(self, agent_id: str, status: str) -> bool:
+        """Record an agent status; returns True if it changed."""
+        old = self.agent_status.get(agent_id)
+        if old == status:
+            return False
+        if old is not None:
+            self.status_counts[old] -= 1
+        self.status_counts[status] += 1
+        self.agent_status[agent_id] = status
+        return True
+
+    def incr(self, name: str, n: int = 1) -> None:
+        self.counters[name] += n
+
+    def command_finished(self, status: str, duration: Optional[float], at: Optional[float] = None) -> None:
+        self.finished.append((at or time.time(), status == "success", duration))
+        self.finished_by_status[status] += 1
+
+    def window(self, seconds: int, now: Optional[float] = None) -> dict:
+        now = now or time.time()
+        while self.finished and now - self.finished[0][0] > max(self.WINDOWS.values()):
+            self.finished.popleft()
+        recent = [f for f in self.finished if now - f[0] <= seconds]
+        durations = sorted(d for _, _, d in recent if d is not None)
+        return {
+            "finished": len(recent),
+            "success_rate": (sum(1 for _, ok, _ in recent if ok) / len(recent)) if recent else None,
+            "duration_p50": percentile(durations, 0.5),
+            "duration_p90": percentile(durations, 0.9),
+            "duration_p99": percentile(durations, 0.99),
+        }
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        return {
+            "agents_by_status": {k: v for k, v in self.status_counts.items() if v},
+            "commands": {name: self.window(secs, now) for name, secs in self.WINDOWS.items()},
+            "finished_by_status": dict(self.finished_by_status),
+            "counters": dict(self.counters),
+        }
+
+    def prometheus(self, extra_gauges: Optional[dict[str, float]] = None) -> str:
+        """Prometheus text exposition (format 0.0.4)."""
+        snap = self.snapshot()
+        out = [
+            "# HELP fleet_agents Agents by last known status.",
+            "# TYPE fleet_agents gauge",
+        ]
+        for status, n in sorted(snap["agents_by_status"].items()):
+            out.append(f'fleet_agents{{status="{status}"}} {n}')
+        out += [
+            "# HELP fleet_command_success_ratio Share of finished commands that succeeded.",
+            "# TYPE fleet_command_success_ratio gauge",
+        ]
+        for window, w in snap["commands"].items():
+            if w["success_rate"] is not None:
+                out.append(f'fleet_command_success_ratio{{window="{window}"}} {w["success_rate"]}')
+        out += [
+            "# HELP fleet_command_duration_seconds Command duration quantiles.",
+            "# TYPE fleet_command_duration_seconds gauge",
+        ]
+        for window, w in snap["commands"].items():
+            for q, label in (("p50", "0.5"), ("p90", "0.9"), ("p99", "0.99")):
+                v = w[f"duration_{q}"]
+                if v is not None:
+                    out.append(f'fleet_command_duration_seconds{{window="{window}",quantile="{label}"}} {v}')
+        out.append("# TYPE fleet_commands_finished_total counter")
+        for status, n in sorted(snap["finished_by_status"].items()):
+            out.append(f'fleet_commands_finished_total{{status="{status}"}} {n}')
+        for name, v in sorted(snap["counters"].items()):
+            out += [f"# TYPE fleet_{name}_total counter", f"fleet_{name}_total {v}"]
+        for name, v in sorted((extra_gauges or {}).items()):
+            out += [f"# TYPE fleet_{name} gauge", f"fleet_{name} {v}"]
+        return "\n".join(out) + "\n"
+
+
+fleet_metrics = FleetMetrics()
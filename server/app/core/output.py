@@ -0,0 +1,106 @@
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import exists, func, insert, literal
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from ..db.models import Command, CommandOutput
+from .archive import archive_reader
+
+
+class OutputStore:
+    """Append-only command output, one ``CommandOutput`` row per chunk.
+
+    Appends are a single indexed INSERT (no rewrite of previous output).
+    Sequence numbers come from the database, never from per-process state,
+    so any number of server workers can append to the same command.
+    """
+
+    def append(self, session: Session, command_id: str, data: str, retries: int = 5) -> int:
+        """Append one chunk after the stored ones and return its sequence number (caller commits).
+
+        The seq is reserved by the INSERT itself (``max(seq) + 1``); a writer
+        losing a race on ``ux_command_output_cmd_seq`` retries.
+        """
+        nxt = select(
+            literal(command_id), func.coalesce(func.max(CommandOutput.seq), 0) + 1, literal(data), literal(datetime.utcnow()),
+        ).where(CommandOutput.command_id == command_id)
+        stmt = insert(CommandOutput).from_select(["command_id", "seq", "data", "created_at"], nxt).returning(CommandOutput.seq)
+        for _ in range(retries - 1):
+            try:
+                with session.begin_nested():
+                    return session.execute(stmt).scalar_one()
+            except IntegrityError:
+                continue
+        return session.execute(stmt).scalar_one()
+
+    def append_many(self, session: Session, command_id: str, chunks: list[tuple[int, str]], attempt: Optional[int] = None) -> list[tuple[int, str]]:
+        """Store agent-sequenced chunks of one run in one statement, skipping already stored ones.
+
+        The agent numbers chunks from 1 on every run; they are stored after
+        the output of earlier claims (``Command.output_base``), so a requeued
+        command keeps both runs. Chunks of a superseded ``attempt`` are
+        dropped. Returns the chunks actually appended, with their stored seq
+        (resent batches are idempotent).
+        """
+        row = session.exec(select(Command.attempt, Command.output_base).where(Command.command_id == command_id)).first()
+        if row is not None and attempt is not None and row.attempt is not None and attempt != row.attempt:
+            return []
+        base = (row.output_base if row is not None else None) or 0
+        rebased = {base + seq: data for seq, data in chunks if seq >= 1}
+        if not rebased:
+            return []
+        stored = set(session.exec(select(CommandOutput.seq).where(CommandOutput.command_id == command_id, CommandOutput.seq.in_(list(rebased)))).all())
+        fresh = sorted((seq, data) for seq, data in rebased.items() if seq not in stored)
+        if fresh:
+            stmt = insert(CommandOutput)
+            dialect = session.get_bind().dialect.name
+            if dialect == "sqlite":
+                stmt = stmt.prefix_with("OR IGNORE")
+            elif dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert as pg_insert
+                stmt = pg_insert(CommandOutput).on_conflict_do_nothing()
+            session.execute(stmt, [{"command_id": command_id, "seq": seq, "data": data} for seq, data in fresh])
+        return fresh
+
+    def read(self, session: Session, command_id: str, after: int = 0, limit: Optional[int] = None) -> list[tuple[int, str]]:
+        """Chunks with ``seq > after`` in order, served by the (command_id, seq) index."""
+        stmt = (
+            select(CommandOutput.seq, CommandOutput.data)
+            .where(CommandOutput.command_id == command_id, CommandOutput.seq > after)
+            .order_by(CommandOutput.seq)
+        )
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        rows = [(seq, data) for seq, data in session.exec(stmt).all()]
+        if rows:
+            return rows
+        # a caught-up reader of live output stops here; only a finished command
+        # with no chunks left was compacted by retention
+        compacted = select(Command.id).where(
+            Command.command_id == command_id,
+            Command.status.not_in(("pending", "running")),
+            ~exists().where(CommandOutput.command_id == command_id),
+        )
+        if session.exec(compacted).first() is None:
+            return rows
+        archived = archive_reader.load(session, command_id)
+        if archived is None:
+            return rows
+        rows = [c for c in archived if c[0] > after]
+        return rows[:limit] if limit is not None else rows
+
+    def legacy(self, session: Session, command_id: str) -> Optional[str]:
+        """Output stored inline by older versions (archived as seq 0)."""
+        legacy = session.exec(select(Command.output).where(Command.command_id == command_id)).first()
+        if legacy is None:
+            archived = archive_reader.load(session, command_id)
+            if archived and archived[0][0] == 0:
+                legacy = archived[0][1]
+        return legacy
+
+    def materialize(self, session: Session, command_id: str) -> str:
+        """Full output text, including output stored inline by older versions."""
+        return (self.legacy(session, command_id) or "") + "".join(data for _, data in self.read(session, command_id))
+
+
+output_store = OutputStore()
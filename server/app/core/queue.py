@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta
+from typing import Any, Optional
+import json
+from sqlalchemy import func, update, select
+from sqlmodel import Session
+from ..db.models import Command, CommandOutput, Deployment
+
+# statuses an agent may report for a command; anything else would strand it
+FINAL_STATUSES = ("success", "failed", "timeout", "cancelled")
+
+
+def claim_next(session: Session, agent_id: str, lease_seconds: int, now: Optional[datetime] = None) -> Optional[dict[str, Any]]:
+    """Atomically claim the oldest pending command of ``agent_id``.
+
+    Select and status flip happen in a single ``UPDATE ... RETURNING`` so two
+    concurrent pollers can never both receive the same command. The lookup is
+    served by ``ix_command_agent_status_created``. Each claim is a new
+    ``attempt`` whose output is stored after what earlier attempts stored.
+    """
+    now = now or datetime.utcnow()
+    oldest = (
+        select(Command.id)
+        .where(Command.agent_id == agent_id, Command.status == "pending")
+        .order_by(Command.created_at, Command.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    stored = (
+        select(func.coalesce(func.max(CommandOutput.seq), 0))
+        .where(CommandOutput.command_id == Command.command_id)
+        .scalar_subquery()
+    )
+    stmt = (
+        update(Command)
+        # re-check status so a concurrent claimer on a MVCC backend updates nothing
+        .where(Command.id == oldest, Command.status == "pending")
+        .values(
+            status="running", updated_at=now, started_at=now, lease_expires_at=now + timedelta(seconds=lease_seconds),
+            attempt=func.coalesce(Command.attempt, 0) + 1, output_base=stored,
+        )
+        .returning(Command.command_id, Command.payload, Command.attempt)
+        .execution_options(synchronize_session=False)
+    )
+    row = session.execute(stmt).first()
+    session.commit()
+    if row is None:
+        return None
+    command = json.loads(row.payload)
+    command.setdefault("command_id", row.command_id)
+    command["attempt"] = row.attempt
+    return command
+
+
+def extend_lease(session: Session, command_id: str, lease_seconds: int, now: Optional[datetime] = None) -> None:
+    """Push back the lease of a running command (agent is still reporting)."""
+    now = now or datetime.utcnow()
+    session.execute(
+        update(Command)
+        .where(Command.command_id == command_id, Command.status == "running")
+        .values(updated_at=now, lease_expires_at=now + timedelta(seconds=lease_seconds))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def requeue_expired(session: Session, now: Optional[datetime] = None) -> int:
+    """Return running commands whose lease expired to pending. Returns the row count."""
+    now = now or datetime.utcnow()
+    res = session.execute(
+        update(Command)
+        .where(Command.status == "running", Command.lease_expires_at < now)
+        .values(status="pending", lease_expires_at=None, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+    return res.rowcount or 0
+
+
+def finish(
+    session: Session,
+    command_id: str,
+    status: str,
+    duration: Optional[int] = None,
+    exit_code: Optional[int] = None,
+    logs: Optional[str] = None,
+    now: Optional[datetime] = None,
+) -> int:
+    """Record a command's final status reported by the agent (no commit).
+
+    Only a pending/running command transitions, so a result delivered twice
+    is counted once; returns 0 for a duplicate or unknown command. A command
+    targeting an app (``payload["app"]``) also gets its ``Deployment`` row.
+    Raises ValueError for a status that is not final.
+    """
+    if status not in FINAL_STATUSES:
+        raise ValueError(f"not a final command status: {status!r}")
+    now = now or datetime.utcnow()
+    row = session.execute(
+        update(Command)
+        .where(Command.command_id == command_id, Command.status.in_(("pending", "running")))
+        .values(status=status, lease_expires_at=None, updated_at=now, finished_at=now, duration=duration, exit_code=exit_code)
+        .returning(Command.agent_id, Command.payload, Command.started_at)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        return 0
+    try:
+        app = json.loads(row.payload).get("app")
+    except (ValueError, AttributeError):
+        app = None
+    if app:
+        session.add(Deployment(
+            agent_id=row.agent_id, app_name=app, command_id=command_id, status=status,
+            started_at=row.started_at or now, finished_at=now, logs=logs,
+        ))
+    return 1
@@ -0,0 +1,206 @@
+import json
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+from sqlalchemy import Engine, and_, delete, exists, func, literal, or_, text, update
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, select
+from ..db.models import Command, CommandArchive, CommandOutput, Deployment
+from .archive import archive_reader, default_codec, pack
+
+ACTIVE = ("pending", "running")
+
+
+@dataclass
+class RetentionPolicy:
+    """What to keep of finished commands; 0 disables a rule.
+
+    A finished command is deleted when it is older than ``keep_days`` or
+    beyond the newest ``max_per_agent`` of its agent, unless it is among the
+    last ``keep_per_type`` commands of its type on that agent. Output of
+    commands finished more than ``archive_after_hours`` ago is compressed
+    into a CommandArchive row.
+    """
+
+    keep_days: int = 0
+    max_per_agent: int = 0
+    keep_per_type: int = 5
+    archive_after_hours: int = 24
+    codec: str = ""
+    batch_size: int = 200
+    vacuum_pages: int = 2000
+
+
+def command_kind(payload: Optional[str]) -> Optional[str]:
+    try:
+        return json.loads(payload or "{}").get("command")
+    except Exception:
+        return None
+
+
+class Retention:
+    """One retention pass: backfill kinds, archive output, prune, vacuum.
+
+    Every step works in bounded batches with a commit in between, so the
+    write lock is never held for long (except the one-time ``VACUUM`` that
+    converts an older database file, see ``vacuum``).
+    """
+
+    def __init__(self, engine: Engine, policy: RetentionPolicy) -> None:
+        self.engine = engine
+        self.policy = policy
+
+    def run(self, now: Optional[datetime] = None) -> dict[str, int]:
+        now = now or datetime.utcnow()
+        stats = {"kinds": self.backfill_kinds(), "archived": 0, "deleted": 0, "vacuumed_pages": 0}
+        if self.policy.archive_after_hours > 0:
+            stats["archived"] = self.archive(now - timedelta(hours=self.policy.archive_after_hours))
+        stats["deleted"] = self.prune(now)
+        stats["vacuumed_pages"] = self.vacuum()
+        return stats
+
+    def backfill_kinds(self) -> int:
+        """Fill ``Command.kind`` for rows enqueued before the column existed."""
+        done = 0
+        while True:
+            with Session(self.engine) as session:
+                rows = session.exec(select(Command.id, Command.payload).where(Command.kind == None).limit(self.policy.batch_size)).all()  # noqa: E711
+                if not rows:
+                    return done
+                for cid, payload in rows:
+                    session.execute(update(Command).where(Command.id == cid).values(kind=command_kind(payload) or ""))
+                session.commit()
+                done += len(rows)
+
+    def archive(self, cutoff: datetime) -> int:
+        codec = self.policy.codec or default_codec()
+        has_chunks = exists().where(CommandOutput.command_id == Command.command_id)
+        archived = exists().where(CommandArchive.command_id == Command.command_id)
+        done = 0
+        while True:
+            with Session(self.engine) as session:
+                batch = session.exec(
+                    select(Command.command_id, Command.output)
+                    .where(Command.status.not_in(ACTIVE), Command.updated_at < cutoff)
+                    .where(or_(has_chunks, Command.output != None), ~archived)  # noqa: E711
+                    .limit(self.policy.batch_size)
+                ).all()
+                if not batch:
+                    return done
+                for command_id, legacy in batch:
+                    chunks = [(0, legacy)] if legacy else []
+                    chunks += session.exec(
+                        select(CommandOutput.seq, CommandOutput.data)
+                        .where(CommandOutput.command_id == command_id)
+                        .order_by(CommandOutput.seq)
+                    ).all()
+                    data, raw = pack([list(c) for c in chunks], codec)
+                    session.add(CommandArchive(command_id=command_id, codec=codec, data=data, raw_bytes=raw))
+                    session.execute(delete(CommandOutput).where(CommandOutput.command_id == command_id))
+                    session.execute(update(Command).where(Command.command_id == command_id).values(output=None))
+                session.commit()
+            for command_id, _ in batch:
+                archive_reader.forget(command_id)
+            done += len(batch)
+
+    def _doomed(self, session: Session, where: list, after: Optional[tuple[datetime, int]]) -> tuple[list[tuple[int, str]], Optional[tuple[datetime, int]]]:
+        """One page of finished commands matching ``where``, oldest first after ``after``.
+
+        Returns the deletable ones (not among the newest ``keep_per_type`` of
+        their agent and type) and the cursor of the page's last row.
+        """
+        k = self.policy.keep_per_type
+        stmt = select(Command.id, Command.command_id, Command.created_at).where(Command.status.not_in(ACTIVE), *where)
+        if after is not None:
+            stmt = stmt.where(or_(Command.created_at > after[0], and_(Command.created_at == after[0], Command.id > after[1])))
+        if k:
+            newer = aliased(Command)
+            # k newer commands of the same agent and type exist: a bounded probe per row
+            kth_newer = (
+                select(newer.id)
+                .where(newer.agent_id == Command.agent_id, newer.kind == Command.kind, newer.status.not_in(ACTIVE))
+                .where(or_(newer.created_at > Command.created_at, and_(newer.created_at == Command.created_at, newer.id > Command.id)))
+                .limit(1).offset(k - 1)
+                .correlate(Command)
+                .scalar_subquery()
+            )
+            stmt = stmt.add_columns(kth_newer.is_not(None))
+        else:
+            stmt = stmt.add_columns(literal(True))
+        rows = session.exec(stmt.order_by(Command.created_at, Command.id).limit(self.policy.batch_size)).all()
+        cursor = (rows[-1][2], rows[-1][0]) if len(rows) == self.policy.batch_size else None
+        return [(r[0], r[1]) for r in rows if r[3]], cursor
+
+    def _expired_batches(self, now: datetime) -> Iterator[list[tuple[int, str]]]:
+        """Batches of commands to delete, found with indexed range scans (no full-table window)."""
+        p = self.policy
+        sweeps: list[list] = []
+        if p.keep_days:
+            sweeps.append([Command.created_at < now - timedelta(days=p.keep_days)])
+        if p.max_per_agent:
+            with Session(self.engine) as session:
+                agent_id = session.exec(select(func.min(Command.agent_id))).one()
+                while agent_id is not None:
+                    # newest command beyond the first max_per_agent of this agent
+                    edge = session.exec(
+                        select(Command.created_at, Command.id)
+                        .where(Command.agent_id == agent_id, Command.status.not_in(ACTIVE))
+                        .order_by(Command.created_at.desc(), Command.id.desc())
+                        .limit(1).offset(p.max_per_agent)
+                    ).first()
+                    if edge is not None:
+                        sweeps.append([Command.agent_id == agent_id, or_(Command.created_at < edge[0], and_(Command.created_at == edge[0], Command.id <= edge[1]))])
+                    # next agent: an index seek, not a DISTINCT over the table
+                    agent_id = session.exec(select(func.min(Command.agent_id)).where(Command.agent_id > agent_id)).one()
+        for where in sweeps:
+            after = None
+            while True:
+                with Session(self.engine) as session:
+                    doomed, after = self._doomed(session, where, after)
+                if doomed:
+                    yield doomed
+                if after is None:
+                    break
+
+    def prune(self, now: datetime) -> int:
+        deleted = 0
+        for batch in self._expired_batches(now):
+            ids = [r[0] for r in batch]
+            command_ids = [r[1] for r in batch]
+            with Session(self.engine) as session:
+                session.execute(delete(CommandOutput).where(CommandOutput.command_id.in_(command_ids)))
+                session.execute(delete(CommandArchive).where(CommandArchive.command_id.in_(command_ids)))
+                session.execute(delete(Deployment).where(Deployment.command_id.in_(command_ids)))
+                res = session.execute(delete(Command).where(Command.id.in_(ids)))
+                session.commit()
+            for command_id in command_ids:
+                archive_reader.forget(command_id)
+            deleted += res.rowcount or 0
+        return deleted
+
+    def vacuum(self) -> int:
+        """Give free pages back to the filesystem (SQLite).
+
+        ``auto_vacuum=INCREMENTAL`` only applies to a new database file: an
+        older one is converted by a full ``VACUUM`` the first time (the
+        database is locked while it rewrites the file), and every later pass
+        frees at most ``vacuum_pages`` pages.
+        """
+        if self.engine.dialect.name != "sqlite" or not self.policy.vacuum_pages:
+            return 0
+        with self.engine.connect() as conn:
+            incremental = conn.execute(text("PRAGMA auto_vacuum")).scalar() == 2
+        if not incremental:
+            # VACUUM cannot run inside a transaction
+            with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                before = conn.execute(text("PRAGMA page_count")).scalar() or 0
+                conn.execute(text("PRAGMA auto_vacuum=INCREMENTAL"))
+                conn.execute(text("VACUUM"))
+                return max(0, before - (conn.execute(text("PRAGMA page_count")).scalar() or 0))
+        with self.engine.connect() as conn:
+            free = conn.execute(text("PRAGMA freelist_count")).scalar() or 0
+            pages = min(free, self.policy.vacuum_pages)
+            if pages:
+                conn.execute(text(f"PRAGMA incremental_vacuum({pages})")).fetchall()
+                conn.commit()
+            return pages
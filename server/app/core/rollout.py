@@ -0,0 +1,467 @@
+import asyncio
+import json
+import math
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional, Union
+from sqlalchemy import Engine, insert, update
+from sqlmodel import Session, select
+from ..db.models import Command, FanoutJob, Rollout, RolloutTarget
+
+ACTIVE = ("queued", "verifying")
+TERMINAL = ("succeeded", "failed", "cancelled")
+UNHEALTHY = {"unhealthy", "down", "failed", "error", "exited", "dead"}
+
+RunDb = Callable[..., Awaitable[Any]]
+
+
+@dataclass
+class RolloutSpec:
+    # canary counts (int) and cumulative fleet percentages ("25%"), in order
+    waves: list[Union[int, str]] = field(default_factory=lambda: [1, "100%"])
+    max_in_flight: int = 0  # per desired state group; 0 = unlimited
+    failure_threshold: float = 0.2  # pause once failed/finished exceeds this
+    health_gate: bool = True  # a success counts once the next heartbeat is healthy
+    health_timeout: int = 600  # seconds to wait for that heartbeat
+    claim_timeout: int = 600  # seconds a queued command may wait unclaimed before its target fails
+
+
+def plan_waves(agent_ids: list[str], waves: list[Union[int, str]]) -> list[list[str]]:
+    """Split agents into waves; leftovers join the last wave, empty waves are dropped."""
+    n = len(agent_ids)
+    bounds: list[int] = []
+    done = 0
+    for w in waves:
+        if isinstance(w, str) and w.strip().endswith("%"):
+            done = max(done, math.ceil(float(w.strip()[:-1]) / 100 * n))
+        else:
+            done += int(w)
+        bounds.append(min(done, n))
+    if not bounds or bounds[-1] < n:
+        bounds.append(n)
+    out, start = [], 0
+    for b in bounds:
+        if b > start:
+            out.append(agent_ids[start:b])
+            start = b
+    return out
+
+
+def is_healthy(apps: dict[str, Any], app: Optional[str] = None) -> bool:
+    checked = {app: apps.get(app)} if app else apps
+    for state in checked.values():
+        if not isinstance(state, dict):
+            continue
+        if str(state.get("health") or "").lower() in UNHEALTHY or str(state.get("status") or "").lower() in UNHEALTHY:
+            return False
+    return True
+
+
+@dataclass
+class Target:
+    agent_id: str
+    group: Optional[str]
+    wave: int
+    status: str = "waiting"
+    command_id: Optional[str] = None
+    detail: Optional[str] = None
+
+
+class RolloutRun:
+    """In-memory state of one rollout; the DB rows are its durable copy."""
+
+    def __init__(self, rid: str, payload: dict[str, Any], spec: RolloutSpec, state: str = "running", wave: int = 0, reason: Optional[str] = None) -> None:
+        self.id = rid
+        self.payload = payload
+        self.spec = spec
+        self.state = state
+        self.wave = wave
+        self.reason = reason
+        self.targets: dict[str, Target] = {}
+        self.waves: list[list[str]] = []
+        self.in_flight: dict[Optional[str], int] = {}
+
+    def add(self, t: Target) -> None:
+        self.targets[t.agent_id] = t
+        while len(self.waves) <= t.wave:
+            self.waves.append([])
+        self.waves[t.wave].append(t.agent_id)
+        if t.status in ACTIVE:
+            self.in_flight[t.group] = self.in_flight.get(t.group, 0) + 1
+
+    def counts(self) -> dict[str, int]:
+        out: dict[str, int] = {}
+        for t in self.targets.values():
+            out[t.status] = out.get(t.status, 0) + 1
+        return out
+
+    def failure_rate(self) -> Optional[float]:
+        c = self.counts()
+        finished = c.get("succeeded", 0) + c.get("failed", 0)
+        return c.get("failed", 0) / finished if finished else None
+
+    def describe(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "state": self.state,
+            "reason": self.reason,
+            "wave": self.wave,
+            "waves": [
+                {"size": len(ids), "counts": _count(self.targets[a].status for a in ids)}
+                for ids in self.waves
+            ],
+            "counts": self.counts(),
+            "failure_rate": self.failure_rate(),
+            "in_flight": {g or "": n for g, n in self.in_flight.items() if n},
+            "spec": self.spec.__dict__,
+            "payload": self.payload,
+        }
+
+
+def _count(statuses) -> dict[str, int]:
+    out: dict[str, int] = {}
+    for s in statuses:
+        out[s] = out.get(s, 0) + 1
+    return out
+
+
+class RolloutScheduler:
+    """Dispatches rollout waves from command-result and heartbeat events.
+
+    Nothing polls: a rollout advances when one of its commands reports a
+    result, when a gated agent sends its next heartbeat (or the gate times
+    out), when a queued command stays unclaimed past ``claim_timeout``
+    (offline agent), or when an operator resumes it. Each step dispatches
+    as many waiting targets of the current wave as the per-group in-flight
+    limit allows, and a wave starts only once the previous one is fully
+    settled. Completed and aborted runs are dropped from ``runs`` once none
+    of their commands is in flight; the DB keeps their final state.
+    """
+
+    def __init__(self, engine: Engine, run_db: RunDb, notify: Callable[[str], None], group_of: Callable[[str], Optional[str]]) -> None:
+        self.engine = engine
+        self.run_db = run_db
+        self.notify = notify
+        self.group_of = group_of
+        self.runs: dict[str, RolloutRun] = {}
+        self._by_command: dict[str, tuple[str, str]] = {}  # command_id -> (rollout, agent)
+        self._verifying: dict[str, set[str]] = {}  # agent -> rollouts waiting for its heartbeat
+        self._timers: dict[tuple[str, str], asyncio.TimerHandle] = {}
+        self._lock = asyncio.Lock()
+
+    # ---- persistence (run in the DB executor) ----
+
+    def _db_create(self, run: RolloutRun, user: Optional[str]) -> None:
+        with Session(self.engine) as session:
+            session.add(Rollout(id=run.id, payload=json.dumps(run.payload), spec=json.dumps(run.spec.__dict__), created_by=user))
+            # progress is also readable through the fan-out job endpoint
+            session.add(FanoutJob(id=run.id, payload=json.dumps(run.payload), target=json.dumps({"rollout": run.id}), total=len(run.targets), created_by=user))
+            session.execute(insert(RolloutTarget), [
+                {"rollout_id": run.id, "agent_id": t.agent_id, "group": t.group, "wave": t.wave, "status": t.status}
+                for t in run.targets.values()
+            ])
+            session.commit()
+
+    def _db_dispatch(self, run: RolloutRun, targets: list[Target]) -> None:
+        encoded = json.dumps(run.payload)
+        kind = run.payload.get("command") or ""
+        now = datetime.utcnow()
+        with Session(self.engine) as session:
+            session.execute(insert(Command), [
+                {"command_id": t.command_id, "agent_id": t.agent_id, "payload": encoded, "kind": kind, "job_id": run.id, "status": "pending"}
+                for t in targets
+            ])
+            for t in targets:
+                session.execute(
+                    update(RolloutTarget)
+                    .where(RolloutTarget.rollout_id == run.id, RolloutTarget.agent_id == t.agent_id)
+                    .values(status=t.status, command_id=t.command_id, updated_at=now)
+                )
+            self._db_save_run(session, run)
+            session.commit()
+
+    def _db_save(self, run: RolloutRun, targets: list[Target]) -> None:
+        now = datetime.utcnow()
+        with Session(self.engine) as session:
+            for t in targets:
+                session.execute(
+                    update(RolloutTarget)
+                    .where(RolloutTarget.rollout_id == run.id, RolloutTarget.agent_id == t.agent_id)
+                    .values(status=t.status, detail=t.detail, updated_at=now)
+                )
+            self._db_save_run(session, run)
+            session.commit()
+
+    @staticmethod
+    def _db_save_run(session: Session, run: RolloutRun) -> None:
+        session.execute(
+            update(Rollout).where(Rollout.id == run.id)
+            .values(state=run.state, wave=run.wave, reason=run.reason, updated_at=datetime.utcnow())
+        )
+
+    def _db_expire_unclaimed(self, command_id: str, timeout: int) -> bool:
+        """Cancel ``command_id`` if it has been pending for ``timeout`` seconds; True if it was."""
+        now = datetime.utcnow()
+        with Session(self.engine) as session:
+            res = session.execute(
+                update(Command)
+                .where(Command.command_id == command_id, Command.status == "pending", Command.updated_at <= now - timedelta(seconds=timeout))
+                .values(status="cancelled", updated_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+        return bool(res.rowcount)
+
+    def _db_cancel_pending(self, run: RolloutRun) -> list[str]:
+        """Cancel commands of the rollout not yet claimed; returns their ids."""
+        with Session(self.engine) as session:
+            ids = list(session.exec(select(Command.command_id).where(Command.job_id == run.id, Command.status == "pending")).all())
+            session.execute(
+                update(Command).where(Command.job_id == run.id, Command.status == "pending")
+                .values(status="cancelled", updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+        return ids
+
+    @staticmethod
+    def _restore(session: Session, r: Rollout, settled: Optional[list[Target]] = None) -> RolloutRun:
+        run = RolloutRun(r.id, json.loads(r.payload), RolloutSpec(**json.loads(r.spec)), r.state, r.wave, r.reason)
+        rows = session.exec(select(RolloutTarget).where(RolloutTarget.rollout_id == r.id).order_by(RolloutTarget.id)).all()
+        finals = dict(session.exec(select(Command.command_id, Command.status).where(Command.job_id == r.id, Command.status.not_in(("pending", "running")))).all())
+        for row in rows:
+            t = Target(row.agent_id, row.group, row.wave, row.status, row.command_id, row.detail)
+            if t.status == "queued" and t.command_id in finals:
+                # settled while the server was down: no heartbeat gate to replay
+                t.status = "succeeded" if finals[t.command_id] == "success" else "failed"
+                t.detail = None if t.status == "succeeded" else f"command {finals[t.command_id]}"
+            elif t.status == "verifying":
+                t.status = "succeeded"
+            run.add(t)
+            if settled is not None and t.status != row.status:
+                settled.append(t)
+        return run
+
+    def _db_load(self) -> list[tuple[RolloutRun, list[Target]]]:
+        with Session(self.engine) as session:
+            out = []
+            for r in session.exec(select(Rollout).where(Rollout.state.in_(("running", "paused")))).all():
+                settled: list[Target] = []
+                out.append((self._restore(session, r, settled), settled))
+            return out
+
+    async def load(self) -> None:
+        """Rebuild active rollouts at startup and carry on with the running ones.
+
+        Results that arrived while down are applied (and count toward the
+        failure threshold), then each running rollout is pumped: its current
+        wave may have settled meanwhile, or have targets held back by
+        ``max_in_flight`` that nothing else would dispatch.
+        """
+        for run, settled in await self.run_db(self._db_load):
+            async with self._lock:
+                for t in run.targets.values():
+                    if t.status == "queued" and t.command_id:
+                        self._by_command[t.command_id] = (run.id, t.agent_id)
+                        self._arm(run, t.agent_id, run.spec.claim_timeout, self._claim_timeout)
+                self.runs[run.id] = run
+                state = run.state
+                self._check_failures(run)
+                if settled or run.state != state:
+                    await self.run_db(self._db_save, run, settled)
+                await self._pump(run)
+
+    def read(self, rid: str, active_only: bool = True) -> Optional[RolloutRun]:
+        """A rollout as stored, e.g. one driven by another server worker or already over (blocking)."""
+        with Session(self.engine) as session:
+            r = session.get(Rollout, rid)
+            if r is None or (active_only and r.state not in ("running", "paused")):
+                return None
+            return self._restore(session, r)
+
+    # ---- operations ----
+
+    async def create(self, agent_ids: list[str], payload: dict[str, Any], spec: RolloutSpec, user: Optional[str] = None) -> RolloutRun:
+        run = RolloutRun(str(uuid.uuid4()), payload, spec)
+        for wave, ids in enumerate(plan_waves(list(dict.fromkeys(agent_ids)), spec.waves)):
+            for a in ids:
+                run.add(Target(a, self.group_of(a), wave))
+        async with self._lock:
+            await self.run_db(self._db_create, run, user)
+            self.runs[run.id] = run
+            await self._pump(run)
+        return run
+
+    async def _pump(self, run: RolloutRun) -> None:
+        """Dispatch what the current wave and in-flight limits allow (caller holds the lock)."""
+        while run.state == "running":
+            if run.wave >= len(run.waves):
+                run.state = "completed"
+                await self.run_db(self._db_save, run, [])
+                self._retire(run)
+                return
+            batch: list[Target] = []
+            for a in run.waves[run.wave]:
+                t = run.targets[a]
+                if t.status != "waiting":
+                    continue
+                limit = run.spec.max_in_flight
+                if limit and run.in_flight.get(t.group, 0) >= limit:
+                    continue
+                t.status, t.command_id = "queued", str(uuid.uuid4())
+                run.in_flight[t.group] = run.in_flight.get(t.group, 0) + 1
+                self._by_command[t.command_id] = (run.id, a)
+                batch.append(t)
+            if batch:
+                await self.run_db(self._db_dispatch, run, batch)
+                for t in batch:
+                    self._arm(run, t.agent_id, run.spec.claim_timeout, self._claim_timeout)
+                    self.notify(t.agent_id)
+            if any(run.targets[a].status not in TERMINAL for a in run.waves[run.wave]):
+                return
+            run.wave += 1
+
+    def _arm(self, run: RolloutRun, agent_id: str, delay: float, fn: Callable[[str, str], Awaitable[None]]) -> None:
+        """(Re)start the single timer of a target: claim deadline while queued, health gate while verifying."""
+        old = self._timers.pop((run.id, agent_id), None)
+        if old is not None:
+            old.cancel()
+        rid = run.id
+        self._timers[(rid, agent_id)] = asyncio.get_running_loop().call_later(delay, lambda: asyncio.ensure_future(fn(rid, agent_id)))
+
+    def _retire(self, run: RolloutRun) -> None:
+        """Forget a completed/aborted run once nothing of it is in flight."""
+        if run.state not in ("completed", "aborted") or any(t.status in ACTIVE for t in run.targets.values()):
+            return
+        self.runs.pop(run.id, None)
+        for t in run.targets.values():
+            self._by_command.pop(t.command_id or "", None)
+            timer = self._timers.pop((run.id, t.agent_id), None)
+            if timer is not None:
+                timer.cancel()
+
+    def _settle(self, run: RolloutRun, t: Target, status: str, detail: Optional[str] = None) -> None:
+        if t.status in ACTIVE:
+            run.in_flight[t.group] = max(0, run.in_flight.get(t.group, 0) - 1)
+        t.status, t.detail = status, detail
+        timer = self._timers.pop((run.id, t.agent_id), None)
+        if timer is not None:
+            timer.cancel()
+        waiting = self._verifying.get(t.agent_id)
+        if waiting is not None:
+            waiting.discard(run.id)
+            if not waiting:
+                del self._verifying[t.agent_id]
+        if status == "failed":
+            self._check_failures(run)
+        # last in-flight target of an aborted run
+        self._retire(run)
+
+    @staticmethod
+    def _check_failures(run: RolloutRun) -> None:
+        if run.state != "running":
+            return
+        rate = run.failure_rate()
+        if rate is not None and rate > run.spec.failure_threshold:
+            run.state = "paused"
+            run.reason = f"failure rate {rate:.0%} above {run.spec.failure_threshold:.0%}"
+
+    async def on_result(self, command_id: str, status: str) -> None:
+        ref = self._by_command.pop(command_id, None)
+        if ref is None:
+            return
+        async with self._lock:
+            run = self.runs.get(ref[0])
+            t = run.targets.get(ref[1]) if run else None
+            if run is None or t is None or t.status != "queued":
+                return
+            if status != "success":
+                self._settle(run, t, "failed", f"command {status}")
+            elif run.spec.health_gate:
+                t.status = "verifying"
+                self._verifying.setdefault(t.agent_id, set()).add(run.id)
+                self._arm(run, t.agent_id, run.spec.health_timeout, self._gate_timeout)
+            else:
+                self._settle(run, t, "succeeded")
+            await self.run_db(self._db_save, run, [t])
+            await self._pump(run)
+
+    def awaiting(self, agent_id: str) -> bool:
+        return agent_id in self._verifying
+
+    async def on_heartbeat(self, agent_id: str, apps: dict[str, Any]) -> None:
+        if agent_id not in self._verifying:
+            return
+        async with self._lock:
+            for rid in list(self._verifying.get(agent_id, ())):
+                run = self.runs[rid]
+                t = run.targets[agent_id]
+                if is_healthy(apps, run.payload.get("app")):
+                    self._settle(run, t, "succeeded")
+                else:
+                    self._settle(run, t, "failed", "unhealthy after command")
+                await self.run_db(self._db_save, run, [t])
+                await self._pump(run)
+
+    async def _gate_timeout(self, rid: str, agent_id: str) -> None:
+        async with self._lock:
+            run = self.runs.get(rid)
+            t = run.targets.get(agent_id) if run else None
+            if run is None or t is None or t.status != "verifying":
+                return
+            self._settle(run, t, "failed", "no heartbeat after command")
+            await self.run_db(self._db_save, run, [t])
+            await self._pump(run)
+
+    async def _claim_timeout(self, rid: str, agent_id: str) -> None:
+        async with self._lock:
+            run = self.runs.get(rid)
+            t = run.targets.get(agent_id) if run else None
+            if run is None or t is None or t.status != "queued" or not t.command_id:
+                return
+            self._timers.pop((rid, agent_id), None)
+            timeout = run.spec.claim_timeout
+            if not await self.run_db(self._db_expire_unclaimed, t.command_id, timeout):
+                # claimed (or requeued after a lost lease less than timeout ago): check again later
+                self._arm(run, agent_id, timeout, self._claim_timeout)
+                return
+            self._by_command.pop(t.command_id, None)
+            # counts toward failure_threshold like any failure: an offline canary pauses the rollout
+            self._settle(run, t, "failed", f"not claimed within {timeout}s")
+            await self.run_db(self._db_save, run, [t])
+            await self._pump(run)
+
+    async def pause(self, rid: str, reason: str = "paused by operator") -> Optional[RolloutRun]:
+        async with self._lock:
+            run = self.runs.get(rid)
+            if run is not None and run.state == "running":
+                run.state, run.reason = "paused", reason
+                await self.run_db(self._db_save, run, [])
+            return run
+
+    async def resume(self, rid: str) -> Optional[RolloutRun]:
+        async with self._lock:
+            run = self.runs.get(rid)
+            if run is not None and run.state == "paused":
+                run.state, run.reason = "running", None
+                await self.run_db(self._db_save, run, [])
+                await self._pump(run)
+            return run
+
+    async def abort(self, rid: str, reason: str = "aborted by operator") -> Optional[RolloutRun]:
+        async with self._lock:
+            run = self.runs.get(rid)
+            if run is None or run.state in ("completed", "aborted"):
+                return run
+            run.state, run.reason = "aborted", reason
+            cancelled = set(await self.run_db(self._db_cancel_pending, run))
+            changed = []
+            for t in run.targets.values():
+                if t.status == "waiting" or (t.status == "queued" and t.command_id in cancelled):
+                    self._by_command.pop(t.command_id or "", None)
+                    self._settle(run, t, "cancelled")
+                    changed.append(t)
+            await self.run_db(self._db_save, run, changed)
+            self._retire(run)
+            return run
@@ -0,0 +1,160 @@
+import bisect
+import json
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Iterable, Optional
+
+
+class SnapshotEntry:
+    """One agent as served by ``/api/agents``, with its static part pre-encoded."""
+
+    __slots__ = ("id", "revision", "last_seen", "status", "apps_state", "os_update", "agent_version", "encoded")
+
+    def __init__(self, agent_id: str) -> None:
+        self.id = agent_id
+        self.revision = 0
+        self.last_seen = datetime.utcnow()
+        self.status = "online"
+        self.apps_state: Any = None
+        self.os_update: Any = None
+        self.agent_version: Optional[str] = None
+        self.encoded = ""
+
+    def encode(self) -> None:
+        os_update = self.os_update if isinstance(self.os_update, dict) else {}
+        fields = {
+            "id": self.id,
+            "status": self.status,
+            "apps_state": self.apps_state,
+            "os_update": self.os_update,
+            "agent_version": self.agent_version,
+            "outdated": (os_update.get("upgrades") or 0) > 0,
+        }
+        # open object: last_seen/uptime_seconds are appended at serve time
+        self.encoded = json.dumps(fields)[:-1] + ", "
+
+    def render(self, now: datetime) -> str:
+        uptime = max(0, int((now - self.last_seen).total_seconds()))
+        return f'{self.encoded}"last_seen": "{self.last_seen.isoformat()}", "uptime_seconds": {uptime}}}'
+
+
+class FleetSnapshot:
+    """In-memory copy of the fleet kept current by heartbeat ingestion.
+
+    Every state or status change bumps a global ``revision`` and re-encodes
+    only that agent, so listing the fleet is a join of cached fragments.
+    With several workers the revision of a change is allocated once, from a
+    counter on the bus, and travels with the event so every worker files the
+    change under the same number.
+    Liveness-only heartbeats move ``last_seen`` without bumping the revision:
+    the revision tracks what dashboards react to, like the WebSocket feed
+    does. They bump ``touches`` instead, which the ETag also covers since
+    ``last_seen`` is part of the body.
+    """
+
+    def __init__(self) -> None:
+        self.revision = 0
+        self.touches = 0
+        self.tag = ""  # distinguishes workers in the ETag
+        self.entries: dict[str, SnapshotEntry] = {}
+        self.ids: list[str] = []  # sorted, for cursor pagination
+        # agent ids ordered by the revision of their last change (oldest first)
+        self.changes: OrderedDict[str, int] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def version(self) -> str:
+        """Changes whenever any served field does (except the serve-time ``uptime_seconds``)."""
+        return f"{self.tag}{self.revision}.{self.touches}"
+
+    @property
+    def etag(self) -> str:
+        return f'W/"{self.version}"'
+
+    def load(self, rows: Iterable[Any]) -> None:
+        """Seed from Agent rows (JSON columns are parsed here, once)."""
+        for a in rows:
+            self.update(
+                a.id,
+                last_seen=a.last_seen,
+                status=a.status,
+                apps_state=json.loads(a.apps_state) if a.apps_state else None,
+                os_update=json.loads(a.os_update) if a.os_update else None,
+                agent_version=a.agent_version,
+                revision=0,  # part of any later full listing, never of a ``since`` delta
+            )
+
+    def _entry(self, agent_id: str) -> SnapshotEntry:
+        e = self.entries.get(agent_id)
+        if e is None:
+            e = self.entries[agent_id] = SnapshotEntry(agent_id)
+            bisect.insort(self.ids, agent_id)
+        return e
+
+    def update(self, agent_id: str, last_seen: Optional[datetime] = None, status: Optional[str] = None, apps_state: Any = None, os_update: Any = None, agent_version: Optional[str] = None, revision: Optional[int] = None) -> int:
+        """Apply a change under ``revision`` (shared counter), or the next local one."""
+        e = self._entry(agent_id)
+        if last_seen is not None:
+            e.last_seen = last_seen
+        if status is not None:
+            e.status = status
+        if apps_state is not None:
+            e.apps_state = apps_state
+        if os_update is not None:
+            e.os_update = os_update
+        if agent_version is not None:
+            e.agent_version = agent_version
+        e.encode()
+        if revision is None:
+            revision = self.revision + 1
+        self.revision = max(self.revision, revision)
+        e.revision = revision
+        self.changes.pop(agent_id, None)
+        tail = next(reversed(self.changes.values()), 0)
+        self.changes[agent_id] = revision
+        if revision < tail:
+            # delivered after a later change from another worker: keep the log ordered
+            self.changes = OrderedDict(sorted(self.changes.items(), key=lambda kv: kv[1]))
+        return revision
+
+    def touch(self, agent_id: str, last_seen: datetime) -> None:
+        e = self.entries.get(agent_id)
+        if e is not None:
+            e.last_seen = last_seen
+            self.touches += 1
+
+    def get(self, agent_id: str) -> Optional[SnapshotEntry]:
+        return self.entries.get(agent_id)
+
+    def uptime_seconds(self, now: Optional[datetime] = None) -> dict[str, int]:
+        """Seconds since each agent's last heartbeat, as rendered in ``/api/agents``."""
+        now = now or datetime.utcnow()
+        return {e.id: max(0, int((now - e.last_seen).total_seconds())) for e in self.entries.values()}
+
+    def page(self, cursor: Optional[str] = None, limit: Optional[int] = None) -> tuple[list[SnapshotEntry], Optional[str]]:
+        """Agents by id after ``cursor``; returns the page and the next cursor."""
+        start = bisect.bisect_right(self.ids, cursor) if cursor else 0
+        end = len(self.ids) if limit is None else min(len(self.ids), start + limit)
+        ids = self.ids[start:end]
+        nxt = ids[-1] if ids and end < len(self.ids) else None
+        return [self.entries[i] for i in ids], nxt
+
+    def since(self, revision: int) -> list[SnapshotEntry]:
+        """Agents changed after ``revision``, walking the change log from the newest end."""
+        out: list[SnapshotEntry] = []
+        for agent_id in reversed(self.changes):
+            if self.changes[agent_id] <= revision:
+                break
+            out.append(self.entries[agent_id])
+        out.reverse()
+        return out
+
+    @staticmethod
+    def render(entries: Iterable[SnapshotEntry], now: Optional[datetime] = None) -> str:
+        now = now or datetime.utcnow()
+        return "[" + ", ".join(e.render(now) for e in entries) + "]"
+
+
+fleet_snapshot = FleetSnapshot()
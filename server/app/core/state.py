@@ -0,0 +1,61 @@
+import hashlib
+import json
+from dataclasses import dataclass, field
+from typing import Any, Optional
+from sqlalchemy import Engine
+from sqlmodel import Session
+from ..db.models import Agent
+
+
+def state_hash(apps: dict[str, Any], os_update: Any) -> str:
+    """Stable digest of an agent's reported state (what delta beats are based on)."""
+    blob = json.dumps({"apps": apps, "os_update": os_update}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class AgentState:
+    apps: dict[str, Any] = field(default_factory=dict)
+    os_update: Any = None
+    hash: str = ""
+
+    def rehash(self) -> str:
+        self.hash = state_hash(self.apps, self.os_update)
+        return self.hash
+
+
+class AgentStateCache:
+    """Last known apps/os_update state per agent, seeded from the DB on first use.
+
+    The heartbeat handler applies full or delta beats against this copy and
+    only writes/broadcasts when the resulting hash changes.
+    """
+
+    def __init__(self, engine: Engine) -> None:
+        self.engine = engine
+        self._states: dict[str, AgentState] = {}
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def peek(self, agent_id: str) -> Optional[AgentState]:
+        return self._states.get(agent_id)
+
+    def load(self, agent_id: str) -> Optional[AgentState]:
+        """Return the cached state, reading the Agent row on a miss (blocking)."""
+        st = self._states.get(agent_id)
+        if st is not None:
+            return st
+        with Session(self.engine) as session:
+            agent = session.get(Agent, agent_id)
+            if agent is None:
+                return None
+            st = AgentState(
+                apps=json.loads(agent.apps_state) if agent.apps_state else {},
+                os_update=json.loads(agent.os_update) if agent.os_update else None,
+            )
+        st.rehash()
+        return self._states.setdefault(agent_id, st)
+
+    def put(self, agent_id: str, st: AgentState) -> None:
+        self._states[agent_id] = st
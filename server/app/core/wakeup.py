@@ -0,0 +1,54 @@
+import asyncio
+from typing import Optional
+
+
+class AgentWakeups:
+    """In-process wakeup signals for long-polling ``next-command``.
+
+    A poller registers before checking the queue, so a command enqueued
+    between the check and the wait is never missed. ``notify`` may be called
+    from worker threads (sync endpoints run in a threadpool).
+    """
+
+    def __init__(self) -> None:
+        self._waiters: dict[str, set[asyncio.Event]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+
+    def register(self, agent_id: str) -> asyncio.Event:
+        ev = asyncio.Event()
+        self._waiters.setdefault(agent_id, set()).add(ev)
+        return ev
+
+    def unregister(self, agent_id: str, ev: asyncio.Event) -> None:
+        waiters = self._waiters.get(agent_id)
+        if waiters is None:
+            return
+        waiters.discard(ev)
+        if not waiters:
+            self._waiters.pop(agent_id, None)
+
+    def _wake(self, agent_id: str) -> None:
+        for ev in self._waiters.get(agent_id, ()):
+            ev.set()
+
+    def notify(self, agent_id: str) -> None:
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._wake(agent_id)
+        else:
+            loop.call_soon_threadsafe(self._wake, agent_id)
+
+    def __len__(self) -> int:
+        return sum(len(w) for w in self._waiters.values())
+
+
+wakeups = AgentWakeups()
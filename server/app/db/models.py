@@ -1,20 +1,31 @@
 from datetime import datetime
 from typing import Optional
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 
 
 class Agent(SQLModel, table=True):
     id: str = Field(primary_key=True)
-    last_seen: datetime = Field(default_factory=datetime.utcnow)
+    last_seen: datetime = Field(default_factory=datetime.utcnow, index=True)
     status: str = Field(default="online")
     apps_state: Optional[str] = None  # JSON string of apps state snapshot
     psk_hash: Optional[str] = None
     os_update: Optional[str] = None  # JSON string of OS update status
+    # Extracted from os_update at ingest so /api/agents can filter on indexes
+    hostname: Optional[str] = Field(default=None, index=True)
+    os_version: Optional[str] = Field(default=None, index=True)
+    kernel: Optional[str] = Field(default=None, index=True)
+    arch: Optional[str] = Field(default=None, index=True)
+    upgrades: Optional[int] = Field(default=None, index=True)
+    sudo_apt_ok: Optional[bool] = Field(default=None, index=True)
+    poll_interval: Optional[int] = None  # reported by the agent; sets its offline deadline
+    agent_version: Optional[str] = None  # reported by the agent with each heartbeat
 
 
 class Deployment(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     agent_id: str
+    command_id: Optional[str] = Field(default=None, index=True)  # Command that performed it
     app_name: str
     status: str
     started_at: datetime = Field(default_factory=datetime.utcnow)
@@ -31,11 +42,107 @@ class DesiredState(SQLModel, table=True):
 
 
 class Command(SQLModel, table=True):
+    __table_args__ = (
+        # next-command claim: oldest pending row for one agent
+        Index("ix_command_agent_status_created", "agent_id", "status", "created_at"),
+        # lease sweep: running rows whose lease has expired
+        Index("ix_command_status_lease", "status", "lease_expires_at"),
+        # metrics: most recent commands fleet-wide
+        Index("ix_command_created", "created_at"),
+        # retention: finished rows by age, newest per agent/type
+        Index("ix_command_status_updated", "status", "updated_at"),
+        Index("ix_command_agent_kind_created", "agent_id", "kind", "created_at"),
+        # fan-out progress: status counts per job
+        Index("ix_command_job_status", "job_id", "status"),
+        # history: keyset pages per agent and fleet-wide by status
+        Index("ix_command_agent_created", "agent_id", "created_at", "id"),
+        Index("ix_command_status_created", "status", "created_at", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    command_id: str
+    command_id: str = Field(index=True)
     agent_id: str
     payload: str  # JSON payload (e.g., commands)
-    status: str = Field(default="pending")  # pending|running|success|failed
-    output: Optional[str] = None
+    kind: Optional[str] = None  # payload["command"], e.g. apt_upgrade
+    job_id: Optional[str] = None  # FanoutJob that created this command, if any
+    status: str = Field(default="pending")  # pending|running|success|failed|timeout|cancelled (final status reported by the agent)
+    output: Optional[str] = None  # legacy inline output; new output goes to CommandOutput
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    lease_expires_at: Optional[datetime] = None  # set while running; expired -> back to pending
+    started_at: Optional[datetime] = None  # last claim by the agent
+    attempt: Optional[int] = None  # claims so far; the agent tags its output chunks with it
+    output_base: Optional[int] = None  # max CommandOutput.seq at the last claim; that run's seqs start after it
+    finished_at: Optional[datetime] = None
+    duration: Optional[int] = None  # seconds, as measured by the agent
+    exit_code: Optional[int] = None  # of the last step run
+
+
+class FanoutJob(SQLModel, table=True):
+    """One bulk enqueue: the same payload queued for many agents."""
+
+    id: str = Field(primary_key=True)
+    payload: str  # JSON payload shared by every command of the job
+    target: str  # JSON description of how agents were selected
+    total: int = 0
+    created_by: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class Rollout(SQLModel, table=True):
+    """Wave-based rollout of one payload; its commands carry ``job_id == id``."""
+
+    id: str = Field(primary_key=True)
+    payload: str  # JSON payload queued for each target
+    spec: str  # JSON: waves, max_in_flight, failure_threshold, health_gate, health_timeout
+    state: str = Field(default="running", index=True)  # running|paused|completed|aborted
+    wave: int = 0  # index of the wave being dispatched
+    reason: Optional[str] = None  # why it paused/aborted
+    created_by: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class RolloutTarget(SQLModel, table=True):
+    __table_args__ = (
+        Index("ux_rollout_target", "rollout_id", "agent_id", unique=True),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    rollout_id: str
+    agent_id: str
+    group: Optional[str] = None  # desired state group, for per-group in-flight limits
+    wave: int = 0
+    status: str = "waiting"  # waiting|queued|verifying|succeeded|failed|cancelled
+    command_id: Optional[str] = None
+    detail: Optional[str] = None
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class CommandOutput(SQLModel, table=True):
+    """Append-only output chunks of a command, replayed in ``seq`` order."""
+
+    __table_args__ = (
+        Index("ux_command_output_cmd_seq", "command_id", "seq", unique=True),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    command_id: str
+    seq: int
+    data: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class CommandArchive(SQLModel, table=True):
+    """Compressed output of a finished command, replacing its CommandOutput rows.
+
+    ``data`` is the JSON list of ``[seq, chunk]`` pairs (seq 0 holds output
+    stored inline by older versions), compressed with ``codec``.
+    """
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    command_id: str = Field(index=True, unique=True)
+    codec: str  # zstd | gzip
+    data: bytes
+    raw_bytes: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -1,10 +1,100 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
 from sqlmodel import SQLModel, create_engine
 from . import models  # noqa: F401
 from ..config import settings
 
+T = TypeVar("T")
 
-engine = create_engine(settings.database_url, echo=False)
+
+def _sqlite_profile(engine: Engine) -> None:
+    """Per-connection pragmas for concurrent readers/writers on one SQLite file."""
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_conn, _record) -> None:
+        cur = dbapi_conn.cursor()
+        # only effective on a new database file; lets retention hand pages back
+        cur.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cur.execute("PRAGMA journal_mode=WAL")  # readers no longer block the writer
+        cur.execute("PRAGMA synchronous=NORMAL")  # fsync at checkpoints, safe with WAL
+        cur.execute(f"PRAGMA busy_timeout={settings.sqlite_busy_timeout_ms}")
+        cur.execute(f"PRAGMA cache_size=-{settings.sqlite_cache_mb * 1024}")
+        cur.execute(f"PRAGMA mmap_size={settings.sqlite_mmap_mb * 1024 * 1024}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.close()
+
+
+def make_engine(url: str) -> Engine:
+    # pool_size connections for the run_db threads, the overflow for sync handlers
+    # in the threadpool (capped to db_sync_threads at startup): checkouts never wait
+    if url.startswith("sqlite") and ":memory:" not in url:
+        eng = create_engine(
+            url,
+            echo=False,
+            connect_args={"check_same_thread": False},
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_sync_threads,
+            pool_timeout=30,
+        )
+        _sqlite_profile(eng)
+        return eng
+    return create_engine(url, echo=False, pool_pre_ping=True, pool_size=settings.db_pool_size, max_overflow=settings.db_sync_threads)
+
+
+engine = make_engine(settings.database_url)
+
+# Dedicated threads for blocking DB work issued from async handlers: sized to
+# the connection pool so callers queue here rather than on pool checkout.
+_db_executor = ThreadPoolExecutor(max_workers=settings.db_pool_size, thread_name_prefix="db")
+
+
+def db_backlog() -> int:
+    """DB calls from async handlers waiting for a free worker thread."""
+    return _db_executor._work_queue.qsize()
+
+
+async def run_db(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a synchronous DB function without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(fn, *args, **kwargs))
+
+
+def _ensure_schema(bind) -> None:
+    """Bring tables created by older versions up to date.
+
+    ``create_all`` only creates missing tables, so columns and indexes added
+    to existing models afterwards are applied here (additive changes only).
+    """
+    insp = inspect(bind)
+    for table in SQLModel.metadata.sorted_tables:
+        if not insp.has_table(table.name):
+            continue
+        existing = {c["name"] for c in insp.get_columns(table.name)}
+        with bind.begin() as conn:
+            for col in table.columns:
+                if col.name in existing:
+                    continue
+                ddl = col.type.compile(dialect=bind.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{col.name}" {ddl}'))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
 
 
 def init_db() -> None:
-    SQLModel.metadata.create_all(engine)
+    # several server workers may start at once: the loser of a DDL race
+    # ("already exists", "duplicate column") retries and finds it done
+    for attempt in range(3):
+        try:
+            SQLModel.metadata.create_all(engine)
+            _ensure_schema(engine)
+            return
+        except OperationalError:
+            if attempt == 2:
+                raise
+            time.sleep(0.2 * (attempt + 1))
@@ -1,21 +1,42 @@
 from fastapi import FastAPI, Header, HTTPException, Request, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import StreamingResponse, FileResponse, PlainTextResponse, Response
 from fastapi import WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
 import os
+import anyio.to_thread
 from sqlmodel import Session, select
+from sqlalchemy import bindparam, func, update
 from .config import settings
 from .utils.hmac import verify_signature
-from .db.session import engine, init_db
-from .db.models import Agent, Command
-from .schemas.protocol import HeartbeatPayload, CommandResult, CommandChunk
+from .utils import wire
+from .db.session import db_backlog, engine, init_db, run_db
+from .db.models import Agent, Command, Rollout
+from .schemas.protocol import HeartbeatPayload, CommandResult, CommandChunk, CommandChunkBatch, BulkCommandRequest, RolloutRequest
 from .core.security import create_access_token, decode_token, verify_password
+from .core.queue import claim_next, extend_lease, finish, requeue_expired
+from .core.retention import Retention, RetentionPolicy
+from .core.fanout import enqueue_many, job_progress
+from .core.rollout import RolloutScheduler, RolloutSpec, plan_waves
+from .core.output import output_store
+from .core.hub import CommandHub, END, KEEPALIVE
+from .core.broadcast import WsBroadcaster
+from .core.wakeup import wakeups
+from .core.ingest import HeartbeatBuffer, PendingHeartbeat, os_columns
+from .core.state import AgentState, AgentStateCache
+from .core.metrics import fleet_metrics
+from .core.snapshot import fleet_snapshot
+from .core.drift import DesiredStateFile, DriftEngine
+from .core.bus import make_bus
+from .core.liveness import LivenessTracker
+from .core.instrument import Instrumentation, TimingMiddleware
+from .core.profiler import stack_sampler
 import json
-from datetime import datetime
+from datetime import datetime, timezone
 import asyncio
 import uuid
 import time
+import zlib
 from typing import Dict, Any
 
 
@@ -29,6 +50,51 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
+instrumentation = Instrumentation(enabled=settings.instrumentation)
+if instrumentation.enabled:
+    app.add_middleware(TimingMiddleware, recorder=instrumentation)
+    instrumentation.install_db(engine)
+
+heartbeat_buffer = HeartbeatBuffer(
+    engine,
+    flush_ms=settings.heartbeat_flush_ms,
+    batch_size=settings.heartbeat_flush_batch,
+    max_pending=settings.heartbeat_buffer_max,
+    run_db=run_db,
+)
+
+agent_states = AgentStateCache(engine)
+desired_state = DesiredStateFile(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", settings.desired_state_path)))
+drift_engine = DriftEngine(desired_state)
+command_hub = CommandHub()
+liveness = LivenessTracker(
+    grace=settings.offline_after_intervals,
+    min_timeout=settings.offline_min_seconds,
+    default_interval=settings.agent_default_poll_interval,
+)
+
+
+def _default_bus_url() -> str:
+    # several uvicorn workers on one host: share events through a file next to the database
+    if int(os.getenv("WEB_CONCURRENCY", "1")) > 1 and settings.database_url.startswith("sqlite:///"):
+        return settings.database_url + ".bus"
+    return "local"
+
+
+# Cross-worker events (dashboard updates, command output, long-poll wakeups)
+# and shared state (login rate limits); a no-op with a single worker
+bus = make_bus(settings.bus_url or _default_bus_url())
+
+
+def notify_agents(*agent_ids: str) -> None:
+    """Wake the long-polls of ``agent_ids`` on every worker (callable from threads)."""
+    for agent_id in agent_ids:
+        wakeups.notify(agent_id)
+    bus.publish("wake", list(agent_ids))
+
+
+rollouts = RolloutScheduler(engine, run_db, notify_agents, lambda agent_id: desired_state.current.group_of(agent_id))
+
 # Note: Static UI mount is added at the end of this file to avoid
 # intercepting API routes (e.g., POST /api/auth/login) with a 405.
 
@@ -48,29 +114,246 @@ def _startup():
     if missing:
         raise RuntimeError(f"Missing required environment/config for production: {', '.join(missing)}")
     init_db()
+    # seed in-memory fleet views once; heartbeats keep them current afterwards
+    with Session(engine) as session:
+        agents = session.exec(select(Agent)).all()
+        # rows reported before os_update attributes had their own columns
+        stale = [a for a in agents if a.os_update and a.hostname is None and a.os_version is None and a.upgrades is None]
+        for a in stale:
+            try:
+                for k, v in os_columns(json.loads(a.os_update)).items():
+                    setattr(a, k, v)
+                session.add(a)
+            except Exception:
+                pass
+        if stale:
+            session.commit()
+    fleet_metrics.seed_agents((a.id, a.status) for a in agents)
+    liveness.seed(((a.id, _epoch(a.last_seen), a.poll_interval) for a in agents if a.status == "online"), time.time())
+    fleet_snapshot.load(agents)
+    drift_engine.load((e.id, e.apps_state) for e in fleet_snapshot.entries.values())
+
+
+ROLLOUTS_LOAD_KEY = "rollouts-load"
+# snapshot revisions are allocated on the bus so every worker numbers a change alike
+FLEET_REVISION_KEY = "fleet-revision"
+FLEET_REVISION_TTL = 10 * 365 * 86400
+
+
+async def _next_revision() -> int | None:
+    try:
+        return await bus.incr(FLEET_REVISION_KEY, FLEET_REVISION_TTL)
+    except Exception as e:
+        print(f"fleet revision error: {e}")
+        return None  # numbered locally
+
+
+@app.on_event("startup")
+async def _start_lease_sweeper():
+    wakeups.bind(asyncio.get_running_loop())
+    # sync handlers run here; the engine's pool overflow is sized to match
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.db_sync_threads
+    await bus.start(_on_bus_event)
+    if bus.shared:
+        fleet_snapshot.tag = bus.origin + ":"
+    fleet_snapshot.revision = max(fleet_snapshot.revision, int(await bus.get(FLEET_REVISION_KEY) or 0))
+    # one worker resumes the active rollouts; each then drives the ones it created.
+    # Released on shutdown so a fleet restarted within the TTL still resumes them.
+    if await bus.claim(ROLLOUTS_LOAD_KEY, 60):
+        await rollouts.load()
+
+    def requeue() -> int:
+        with Session(engine) as session:
+            return requeue_expired(session)
+
+    async def sweep():
+        while True:
+            await asyncio.sleep(settings.command_lease_sweep_seconds)
+            # with several workers, a single one sweeps per period
+            if not await bus.claim("lease-sweep", settings.command_lease_sweep_seconds * 0.9):
+                continue
+            try:
+                n = await run_db(requeue)
+                if n:
+                    print(f"requeued {n} command(s) with expired lease")
+            except Exception as e:
+                print(f"lease sweep error: {e}")
+
+    async def evict_streams():
+        while True:
+            await asyncio.sleep(30)
+            command_hub.evict()
+
+    retention = Retention(engine, RetentionPolicy(
+        keep_days=settings.retention_keep_days,
+        max_per_agent=settings.retention_max_per_agent,
+        keep_per_type=settings.retention_keep_per_type,
+        archive_after_hours=settings.retention_archive_after_hours,
+        codec=settings.retention_codec,
+    ))
+
+    async def retain():
+        while True:
+            await asyncio.sleep(settings.retention_interval_seconds)
+            if not await bus.claim("retention", settings.retention_interval_seconds * 0.9):
+                continue
+            try:
+                stats = await run_db(retention.run)
+                if stats["archived"] or stats["deleted"]:
+                    print(f"retention: {stats}")
+            except Exception as e:
+                print(f"retention error: {e}")
+
+    async def detect_offline():
+        # deadline heap: only agents whose deadline passed are looked at
+        while True:
+            await asyncio.sleep(1.0)
+            try:
+                # every worker tracks deadlines; a single one marks agents offline per tick
+                if not await bus.claim("offline-detect", 0.9):
+                    continue
+                overdue = liveness.expired(time.time())
+                if overdue:
+                    await _mark_offline(overdue)
+            except Exception as e:
+                print(f"offline detection error: {e}")
+
+    async def share_touches():
+        # liveness-only heartbeats, batched for the other workers' snapshots
+        while True:
+            await asyncio.sleep(1.0)
+            if _touched:
+                batch = [[a, t.isoformat()] for a, t in _touched.items()]
+                _touched.clear()
+                bus.publish("touch", batch)
+
+    asyncio.create_task(sweep())
+    asyncio.create_task(evict_streams())
+    asyncio.create_task(detect_offline())
+    if instrumentation.enabled:
+        asyncio.create_task(instrumentation.monitor_loop())
+    if bus.shared:
+        asyncio.create_task(share_touches())
+    if settings.retention_interval_seconds > 0:
+        asyncio.create_task(retain())
+    heartbeat_buffer.start()
+
+
+@app.on_event("shutdown")
+async def _flush_heartbeats():
+    await heartbeat_buffer.stop()
+    try:
+        await bus.release(ROLLOUTS_LOAD_KEY)
+    except Exception as e:
+        print(f"bus release error: {e}")
+    await bus.stop()
+
+
+def _epoch(dt: datetime) -> float:
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _write_offline(rows: list[dict[str, Any]]) -> None:
+    # skipped for an agent whose newer heartbeat reached the DB meanwhile
+    agents = Agent.__table__
+    with Session(engine) as session:
+        # Core statement: one executemany, not an ORM bulk update by primary key
+        session.connection().execute(
+            update(agents).where(agents.c.id == bindparam("agent_id"), agents.c.last_seen <= bindparam("seen")).values(status="offline"),
+            rows,
+        )
+        session.commit()
+
+
+async def _mark_offline(overdue: list[tuple[str, float]]) -> None:
+    """Flip agents past their heartbeat deadline to offline: one DB batch, pushes for changes only."""
+    rows = [{"agent_id": a, "seen": datetime.utcfromtimestamp(seen)} for a, seen in overdue]
+    await run_db(_write_offline, rows)
+    revision = await _next_revision()
+    _offline_changed(overdue, revision)
+    bus.publish("offline", {"agents": overdue, "rev": revision})
+
+
+def _offline_changed(overdue: list[tuple[str, float]], revision: int | None) -> None:
+    for agent_id, _ in overdue:
+        if not fleet_metrics.set_agent_status(agent_id, "offline"):
+            continue
+        fleet_snapshot.update(agent_id, status="offline", revision=revision)
+        e = fleet_snapshot.get(agent_id)
+        ws_broadcast({
+            "type": "agent_update",
+            "agent": {
+                "id": agent_id,
+                "last_seen": e.last_seen.isoformat() if e and e.last_seen else None,
+                "status": "offline",
+                "apps_state": e.apps_state if e else None,
+                "os_update": e.os_update if e else None,
+                "agent_version": e.agent_version if e else None,
+            }
+        }, key=("agent_update", agent_id))
+
+
+async def _on_bus_event(channel: str, data: Any) -> None:
+    """Apply a change made on another worker to this worker's in-memory views."""
+    if channel == "agent":
+        agent_id = data["id"]
+        state = AgentState(apps=data["apps"], os_update=data["os_update"], hash=data["hash"])
+        agent_states.put(agent_id, state)
+        liveness.beat(agent_id, _epoch(datetime.fromisoformat(data["at"])), data.get("poll_interval"))
+        fleet_metrics.set_agent_status(agent_id, "online")
+        drift_engine.update(agent_id, state.apps)
+        _agent_changed(agent_id, datetime.fromisoformat(data["at"]), state, data.get("agent_version"), data.get("rev"))
+        if rollouts.awaiting(agent_id):
+            await rollouts.on_heartbeat(agent_id, state.apps)
+    elif channel == "touch":
+        for agent_id, at in data:
+            seen = datetime.fromisoformat(at)
+            liveness.beat(agent_id, _epoch(seen))
+            if fleet_metrics.set_agent_status(agent_id, "online"):
+                # back from offline as seen by this worker
+                fleet_snapshot.update(agent_id, last_seen=seen, status="online", revision=await _next_revision())
+            else:
+                fleet_snapshot.touch(agent_id, seen)
+            known = agent_states.peek(agent_id)
+            if known is not None and rollouts.awaiting(agent_id):
+                await rollouts.on_heartbeat(agent_id, known.apps)
+    elif channel == "offline":
+        # marked by the worker running offline detection this tick
+        overdue = [(agent_id, seen) for agent_id, seen in data["agents"] if liveness.forget(agent_id, seen)]
+        _offline_changed(overdue, data.get("rev"))
+    elif channel == "chunk":
+        for seq, text in data["chunks"]:
+            command_hub.publish(data["id"], seq, text)
+    elif channel == "finish":
+        fleet_metrics.command_finished(data["status"], data["duration"])
+        command_hub.finish(data["id"])
+        await rollouts.on_result(data["id"], data["status"])
+    elif channel == "wake":
+        for agent_id in data:
+            wakeups.notify(agent_id)
+    elif channel == "rollout":
+        ops = {"pause": rollouts.pause, "resume": rollouts.resume, "abort": rollouts.abort}
+        await ops[data["action"]](data["id"])
+
+
 # --------- Simple Rate Limiting for Login ---------
-_login_attempts: Dict[str, Dict[str, Any]] = {}
+# Counters live on the bus so every worker enforces the same limit
+LOGIN_ATTEMPTS_TTL = 3600
 
-def _check_login_rate_limit(ip: str) -> None:
-    now = time.time()
-    rec = _login_attempts.get(ip)
-    if rec and rec.get("cooldown_until", 0) > now:
+async def _check_login_rate_limit(ip: str) -> None:
+    if await bus.get(f"login-cooldown:{ip}") is not None:
         raise HTTPException(status_code=429, detail="Too many attempts. Try again later.")
 
-def _register_login_attempt(ip: str, success: bool) -> None:
-    now = time.time()
-    rec = _login_attempts.get(ip) or {"count": 0, "cooldown_until": 0}
+async def _register_login_attempt(ip: str, success: bool) -> None:
     if success:
-        rec["count"] = 0
-        rec["cooldown_until"] = 0
-    else:
-        rec["count"] = rec.get("count", 0) + 1
-        # Escalating cooldown: 5s after 5 attempts, 10s after 10, cap at 60s
-        if rec["count"] >= 5:
-            steps = max(1, rec["count"] // 5)
-            cooldown = min(60, steps * 5)
-            rec["cooldown_until"] = now + cooldown
-    _login_attempts[ip] = rec
+        await bus.delete(f"login-attempts:{ip}", f"login-cooldown:{ip}")
+        return
+    count = await bus.incr(f"login-attempts:{ip}", LOGIN_ATTEMPTS_TTL)
+    # Escalating cooldown: 5s after 5 attempts, 10s after 10, cap at 60s
+    if count >= 5:
+        steps = max(1, count // 5)
+        cooldown = min(60, steps * 5)
+        await bus.set(f"login-cooldown:{ip}", "1", cooldown)
 
 
 @app.get("/api/health")
@@ -100,64 +383,210 @@ def require_user(authorization: str | None = Header(default=None, alias="Authori
 @app.post("/api/auth/login")
 async def auth_login(payload: dict, request: Request):
     ip = request.client.host if request.client else "unknown"
-    _check_login_rate_limit(ip)
+    await _check_login_rate_limit(ip)
     username = payload.get("username")
     password = payload.get("password")
     if username != settings.ui_user:
-        _register_login_attempt(ip, False)
+        await _register_login_attempt(ip, False)
         raise HTTPException(status_code=401, detail="Invalid credentials")
     if settings.ui_password_hash:
         ok = verify_password(password or "", settings.ui_password_hash, True)
     else:
         ok = verify_password(password or "", settings.ui_password, False)
     if not ok:
-        _register_login_attempt(ip, False)
+        await _register_login_attempt(ip, False)
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token = create_access_token(subject=settings.ui_user)
-    _register_login_attempt(ip, True)
+    await _register_login_attempt(ip, True)
     return {"token": token}
 
 
 # --------- Metrics ---------
 
+def require_metrics_reader(authorization: str | None = Header(default=None, alias="Authorization"), token: str | None = Query(default=None)):
+    # scrapers may use a static METRICS_TOKEN instead of a UI session
+    if settings.metrics_token and authorization and authorization.lower().startswith("bearer "):
+        if authorization.split(" ", 1)[1].strip() == settings.metrics_token:
+            return "metrics"
+    return require_user(authorization, token)
+
+
+def _command_sql_metrics() -> Dict[str, Any]:
+    with Session(engine) as session:
+        # last 100 statuses via ix_command_created, counted by the database
+        last = select(Command.status).order_by(Command.created_at.desc()).limit(100).subquery()
+        counts = dict(session.exec(select(last.c.status, func.count()).group_by(last.c.status)).all())
+        pending = session.exec(select(func.count()).select_from(Command).where(Command.status == "pending")).one()
+    n = sum(counts.values())
+    return {
+        "success_rate_last100": (counts.get("success", 0) / n) if n else None,
+        "pending": pending,
+    }
+
+
+# evaluated on read, whether or not timings are enabled
+instrumentation.gauge("ws_clients", lambda: len(ws_broadcaster))
+instrumentation.gauge("ws_queued", lambda: sum(len(c.queue) for c in ws_broadcaster.clients))
+instrumentation.gauge("ws_max_lag_seconds", lambda: max((ws_broadcaster.lag(c, time.monotonic()) for c in ws_broadcaster.clients), default=0.0))
+instrumentation.gauge("heartbeat_buffer", lambda: len(heartbeat_buffer))
+instrumentation.gauge("command_streams", lambda: len(command_hub))
+instrumentation.gauge("sse_subscribers", lambda: command_hub.subscriber_count())
+instrumentation.gauge("db_backlog", db_backlog)
+instrumentation.gauge("agents_tracked", lambda: len(liveness))
+
+
+# async handlers: fleet_metrics, the snapshot and the gauges are mutated on the
+# event loop, so they are read there too (only the SQL runs in run_db)
 @app.get("/api/metrics")
-def metrics(user: str = Depends(require_user)):
-    now = datetime.utcnow()
+async def metrics(user: str = Depends(require_user)):
+    cmd = await run_db(_command_sql_metrics)
+    drift_engine.refresh()
+    snap = fleet_metrics.snapshot()
+    return {
+        "agents_total": sum(snap["agents_by_status"].values()),
+        "agents_online": snap["agents_by_status"].get("online", 0),
+        "uptime_seconds": fleet_snapshot.uptime_seconds(),
+        "command_success_rate_last100": cmd["success_rate_last100"],
+        "app_drift": drift_engine.app_drift,
+        "agents_drifted": len(drift_engine.drifted),
+        "agents_by_status": snap["agents_by_status"],
+        "commands_pending": cmd["pending"],
+        "commands": snap["commands"],
+    }
+
+
+@app.get("/api/metrics/prometheus")
+async def metrics_prometheus(reader: str = Depends(require_metrics_reader)):
+    cmd = await run_db(_command_sql_metrics)
+    gauges = {"commands_pending": cmd["pending"], **instrumentation.read_gauges()}
+    drift_engine.refresh()
+    gauges["app_drift"] = drift_engine.app_drift
+    if cmd["success_rate_last100"] is not None:
+        gauges["command_success_ratio_last100"] = cmd["success_rate_last100"]
+    return PlainTextResponse(fleet_metrics.prometheus(gauges) + instrumentation.prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/metrics/instrumentation")
+async def metrics_instrumentation(reader: str = Depends(require_metrics_reader)):
+    cmd = await run_db(_command_sql_metrics)
+    snap = instrumentation.snapshot()
+    snap["gauges"]["commands_pending"] = cmd["pending"]
+    return snap
+
+
+@app.get("/api/debug/profile")
+async def debug_profile(
+    seconds: float = Query(default=10, gt=0, le=120),
+    interval: float = Query(default=0.005, ge=0.001, le=1),
+    user: str = Depends(require_user),
+):
+    if not settings.profiler_enabled:
+        raise HTTPException(status_code=404, detail="Profiler disabled (PROFILER_ENABLED)")
+    try:
+        # sampled from a plain thread: the loop keeps serving (and is profiled too)
+        stacks = await asyncio.to_thread(stack_sampler.sample, seconds, interval)
+    except RuntimeError:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return PlainTextResponse(stacks)
+
+
+def _utc(v: datetime) -> datetime:
+    # columns hold naive UTC
+    return v.astimezone(timezone.utc).replace(tzinfo=None) if v.tzinfo else v
+
+
+AGENT_SORTS = {"id": Agent.id, "last_seen": Agent.last_seen, "hostname": Agent.hostname, "os_version": Agent.os_version, "kernel": Agent.kernel, "upgrades": Agent.upgrades}
+
+
+def _prefix(col, prefix: str):
+    # range instead of LIKE so any B-tree index on ``col`` serves it
+    return (col >= prefix) & (col < prefix + "\uffff")
+
+
+def _query_agent_ids(filters: Dict[str, Any], sort: str, cursor: str | None, offset: int, limit: int | None) -> list[str]:
+    stmt = select(Agent.id)
+    if filters.get("outdated") is True:
+        stmt = stmt.where(Agent.upgrades > 0)
+    elif filters.get("outdated") is False:
+        stmt = stmt.where((Agent.upgrades == 0) | (Agent.upgrades == None))  # noqa: E711
+    for name in ("os_version", "kernel", "arch"):
+        if filters.get(name) is not None:
+            stmt = stmt.where(getattr(Agent, name) == filters[name])
+    if filters.get("sudo_ok") is not None:
+        stmt = stmt.where(Agent.sudo_apt_ok == filters["sudo_ok"])
+    if filters.get("last_seen_before") is not None:
+        stmt = stmt.where(Agent.last_seen < _utc(filters["last_seen_before"]))
+    if filters.get("q"):
+        stmt = stmt.where(_prefix(Agent.id, filters["q"]) | _prefix(Agent.hostname, filters["q"]))
+    col = AGENT_SORTS[sort.lstrip("-")]
+    desc = sort.startswith("-")
+    if col is Agent.id and cursor:
+        # keyset pagination on the primary key
+        stmt = stmt.where(Agent.id < cursor if desc else Agent.id > cursor)
+    order = [col.desc() if desc else col.asc()]
+    if col is not Agent.id:
+        order.append(Agent.id)
+    stmt = stmt.order_by(*order).offset(offset)
+    if limit is not None:
+        stmt = stmt.limit(limit)
     with Session(engine) as session:
-        agents = session.exec(select(Agent)).all()
-        total = len(agents)
-        online = sum(1 for a in agents if a.status == "online")
-        uptime_seconds = {a.id: max(0, int((now - a.last_seen).total_seconds())) for a in agents}
-        # simple command success rate last 100
-        total_cmd = session.exec(select(Command).order_by(Command.created_at.desc())).all()
-        last = total_cmd[:100]
-        succ = sum(1 for c in last if c.status == "success")
-        rate = (succ / len(last)) if last else None
-        return {
-            "agents_total": total,
-            "agents_online": online,
-            "uptime_seconds": uptime_seconds,
-            "command_success_rate_last100": rate,
-            "app_drift": 0,
-        }
+        return list(session.exec(stmt).all())
+
+
+# uptime_seconds is relative to the serving time, which no validator covers:
+# browsers must not answer from their cache, explicit If-None-Match still works
+AGENTS_CACHE = {"Cache-Control": "no-store"}
 
 
 @app.get("/api/agents")
-def list_agents(user: str = Depends(require_user)):
-    with Session(engine) as session:
-        agents = session.exec(select(Agent)).all()
-        return [
-            {
-                "id": a.id,
-                "last_seen": a.last_seen.isoformat(),
-                "status": a.status,
-                "apps_state": json.loads(a.apps_state) if a.apps_state else None,
-                "os_update": json.loads(a.os_update) if a.os_update else None,
-                "uptime_seconds": max(0, int((datetime.utcnow() - a.last_seen).total_seconds())),
-                "outdated": (json.loads(a.os_update)["upgrades"] > 0) if a.os_update else False,
-            }
-            for a in agents
-        ]
+async def list_agents(
+    cursor: str | None = Query(default=None),
+    limit: int | None = Query(default=None, ge=1, le=5000),
+    since: int | None = Query(default=None, ge=0),
+    outdated: bool | None = Query(default=None),
+    os_version: str | None = Query(default=None),
+    kernel: str | None = Query(default=None),
+    arch: str | None = Query(default=None),
+    sudo_ok: bool | None = Query(default=None),
+    last_seen_before: datetime | None = Query(default=None),
+    q: str | None = Query(default=None, min_length=1),
+    sort: str | None = Query(default=None, pattern="^-?(" + "|".join(AGENT_SORTS) + ")$"),
+    offset: int = Query(default=0, ge=0),
+    if_none_match: str | None = Header(default=None, alias="If-None-Match"),
+    user: str = Depends(require_user),
+):
+    filters = {
+        "outdated": outdated, "os_version": os_version, "kernel": kernel, "arch": arch,
+        "sudo_ok": sudo_ok, "last_seen_before": last_seen_before, "q": q,
+    }
+    if cursor and sort and sort.lstrip("-") != "id":
+        # the cursor is an agent id: other sorts page with offset
+        raise HTTPException(status_code=400, detail="cursor requires sort=id (use offset)")
+    if any(v is not None for v in filters.values()) or sort or offset:
+        # filtered/sorted: ids from the indexed columns, bodies from the snapshot
+        ids = await run_db(_query_agent_ids, filters, sort or "id", cursor, offset, limit)
+        # membership comes from the DB (written behind the snapshot): part of the ETag
+        etag = f'W/"{fleet_snapshot.version}-{zlib.crc32(chr(0).join(ids).encode()):08x}"'
+        headers = {"ETag": etag, "X-Fleet-Revision": str(fleet_snapshot.revision), **AGENTS_CACHE}
+        if if_none_match and if_none_match == etag:
+            return Response(status_code=304, headers=headers)
+        if limit is not None and len(ids) == limit and (sort or "id").lstrip("-") == "id":
+            headers["X-Next-Cursor"] = ids[-1]
+        entries = [e for e in map(fleet_snapshot.get, ids) if e is not None]
+        return Response(content=fleet_snapshot.render(entries), media_type="application/json", headers=headers)
+    # Served from the in-memory snapshot: no DB read, no per-agent JSON decode
+    headers = {"ETag": fleet_snapshot.etag, "X-Fleet-Revision": str(fleet_snapshot.revision), **AGENTS_CACHE}
+    if if_none_match and if_none_match == fleet_snapshot.etag:
+        return Response(status_code=304, headers=headers)
+    if since is not None and since <= fleet_snapshot.revision:
+        # incremental fetch: only agents changed after the given revision
+        # (a revision this worker has not reached, e.g. from before a restart, gets the full list)
+        entries = fleet_snapshot.since(since)
+    else:
+        entries, nxt = fleet_snapshot.page(cursor, limit)
+        if nxt is not None:
+            headers["X-Next-Cursor"] = nxt
+    return Response(content=fleet_snapshot.render(entries), media_type="application/json", headers=headers)
 
 
 @app.get("/api/agents/{agent_id}")
@@ -172,7 +601,41 @@ def get_agent(agent_id: str, user: str = Depends(require_user)):
             "status": agent.status,
             "apps_state": json.loads(agent.apps_state) if agent.apps_state else None,
             "os_update": json.loads(agent.os_update) if agent.os_update else None,
+            "agent_version": agent.agent_version,
+        }
+
+
+WIRE_ACCEPT = wire.accepted()
+
+
+def _decode_agent_body(request: Request, raw: bytes, model):
+    """Decode a signed agent body (already verified over ``raw``) in one pass."""
+    try:
+        return wire.decode(model, raw, request.headers.get("content-type"), request.headers.get("content-encoding"), settings.agent_max_body_bytes)
+    except wire.WireError as e:
+        raise HTTPException(status_code=e.status, detail=str(e))
+    except ValueError as e:  # pydantic.ValidationError
+        print(f"{model.__name__} validation error: {e}")
+        raise HTTPException(status_code=400, detail="Invalid payload")
+
+
+# liveness-only heartbeats not yet shared with the other workers
+_touched: dict[str, datetime] = {}
+
+
+def _agent_changed(agent_id: str, now: datetime, state: AgentState, agent_version: str | None = None, revision: int | None = None) -> None:
+    fleet_snapshot.update(agent_id, last_seen=now, status="online", apps_state=state.apps, os_update=state.os_update, agent_version=agent_version, revision=revision)
+    ws_broadcast({
+        "type": "agent_update",
+        "agent": {
+            "id": agent_id,
+            "last_seen": now.isoformat(),
+            "status": "online",
+            "apps_state": state.apps,
+            "os_update": state.os_update,
+            "agent_version": fleet_snapshot.get(agent_id).agent_version,
         }
+    }, key=("agent_update", agent_id))
 
 
 @app.post("/api/heartbeat")
@@ -188,161 +651,388 @@ async def heartbeat(
     if not verify_signature(x_signature, raw, settings.server_psk):
         raise HTTPException(status_code=401, detail="Invalid signature")
 
-    try:
-        payload = HeartbeatPayload.model_validate_json(raw)
-    except Exception as e:
-        # Log and reject invalid payloads
-        print(f"heartbeat validation error: {e}")
-        raise HTTPException(status_code=400, detail="Invalid payload")
-
+    payload = _decode_agent_body(request, raw, HeartbeatPayload)
     if payload.agent_id != x_agent_id:
         raise HTTPException(status_code=400, detail="Agent ID mismatch")
 
-    # Parse optional extra fields from body (ignored by schema)
-    body: dict[str, Any] = {}
-    try:
-        body = json.loads(raw)
-    except Exception:
-        body = {}
-
     try:
-        with Session(engine) as session:
-            agent = session.get(Agent, payload.agent_id)
-            if not agent:
-                agent = Agent(id=payload.agent_id)
-            agent.last_seen = datetime.utcnow()
-            agent.status = "online"
-            agent.apps_state = json.dumps({k: v.model_dump() for k, v in payload.apps.items()})
-            if "os_update" in body:
-                agent.os_update = json.dumps(body.get("os_update")) if body.get("os_update") is not None else None
-            session.add(agent)
-            session.commit()
-        await ws_broadcast({
-            "type": "agent_update",
-            "agent": {
-                "id": payload.agent_id,
-                "last_seen": datetime.utcnow().isoformat(),
-                "status": "online",
-                "apps_state": {k: v.model_dump() for k, v in payload.apps.items()},
-                "os_update": body.get("os_update") if body.get("os_update") is not None else (json.loads(agent.os_update) if agent.os_update else None),
-            }
-        })
+        now = datetime.utcnow()
+        current = agent_states.peek(payload.agent_id)
+        if current is None:
+            current = await run_db(agent_states.load, payload.agent_id)
+        if payload.base is None:
+            # full beat: replaces the reported state
+            state = AgentState(
+                apps={k: v.model_dump() for k, v in payload.apps.items()},
+                os_update=payload.os_update if "os_update" in payload.model_fields_set else (current.os_update if current else None),
+            )
+        elif current is None or payload.base != current.hash:
+            # agent diffed against a state we do not hold: ask for a full beat
+            return {"status": "resync", "long_poll": settings.long_poll_seconds}
+        else:
+            state = AgentState(apps=dict(current.apps), os_update=current.os_update)
+            for name in payload.apps_removed or []:
+                state.apps.pop(name, None)
+            for name, app_state in (payload.apps_changed or {}).items():
+                state.apps[name] = app_state.model_dump()
+            if payload.os_update_changed:
+                state.os_update = {**(state.os_update or {}), **payload.os_update_changed}
+        state.rehash()
+        changed = current is None or state.hash != current.hash
+        known = fleet_snapshot.get(payload.agent_id)
+        # an upgraded agent is pushed even when its reported state is unchanged
+        new_version = payload.agent_version is not None and (known is None or known.agent_version != payload.agent_version)
+        fleet_metrics.incr("heartbeats")
+        came_online = fleet_metrics.set_agent_status(payload.agent_id, "online")
+        liveness.beat(payload.agent_id, _epoch(now), payload.poll_interval)
+        # Acknowledge after validation; the DB write happens in the next batched flush
+        if changed:
+            agent_states.put(payload.agent_id, state)
+            drift_engine.update(payload.agent_id, state.apps)
+            await heartbeat_buffer.submit(PendingHeartbeat(
+                agent_id=payload.agent_id,
+                last_seen=now,
+                apps_state=json.dumps(state.apps),
+                os_update=json.dumps(state.os_update) if state.os_update is not None else None,
+                os_attrs=os_columns(state.os_update),
+                has_os_update=True,
+                poll_interval=payload.poll_interval,
+                agent_version=payload.agent_version,
+            ))
+        else:
+            # unchanged state: only liveness (and a version change) is recorded
+            await heartbeat_buffer.submit(PendingHeartbeat(agent_id=payload.agent_id, last_seen=now, has_apps_state=False, poll_interval=payload.poll_interval, agent_version=payload.agent_version if new_version else None))
+        if changed or came_online or new_version:
+            revision = await _next_revision()
+            _agent_changed(payload.agent_id, now, state, payload.agent_version, revision)
+            bus.publish("agent", {"id": payload.agent_id, "at": now.isoformat(), "apps": state.apps, "os_update": state.os_update, "hash": state.hash, "poll_interval": payload.poll_interval, "agent_version": payload.agent_version, "rev": revision})
+        else:
+            # nothing dashboards react to: no push, snapshot revision unchanged
+            fleet_snapshot.touch(payload.agent_id, now)
+            if bus.shared:
+                _touched[payload.agent_id] = now
+        if rollouts.awaiting(payload.agent_id):
+            # health gate of a rollout waiting for this agent's next heartbeat
+            await rollouts.on_heartbeat(payload.agent_id, state.apps)
     except Exception as e:
         print(f"heartbeat processing error: {e}")
         raise HTTPException(status_code=500, detail="Heartbeat processing failed")
 
-    return {"status": "ok"}
+    # advertise long-poll support so agents can stop tight polling, and the
+    # request encodings agents may switch to
+    return {"status": "ok", "state": state.hash, "long_poll": settings.long_poll_seconds, "accept": WIRE_ACCEPT}
+
+
+def _finish_command(result: CommandResult) -> bool:
+    with Session(engine) as session:
+        done = finish(session, result.command_id, result.status, result.duration, result.exit_code, result.logs)
+        session.commit()
+    return bool(done)
 
 
 @app.post("/api/command-result")
 async def command_result(
-    result: CommandResult,
+    request: Request,
     x_agent_id: str | None = Header(default=None, alias="X-Agent-Id"),
     x_signature: str | None = Header(default=None, alias="X-Signature"),
-    request: Request = None,
 ):
     raw = await request.body()
     if not x_agent_id or not x_signature:
         raise HTTPException(status_code=400, detail="Missing authentication headers")
     if not verify_signature(x_signature, raw, settings.server_psk):
         raise HTTPException(status_code=401, detail="Invalid signature")
-    # TODO: persist deployment result
+    result = _decode_agent_body(request, raw, CommandResult)
+    if not await run_db(_finish_command, result):
+        # already finished (retried delivery) or unknown: nothing to count twice
+        return {"ack": True}
+    fleet_metrics.command_finished(result.status, result.duration)
+    command_hub.finish(result.command_id)
+    bus.publish("finish", {"id": result.command_id, "status": result.status, "duration": result.duration})
+    await rollouts.on_result(result.command_id, result.status)
     return {"ack": True}
 
 
-@app.post("/api/agents/{agent_id}/commands")
-def enqueue_command(agent_id: str, body: dict, user: str = Depends(require_user)):
-    cmd_id = body.get("command_id") or f"{uuid.uuid4()}"
-    payload = json.dumps(body)
+def _enqueue_one(agent_id: str, cmd_id: str, body: dict) -> None:
     with Session(engine) as session:
-        cmd = Command(command_id=cmd_id, agent_id=agent_id, payload=payload, status="pending")
+        cmd = Command(command_id=cmd_id, agent_id=agent_id, payload=json.dumps(body), kind=body.get("command") or "", status="pending")
         session.add(cmd)
         session.commit()
-    # initialize broadcaster queue
-    _get_broadcaster(cmd_id)  # ensure exists
+
+
+@app.post("/api/agents/{agent_id}/commands")
+async def enqueue_command(agent_id: str, body: dict, user: str = Depends(require_user)):
+    cmd_id = body.get("command_id") or f"{uuid.uuid4()}"
+    await run_db(_enqueue_one, agent_id, cmd_id, body)
+    fleet_metrics.incr("commands_enqueued")
+    notify_agents(agent_id)
     return {"queued": True, "agent_id": agent_id, "command_id": cmd_id}
 
 
+BULK_FILTERS = ("outdated", "os_version", "kernel", "arch", "sudo_ok", "last_seen_before", "q")
+
+
+def _enqueue_bulk(job_id: str, agent_ids: list[str], payload: dict, target: dict, user: str) -> list[str]:
+    with Session(engine) as session:
+        agents = enqueue_many(session, job_id, agent_ids, payload, target, user)
+        session.commit()
+    return agents
+
+
+async def _resolve_targets(req: BulkCommandRequest) -> tuple[list[str], Dict[str, Any]]:
+    if sum(x is not None for x in (req.agents, req.group, req.filter)) != 1:
+        raise HTTPException(status_code=400, detail="Specify exactly one of agents, group or filter")
+    if req.agents is not None:
+        agent_ids = req.agents
+        target: Dict[str, Any] = {"agents": len(req.agents)}
+    elif req.group is not None:
+        drift_engine.refresh()
+        agent_ids = [a for a, g in desired_state.current.assignments.items() if g == req.group]
+        target = {"group": req.group}
+    else:
+        unknown = set(req.filter) - set(BULK_FILTERS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown filter(s): {', '.join(sorted(unknown))}")
+        filters = dict(req.filter)
+        if isinstance(filters.get("last_seen_before"), str):
+            try:
+                filters["last_seen_before"] = datetime.fromisoformat(filters["last_seen_before"])
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid last_seen_before")
+        agent_ids = await run_db(_query_agent_ids, filters, "id", None, 0, None)
+        target = {"filter": req.filter}
+    return agent_ids, target
+
+
+@app.post("/api/commands/bulk")
+async def enqueue_bulk(req: BulkCommandRequest, user: str = Depends(require_user)):
+    agent_ids, target = await _resolve_targets(req)
+    payload = {k: v for k, v in req.payload.items() if k != "command_id"}
+    job_id = str(uuid.uuid4())
+    # one transaction for the whole fleet
+    agents = await run_db(_enqueue_bulk, job_id, agent_ids, payload, target, user)
+    fleet_metrics.incr("commands_enqueued", len(agents))
+    notify_agents(*agents)
+    return {"job_id": job_id, "queued": len(agents)}
+
+
+@app.get("/api/commands/bulk/{job_id}")
+def bulk_progress(job_id: str, user: str = Depends(require_user)):
+    with Session(engine) as session:
+        progress = job_progress(session, job_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return progress
+
+
+# --------- Rollouts ---------
+
+@app.post("/api/rollouts")
+async def create_rollout(req: RolloutRequest, user: str = Depends(require_user)):
+    agent_ids, _ = await _resolve_targets(req)
+    spec = RolloutSpec(
+        waves=req.waves,
+        max_in_flight=req.max_in_flight,
+        failure_threshold=req.failure_threshold,
+        health_gate=req.health_gate,
+        health_timeout=req.health_timeout,
+        claim_timeout=req.claim_timeout,
+    )
+    try:
+        plan_waves(agent_ids, spec.waves)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid waves (use integers or percentages like \"25%\")")
+    payload = {k: v for k, v in req.payload.items() if k != "command_id"}
+    run = await rollouts.create(agent_ids, payload, spec, user)
+    return run.describe()
+
+
+@app.get("/api/rollouts")
+def list_rollouts(user: str = Depends(require_user)):
+    with Session(engine) as session:
+        rows = session.exec(select(Rollout).order_by(Rollout.created_at.desc()).limit(100)).all()
+    return [
+        {"id": r.id, "state": r.state, "wave": r.wave, "reason": r.reason, "created_at": r.created_at.isoformat(), "payload": json.loads(r.payload)}
+        for r in rows
+    ]
+
+
+@app.get("/api/rollouts/{rollout_id}")
+async def get_rollout(rollout_id: str, user: str = Depends(require_user)):
+    run = rollouts.runs.get(rollout_id)
+    if run is None:
+        # over, or driven by another worker: serve the stored state
+        run = await run_db(rollouts.read, rollout_id, False)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Rollout not found")
+    return run.describe()
+
+
+@app.post("/api/rollouts/{rollout_id}/{action}")
+async def control_rollout(rollout_id: str, action: str, user: str = Depends(require_user)):
+    ops = {"pause": rollouts.pause, "resume": rollouts.resume, "abort": rollouts.abort}
+    if action not in ops:
+        raise HTTPException(status_code=404, detail="Unknown action")
+    run = await ops[action](rollout_id)
+    if run is None and bus.shared and await run_db(rollouts.read, rollout_id) is not None:
+        # owned by another worker: hand the action over
+        bus.publish("rollout", {"id": rollout_id, "action": action})
+        return {"id": rollout_id, "forwarded": action}
+    if run is None:
+        raise HTTPException(status_code=404, detail="Rollout not active")
+    return run.describe()
+
+
 @app.post("/api/agents/{agent_id}/sudo-check")
-def sudo_check(agent_id: str, user: str = Depends(require_user)):
+async def sudo_check(agent_id: str, user: str = Depends(require_user)):
     body = {"command": "sudo_check", "commands": []}
-    return enqueue_command(agent_id, body, user)
+    return await enqueue_command(agent_id, body, user)
+
+
+def _claim_next(agent_id: str) -> dict | None:
+    with Session(engine) as session:
+        return claim_next(session, agent_id, settings.command_lease_seconds)
+
+
+async def _claim(agent_id: str) -> dict | None:
+    cmd = await run_db(_claim_next, agent_id)
+    if cmd:
+        # counted on the loop, never from a DB thread
+        fleet_metrics.incr("commands_claimed")
+    return cmd
 
 
 @app.get("/api/agents/{agent_id}/next-command")
-def next_command(agent_id: str, x_agent_id: str | None = Header(default=None, alias="X-Agent-Id"), x_signature: str | None = Header(default=None, alias="X-Signature")):
+async def next_command(agent_id: str, wait: int = Query(default=0, ge=0), x_agent_id: str | None = Header(default=None, alias="X-Agent-Id"), x_signature: str | None = Header(default=None, alias="X-Signature")):
     # Optional HMAC: verify empty body signature
     if x_agent_id != agent_id:
         raise HTTPException(status_code=400, detail="Agent ID mismatch")
+    hold = min(wait, settings.long_poll_seconds)
+    if hold <= 0:
+        return {"command": await _claim(agent_id)}
+    # Long-poll: park until enqueue_command signals this agent or the hold expires
+    ev = wakeups.register(agent_id)
+    try:
+        deadline = time.monotonic() + hold
+        while True:
+            ev.clear()
+            cmd = await _claim(agent_id)
+            remaining = deadline - time.monotonic()
+            if cmd or remaining <= 0:
+                return {"command": cmd}
+            try:
+                async with asyncio.timeout(remaining):
+                    await ev.wait()
+            except asyncio.TimeoutError:
+                return {"command": None}
+    finally:
+        wakeups.unregister(agent_id, ev)
+
+
+def _store_chunk(command_id: str, data: str) -> int:
     with Session(engine) as session:
-        cmd = session.exec(
-            select(Command).where(Command.agent_id == agent_id, Command.status == "pending").order_by(Command.created_at)
-        ).first()
-        if not cmd:
-            return {"command": None}
-        cmd.status = "running"
-        cmd.updated_at = datetime.utcnow()
-        session.add(cmd)
+        seq = output_store.append(session, command_id, data)
+        # output is proof of life: keep the claim lease alive
+        extend_lease(session, command_id, settings.command_lease_seconds)
+        session.commit()
+    return seq
+
+
+def _store_chunk_batch(command_id: str, chunks: list[tuple[int, str]], attempt: int | None) -> list[tuple[int, str]]:
+    # One transaction per batch; (attempt, seq) makes agent retries idempotent
+    with Session(engine) as session:
+        fresh = output_store.append_many(session, command_id, chunks, attempt)
+        extend_lease(session, command_id, settings.command_lease_seconds)
         session.commit()
-        return {"command": json.loads(cmd.payload)}
+    return fresh
 
 
 @app.post("/api/command-chunk")
-async def command_chunk(chunk: CommandChunk, request: Request, x_agent_id: str | None = Header(default=None, alias="X-Agent-Id"), x_signature: str | None = Header(default=None, alias="X-Signature")):
+async def command_chunk(request: Request, x_agent_id: str | None = Header(default=None, alias="X-Agent-Id"), x_signature: str | None = Header(default=None, alias="X-Signature")):
     raw = await request.body()
     if not x_agent_id or not x_signature or not verify_signature(x_signature, raw, settings.server_psk):
         raise HTTPException(status_code=401, detail="Invalid signature")
-    # Append to DB output and broadcast to SSE subscribers
-    with Session(engine) as session:
-        cmd = session.exec(select(Command).where(Command.command_id == chunk.command_id)).first()
-        if cmd:
-            existing = cmd.output or ""
-            cmd.output = existing + chunk.chunk
-            cmd.updated_at = datetime.utcnow()
-            session.add(cmd)
-            session.commit()
-    # Broadcast
-    queue = _get_broadcaster(chunk.command_id)
-    await queue.put(chunk.chunk)
+    chunk = _decode_agent_body(request, raw, CommandChunk)
+    # Append to the output log and broadcast to SSE subscribers
+    seq = await run_db(_store_chunk, chunk.command_id, chunk.chunk)
+    command_hub.publish(chunk.command_id, seq, chunk.chunk)
+    bus.publish("chunk", {"id": chunk.command_id, "chunks": [[seq, chunk.chunk]]})
     return {"ok": True}
 
 
-# SSE broadcaster storage
-_broadcast_queues: dict[str, asyncio.Queue[str]] = {}
+@app.post("/api/command-chunks")
+async def command_chunks(request: Request, x_agent_id: str | None = Header(default=None, alias="X-Agent-Id"), x_signature: str | None = Header(default=None, alias="X-Signature")):
+    raw = await request.body()
+    if not x_agent_id or not x_signature or not verify_signature(x_signature, raw, settings.server_psk):
+        raise HTTPException(status_code=401, detail="Invalid signature")
+    batch = _decode_agent_body(request, raw, CommandChunkBatch)
+    fresh = await run_db(_store_chunk_batch, batch.command_id, [(c.seq, c.chunk) for c in batch.chunks], batch.attempt)
+    for seq, data in fresh:
+        command_hub.publish(batch.command_id, seq, data)
+    if fresh:
+        bus.publish("chunk", {"id": batch.command_id, "chunks": fresh})
+    return {"ok": True, "accepted": len(fresh)}
 
 
-def _get_broadcaster(command_id: str) -> asyncio.Queue:
-    if command_id not in _broadcast_queues:
-        _broadcast_queues[command_id] = asyncio.Queue()
-    return _broadcast_queues[command_id]
+def _sse_event(seq: int, data: str) -> str:
+    # one data: field per line so multi-line chunks survive SSE framing
+    lines = data[:-1].split("\n") if data.endswith("\n") else data.split("\n")
+    return f"id: {seq}\n" + "".join(f"data: {ln}\n" for ln in lines) + "\n"
+
+
+def _read_output_page(command_id: str, after: int) -> list[tuple[int, str]]:
+    with Session(engine) as session:
+        return output_store.read(session, command_id, after=after, limit=500)
+
+
+def _legacy_output(command_id: str) -> str | None:
+    with Session(engine) as session:
+        return output_store.legacy(session, command_id)
+
+
+def _command_status(command_id: str) -> str | None:
+    with Session(engine) as session:
+        return session.exec(select(Command.status).where(Command.command_id == command_id)).first()
 
 
 @app.get("/api/commands/{command_id}/stream")
-async def stream_command(command_id: str, user: str = Depends(require_user)):
-    queue = _get_broadcaster(command_id)
+async def stream_command(
+    command_id: str,
+    last_event_id: int | None = Query(default=None),
+    last_event_header: str | None = Header(default=None, alias="Last-Event-ID"),
+    user: str = Depends(require_user),
+):
+    # EventSource sends Last-Event-ID on reconnect: resume after it
+    after = last_event_id or 0
+    if last_event_header and last_event_header.isdigit():
+        after = int(last_event_header)
+
+    async def backfill(cursor: int) -> list[tuple[int, str]]:
+        return await run_db(_read_output_page, command_id, cursor)
+
+    async def is_final() -> bool:
+        # unknown ids count as final: replay nothing and end
+        return await run_db(_command_status, command_id) not in ("pending", "running")
 
     async def event_gen():
-        # send existing output first
-        try:
-            with Session(engine) as session:
-                cmd = session.exec(select(Command).where(Command.command_id == command_id)).first()
-                if cmd and cmd.output:
-                    for line in cmd.output.splitlines(True):
-                        yield f"data: {line}\n\n"
-        except Exception as e:
-            yield f"event: error\ndata: init error: {e}\n\n"
-        # then live chunks with keepalive comments every 15s
-        last_ping = asyncio.get_event_loop().time()
-        while True:
+        if after == 0:
+            # output stored inline by older versions has no sequence numbers
             try:
-                # small timeout to allow periodic keepalive
-                chunk = await asyncio.wait_for(queue.get(), timeout=15.0)
-                yield f"data: {chunk}\n\n"
-            except asyncio.TimeoutError:
-                yield ": keepalive\n\n"
-                # continue loop
+                legacy = await run_db(_legacy_output, command_id)
+                for line in (legacy or "").splitlines(True):
+                    yield f"data: {line}\n\n"
             except Exception as e:
-                yield f"event: error\ndata: stream error: {e}\n\n"
+                yield f"event: error\ndata: init error: {e}\n\n"
+        # stored chunks, then live ones, with keepalive comments every 15s
+        try:
+            async for ev in command_hub.follow(command_id, after, backfill, keepalive=15.0, is_final=is_final):
+                if ev == KEEPALIVE:
+                    yield ": keepalive\n\n"
+                elif ev == END:
+                    yield "event: end\ndata: end\n\n"
+                else:
+                    yield _sse_event(*ev)
+        except Exception as e:
+            yield f"event: error\ndata: stream error: {e}\n\n"
 
     headers = {
         "Cache-Control": "no-cache",
@@ -352,8 +1042,104 @@ async def stream_command(command_id: str, user: str = Depends(require_user)):
     return StreamingResponse(event_gen(), media_type="text/event-stream", headers=headers)
 
 
+@app.get("/api/commands/{command_id}/output")
+def command_output(command_id: str, after: int = Query(default=0, ge=0), limit: int = Query(default=1000, ge=1, le=10000), raw: bool = False, user: str = Depends(require_user)):
+    with Session(engine) as session:
+        if raw:
+            return PlainTextResponse(output_store.materialize(session, command_id))
+        chunks = output_store.read(session, command_id, after=after, limit=limit)
+    return {
+        "command_id": command_id,
+        "chunks": [{"seq": seq, "data": data} for seq, data in chunks],
+        "next": chunks[-1][0] if chunks else after,
+    }
+
+
+def _command_item(c: Command) -> Dict[str, Any]:
+    def ts(v):
+        return v.isoformat() if v else None
+    return {
+        "command_id": c.command_id, "agent_id": c.agent_id, "kind": c.kind, "status": c.status, "job_id": c.job_id,
+        "created_at": ts(c.created_at), "started_at": ts(c.started_at), "finished_at": ts(c.finished_at),
+        "duration": c.duration, "exit_code": c.exit_code, "payload": json.loads(c.payload),
+    }
+
+
+def _query_commands(filters: Dict[str, Any], cursor: tuple[datetime, int] | None, limit: int) -> tuple[list[Dict[str, Any]], str | None]:
+    """Newest-first page of command history.
+
+    Keyset pagination on ``(created_at, id)``: each page starts strictly after
+    the last row of the previous one, served by ``ix_command_agent_created``
+    (per agent) or ``ix_command_status_created`` / ``ix_command_created``
+    (fleet-wide) whatever the depth, unlike an OFFSET.
+    """
+    stmt = select(Command)
+    for name in ("agent_id", "status", "kind"):
+        if filters.get(name) is not None:
+            stmt = stmt.where(getattr(Command, name) == filters[name])
+    if filters.get("since") is not None:
+        stmt = stmt.where(Command.created_at >= _utc(filters["since"]))
+    if filters.get("until") is not None:
+        stmt = stmt.where(Command.created_at < _utc(filters["until"]))
+    if cursor:
+        at, last_id = cursor
+        # redundant bound first: a plain range the index can seek to
+        stmt = stmt.where(Command.created_at <= at, (Command.created_at < at) | (Command.id < last_id))
+    stmt = stmt.order_by(Command.created_at.desc(), Command.id.desc()).limit(limit)
+    with Session(engine) as session:
+        rows = session.exec(stmt).all()
+    nxt = f"{rows[-1].created_at.isoformat()}~{rows[-1].id}" if len(rows) == limit else None
+    return [_command_item(c) for c in rows], nxt
+
+
+def _command_cursor(cursor: str | None) -> tuple[datetime, int] | None:
+    if not cursor:
+        return None
+    try:
+        at, _, last_id = cursor.rpartition("~")
+        return datetime.fromisoformat(at), int(last_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def _command_history(filters: Dict[str, Any], cursor: str | None, limit: int) -> Response:
+    items, nxt = await run_db(_query_commands, filters, _command_cursor(cursor), limit)
+    headers = {"X-Next-Cursor": nxt} if nxt else {}
+    return Response(content=json.dumps(items), media_type="application/json", headers=headers)
+
+
+@app.get("/api/agents/{agent_id}/commands")
+async def agent_command_history(
+    agent_id: str,
+    status: str | None = Query(default=None),
+    kind: str | None = Query(default=None),
+    since: datetime | None = Query(default=None),
+    until: datetime | None = Query(default=None),
+    cursor: str | None = Query(default=None),
+    limit: int = Query(default=100, ge=1, le=1000),
+    user: str = Depends(require_user),
+):
+    filters = {"agent_id": agent_id, "status": status, "kind": kind, "since": since, "until": until}
+    return await _command_history(filters, cursor, limit)
+
+
+@app.get("/api/commands")
+async def command_history(
+    agent: str | None = Query(default=None),
+    status: str | None = Query(default=None),
+    kind: str | None = Query(default=None),
+    since: datetime | None = Query(default=None),
+    until: datetime | None = Query(default=None),
+    cursor: str | None = Query(default=None),
+    limit: int = Query(default=100, ge=1, le=1000),
+    user: str = Depends(require_user),
+):
+    filters = {"agent_id": agent, "status": status, "kind": kind, "since": since, "until": until}
+    return await _command_history(filters, cursor, limit)
+
+
 # --------- WebSocket push ---------
-_ws_clients: set[WebSocket] = set()
+ws_broadcaster = WsBroadcaster(max_queue=settings.ws_max_queue, lag_budget=settings.ws_lag_budget_seconds)
 
 
 @app.websocket("/ws")
@@ -369,63 +1155,32 @@ async def websocket_endpoint(ws: WebSocket):
         await ws.close(code=4401)
         return
     await ws.accept()
-    _ws_clients.add(ws)
+    client = ws_broadcaster.register(ws)
     try:
         while True:
             await ws.receive_text()  # no-op; keepalive if needed
-    except WebSocketDisconnect:
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: closed by the broadcaster (client fell too far behind)
         pass
     finally:
-        _ws_clients.discard(ws)
+        ws_broadcaster.unregister(client)
 
 
-async def ws_broadcast(message: dict):
-    if not _ws_clients:
-        return
-    dead: list[WebSocket] = []
-    text = json.dumps(message)
-    for ws in list(_ws_clients):
-        try:
-            await ws.send_text(text)
-        except Exception:
-            dead.append(ws)
-    for ws in dead:
-        _ws_clients.discard(ws)
-
-
-# --------- Desired State & Drift (MVP scaffold) ---------
-def _load_desired_state() -> Dict[str, Any]:
-    path = os.path.join(os.path.dirname(__file__), "..", "..", settings.desired_state_path)
-    path = os.path.abspath(path)
-    if not os.path.isfile(path):
-        return {}
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
+def ws_broadcast(message: dict, key: Any = None) -> None:
+    """Queue ``message`` for every dashboard; never waits on a client.
 
+    Messages sharing a ``key`` (e.g. one agent's updates) are coalesced for
+    clients that have not yet received the previous one.
+    """
+    with instrumentation.span("ws_broadcast"):
+        ws_broadcaster.publish(message, key)
 
+
+# --------- Desired State & Drift ---------
 @app.get("/api/drift")
-def drift(user: str = Depends(require_user)):
-    desired = _load_desired_state()
-    groups = desired.get("groups", {})
-    assignments = desired.get("assignments", {})
-    res: Dict[str, Any] = {"drift": []}
-    with Session(engine) as session:
-        agents = session.exec(select(Agent)).all()
-        for a in agents:
-            group = assignments.get(a.id)
-            target = (groups.get(group, {}) if group else {})
-            target_apps = target.get("apps", {})
-            actual_apps = json.loads(a.apps_state) if a.apps_state else {}
-            drift_items = []
-            for name, t in target_apps.items():
-                av = actual_apps.get(name)
-                if av is None or av.get("version") != t.get("version"):
-                    drift_items.append({"app": name, "expected": t, "actual": av})
-            res["drift"].append({"agent": a.id, "group": group, "items": drift_items})
-    return res
+async def drift(drifted: bool = Query(default=False), user: str = Depends(require_user)):
+    # maintained per heartbeat / desired state change; reload is checked here too
+    return {"drift": drift_engine.drift(only_drifted=drifted)}
 
 # ---- Serve UI without intercepting API/WS: assets mount + SPA fallback ----
 ui_dist_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "ui", "dist"))
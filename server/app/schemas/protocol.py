@@ -1,4 +1,4 @@
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Literal, Optional, Union
 from pydantic import BaseModel
 from pydantic import BaseModel
 from pydantic import ConfigDict
@@ -12,6 +12,7 @@ class HeartbeatApp(BaseModel):
     current: Optional[str] = None
     health: Optional[str] = None
     status: Optional[str] = None
+    stale: Optional[bool] = None
     services: Optional[Dict[str, Any]] = None
 
 
@@ -20,6 +21,16 @@ class HeartbeatPayload(BaseModel):
     agent_id: str
     apps: Dict[str, HeartbeatApp] = Field(default_factory=dict)
     logs: Optional[List[str]] = None
+    agent_version: Optional[str] = None
+    poll_interval: Optional[int] = Field(default=None, ge=1)  # seconds; sets the offline deadline
+    # Full beats only; absent means "keep the last reported os_update"
+    os_update: Optional[Dict[str, Any]] = None
+    # Delta beats: `base` is the state hash last acknowledged by the server.
+    # When set, `apps` is ignored and only the changes below are applied.
+    base: Optional[str] = None
+    apps_changed: Optional[Dict[str, HeartbeatApp]] = None
+    apps_removed: Optional[List[str]] = None
+    os_update_changed: Optional[Dict[str, Any]] = None
 
 
 class CommandRequest(BaseModel):
@@ -32,13 +43,43 @@ class CommandRequest(BaseModel):
 
 class CommandResult(BaseModel):
     command_id: str
-    status: str
+    status: Literal["success", "failed", "timeout", "cancelled"]  # final statuses only
     new_state: Optional[str] = None
     output: Optional[List[str]] = None
     duration: Optional[int] = None
+    exit_code: Optional[int] = None
     logs: Optional[str] = None
 
 
 class CommandChunk(BaseModel):
     command_id: str
     chunk: str
+
+
+class ChunkItem(BaseModel):
+    seq: int
+    chunk: str
+
+
+class CommandChunkBatch(BaseModel):
+    command_id: str
+    chunks: List[ChunkItem]
+    attempt: Optional[int] = None  # claim the chunks belong to (from next-command)
+
+
+class BulkCommandRequest(BaseModel):
+    """Fan-out target: exactly one of ``agents``, ``group`` or ``filter``."""
+    payload: Dict[str, Any]
+    agents: Optional[List[str]] = None
+    group: Optional[str] = None  # desired state group (state.json assignments)
+    filter: Optional[Dict[str, Any]] = None  # same keys as /api/agents filters, e.g. {"outdated": true}
+
+
+class RolloutRequest(BulkCommandRequest):
+    # canary sizes (int) and cumulative fleet percentages ("25%"), in order
+    waves: List[Union[int, str]] = Field(default_factory=lambda: [1, "100%"])
+    max_in_flight: int = Field(default=0, ge=0)  # per desired state group, 0 = unlimited
+    failure_threshold: float = Field(default=0.2, ge=0, le=1)
+    health_gate: bool = True
+    health_timeout: int = Field(default=600, ge=1)
+    claim_timeout: int = Field(default=600, ge=1)  # an unclaimed command (offline agent) fails its target
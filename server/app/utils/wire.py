@@ -0,0 +1,83 @@
+import zlib
+from typing import Any, Optional, TypeVar
+from pydantic import BaseModel
+
+try:  # optional: compact binary encoding of agent requests
+    import msgpack
+except ImportError:  # pragma: no cover - depends on environment
+    msgpack = None
+
+try:  # optional: faster and smaller than gzip
+    import zstandard
+except ImportError:  # pragma: no cover - depends on environment
+    zstandard = None
+
+M = TypeVar("M", bound=BaseModel)
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+
+
+class WireError(ValueError):
+    """Body that cannot be decoded; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int = 400) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def accepted() -> dict[str, list[str]]:
+    """What this server can decode; advertised to agents in the heartbeat ack."""
+    encodings = ["gzip"] + (["zstd"] if zstandard is not None else [])
+    formats = ["json"] + (["msgpack"] if msgpack is not None else [])
+    return {"encodings": encodings, "formats": formats}
+
+
+def _gunzip(data: bytes, limit: int) -> bytes:
+    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    out = d.decompress(data, limit + 1)
+    if len(out) > limit or d.unconsumed_tail:
+        raise WireError("decoded body too large", 413)
+    return out
+
+
+def decompress(data: bytes, encoding: Optional[str], limit: int) -> bytes:
+    """Undo ``Content-Encoding``; output is capped at ``limit`` bytes."""
+    encoding = (encoding or "identity").strip().lower()
+    try:
+        if encoding == "identity":
+            return data
+        if encoding == "gzip":
+            return _gunzip(data, limit)
+        if encoding == "zstd" and zstandard is not None:
+            out = bytearray()
+            with zstandard.ZstdDecompressor().stream_reader(data) as r:
+                while chunk := r.read(64 * 1024):
+                    out += chunk
+                    if len(out) > limit:
+                        raise WireError("decoded body too large", 413)
+            return bytes(out)
+    except WireError:
+        raise
+    except Exception as e:  # zlib.error, zstandard.ZstdError
+        raise WireError(f"bad {encoding} body: {e}")
+    raise WireError(f"unsupported content encoding: {encoding}", 415)
+
+
+def decode(model: type[M], raw: bytes, content_type: Optional[str], content_encoding: Optional[str], limit: int) -> M:
+    """Validate an agent request body into ``model`` in a single pass.
+
+    The HMAC is checked by the caller over ``raw`` (the bytes as sent),
+    before anything is decompressed.
+    """
+    data = decompress(raw, content_encoding, limit)
+    ctype = (content_type or JSON).split(";")[0].strip().lower()
+    if ctype == MSGPACK:
+        if msgpack is None:
+            raise WireError("msgpack bodies require the 'msgpack' package", 415)
+        try:
+            obj: Any = msgpack.unpackb(data, raw=False)
+        except Exception as e:
+            raise WireError(f"bad msgpack body: {e}")
+        return model.model_validate(obj)
+    return model.model_validate_json(data)
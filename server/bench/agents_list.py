@@ -0,0 +1,80 @@
+"""Benchmark: building the /api/agents body, DB scan + JSON vs snapshot.
+
+"before" replays the original handler (select every Agent, json.loads the
+JSON columns, re-serialize the list). "after" renders the same fleet from
+``FleetSnapshot`` fragments; "304" is the If-None-Match check alone.
+
+    PYTHONPATH=server python server/bench/agents_list.py --agents 5000 --rounds 20
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+from sqlmodel import SQLModel, Session, create_engine, select
+
+from app.db.models import Agent
+from app.core.snapshot import FleetSnapshot
+
+
+APPS = json.dumps({f"app{i}": {"type": "docker-compose", "status": "running", "health": "ok", "current": "1.2.3", "branch": "main"} for i in range(5)})
+OS_UPDATE = json.dumps({"pkg_manager": "apt", "upgrades": 3, "status": "outdated", "sudo_apt_ok": True, "os_version": "Debian GNU/Linux 12", "kernel": "6.1.0-18-amd64"})
+
+
+def list_before(engine) -> str:
+    with Session(engine) as session:
+        agents = session.exec(select(Agent)).all()
+        return json.dumps([
+            {
+                "id": a.id,
+                "last_seen": a.last_seen.isoformat(),
+                "status": a.status,
+                "apps_state": json.loads(a.apps_state) if a.apps_state else None,
+                "os_update": json.loads(a.os_update) if a.os_update else None,
+                "uptime_seconds": max(0, int((datetime.utcnow() - a.last_seen).total_seconds())),
+                "outdated": (json.loads(a.os_update)["upgrades"] > 0) if a.os_update else False,
+            }
+            for a in agents
+        ])
+
+
+def timed(fn, rounds: int) -> float:
+    samples = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples) * 1000
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--agents", type=int, default=5000)
+    ap.add_argument("--rounds", type=int, default=20)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    engine = create_engine("sqlite:///" + os.path.join(tmp, "bench.sqlite3"))
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        for i in range(args.agents):
+            session.add(Agent(id=f"vm-{i:05d}", apps_state=APPS, os_update=OS_UPDATE))
+        session.commit()
+        snap = FleetSnapshot()
+        snap.load(session.exec(select(Agent)).all())
+
+    before = timed(lambda: list_before(engine), args.rounds)
+    after = timed(lambda: snap.render(snap.page()[0]), args.rounds)
+    etag = snap.etag
+    not_modified = timed(lambda: etag == snap.etag, args.rounds)
+    print(f"agents={args.agents}")
+    print(f"before  median {before:8.2f} ms")
+    print(f"after   median {after:8.2f} ms  ({before / after:.1f}x)")
+    print(f"304     median {not_modified:8.4f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Benchmark: next-command claim latency as the Command table grows.
+
+Fills a scratch SQLite database with finished command history spread over
+many agents, then measures ``claim_next`` for agents that have one pending
+command. Latency should stay flat from thousands to millions of rows.
+
+    PYTHONPATH=server python server/bench/claim_latency.py --sizes 10000,100000,1000000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+from sqlmodel import SQLModel, Session, create_engine
+
+from app.db.models import Command
+from app.core.queue import claim_next
+
+
+def _fill(engine, start: int, stop: int, agents: int) -> None:
+    base = datetime.utcnow() - timedelta(days=365)
+    payload = json.dumps({"command": "apt_upgrade", "commands": []})
+    batch = 50_000
+    with engine.begin() as conn:
+        for lo in range(start, stop, batch):
+            rows = []
+            for i in range(lo, min(stop, lo + batch)):
+                ts = base + timedelta(seconds=i)
+                rows.append({
+                    "command_id": f"hist-{i}",
+                    "agent_id": f"vm-{i % agents}",
+                    "payload": payload,
+                    "status": "success" if i % 10 else "failed",
+                    "created_at": ts,
+                    "updated_at": ts,
+                })
+            conn.execute(insert(Command), rows)
+
+
+def _measure(engine, agents: int, samples: int) -> list[float]:
+    payload = json.dumps({"command": "sudo_check", "commands": []})
+    picked = random.sample(range(agents), min(samples, agents))
+    with engine.begin() as conn:
+        conn.execute(insert(Command), [
+            {"command_id": f"bench-{time.time_ns()}-{a}", "agent_id": f"vm-{a}", "payload": payload, "status": "pending"}
+            for a in picked
+        ])
+    timings: list[float] = []
+    with Session(engine) as session:
+        for a in picked:
+            t0 = time.perf_counter()
+            cmd = claim_next(session, f"vm-{a}", lease_seconds=600)
+            timings.append((time.perf_counter() - t0) * 1000)
+            assert cmd is not None
+    return timings
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--sizes", default="10000,100000,1000000", help="comma separated table sizes")
+    ap.add_argument("--agents", type=int, default=2000)
+    ap.add_argument("--samples", type=int, default=500)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine("sqlite:///" + os.path.join(tmp, "bench.sqlite3"))
+        SQLModel.metadata.create_all(engine)
+        filled = 0
+        print(f"{'rows':>10} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for size in sorted(int(s) for s in args.sizes.split(",")):
+            _fill(engine, filled, size, args.agents)
+            filled = size
+            t = sorted(_measure(engine, args.agents, args.samples))
+            p99 = t[min(len(t) - 1, int(len(t) * 0.99))]
+            print(f"{size:>10} {statistics.median(t):>8.3f} {p99:>8.3f} {t[-1]:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
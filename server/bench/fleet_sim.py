@@ -0,0 +1,314 @@
+"""Load test: a simulated fleet of asyncio agents against a running server.
+
+Each simulated agent speaks the real protocol: signed heartbeats (a full
+beat, then delta/liveness beats against the acknowledged state hash),
+next-command polls, batched output chunks and a command result. An
+operator task enqueues commands at ``--command-rate`` per second and
+WebSocket/SSE observers attach like dashboards. Latency percentiles,
+throughput and error rates are reported per endpoint, with the server's
+RSS sampled from /proc when ``--server-pid`` is given. For 10k+ agents run
+the simulator on other cores (or another host) than the server, otherwise
+the numbers measure the simulator.
+
+    # server side (same PSK and UI credentials)
+    SERVER_PSK=k UI_USER=u UI_PASSWORD=p JWT_SECRET=s uvicorn app.main:app --port 8000
+    # load
+    PYTHONPATH=server python server/bench/fleet_sim.py --url http://127.0.0.1:8000 \\
+        --psk k --user u --password p --agents 10000 --seconds 60 --json results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Optional
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "agent"))
+from crypto_hmac import sign_bytes  # noqa: E402
+
+from app.schemas.protocol import ChunkItem, CommandChunkBatch, CommandResult, HeartbeatApp, HeartbeatPayload  # noqa: E402
+
+try:  # optional, installed with uvicorn[standard]
+    import websockets
+except ImportError:  # pragma: no cover - depends on environment
+    websockets = None
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.latency: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.events: dict[str, int] = defaultdict(int)
+        self.rss_kb: list[int] = []
+
+    def record(self, endpoint: str, seconds: float, ok: bool) -> None:
+        self.latency[endpoint].append(seconds * 1000)
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def report(self, elapsed: float) -> dict[str, Any]:
+        endpoints = {}
+        for name, samples in sorted(self.latency.items()):
+            s = sorted(samples)
+            q = lambda p: round(s[min(len(s) - 1, int(p * len(s)))], 3)  # noqa: E731
+            endpoints[name] = {
+                "requests": len(s),
+                "throughput_rps": round(len(s) / elapsed, 1),
+                "errors": self.errors[name],
+                "error_rate": round(self.errors[name] / len(s), 5),
+                "p50_ms": q(0.5),
+                "p99_ms": q(0.99),
+                "max_ms": round(s[-1], 3),
+                "mean_ms": round(statistics.fmean(s), 3),
+            }
+        return {
+            "elapsed_seconds": round(elapsed, 2),
+            "endpoints": endpoints,
+            "observer_events": dict(self.events),
+            "server_rss_mb": {
+                "start": round(self.rss_kb[0] / 1024, 1) if self.rss_kb else None,
+                "max": round(max(self.rss_kb) / 1024, 1) if self.rss_kb else None,
+                "end": round(self.rss_kb[-1] / 1024, 1) if self.rss_kb else None,
+            },
+        }
+
+
+class SimAgent:
+    def __init__(self, agent_id: str, args: argparse.Namespace, client: httpx.AsyncClient, stats: Stats) -> None:
+        self.id = agent_id
+        self.args = args
+        self.client = client
+        self.stats = stats
+        self.hash: Optional[str] = None
+        self.apps = {f"app{i}": HeartbeatApp(type="docker-compose", status="running", health="ok", current="1.0.0", branch="main") for i in range(args.apps)}
+        self.os_update = {"pkg_manager": "apt", "upgrades": random.choice([0, 0, 3, 12]), "status": "ok", "sudo_apt_ok": True,
+                          "os_version": "Debian GNU/Linux 12", "kernel": "6.1.0-18-amd64", "arch": "x86_64", "hostname": agent_id}
+
+    async def _post(self, endpoint: str, path: str, body: bytes) -> Optional[httpx.Response]:
+        headers = {"Content-Type": "application/json", "X-Agent-Id": self.id, "X-Signature": sign_bytes(body, self.args.psk)}
+        t0 = time.perf_counter()
+        try:
+            r = await self.client.post(path, content=body, headers=headers)
+            self.stats.record(endpoint, time.perf_counter() - t0, r.status_code < 400)
+            return r
+        except httpx.HTTPError:
+            self.stats.record(endpoint, time.perf_counter() - t0, False)
+            return None
+
+    async def heartbeat(self) -> None:
+        changed = random.random() < self.args.change_ratio
+        if changed:
+            name = random.choice(list(self.apps))
+            self.apps[name] = self.apps[name].model_copy(update={"current": f"1.0.{random.randrange(100)}"})
+        if self.hash is None:
+            payload = HeartbeatPayload(agent_id=self.id, apps=self.apps)
+            extra = {"os_update": self.os_update, "agent_version": "sim"}
+        else:
+            payload = HeartbeatPayload(agent_id=self.id, base=self.hash, apps_changed={name: self.apps[name]} if changed else None)
+            extra = {}
+        body = json.dumps({**payload.model_dump(exclude_none=True), **extra}, separators=(",", ":")).encode()
+        r = await self._post("heartbeat", "/api/heartbeat", body)
+        if r is not None and r.status_code == 200:
+            ack = r.json()
+            self.hash = ack.get("state") if ack.get("status") == "ok" else None
+
+    async def poll(self) -> Optional[dict]:
+        t0 = time.perf_counter()
+        try:
+            r = await self.client.get(f"/api/agents/{self.id}/next-command", headers={"X-Agent-Id": self.id, "X-Signature": sign_bytes(b"{}", self.args.psk)})
+            self.stats.record("next-command", time.perf_counter() - t0, r.status_code < 400)
+            return r.json().get("command") if r.status_code == 200 else None
+        except httpx.HTTPError:
+            self.stats.record("next-command", time.perf_counter() - t0, False)
+            return None
+
+    async def execute(self, cmd: dict) -> None:
+        cid = cmd["command_id"]
+        seq = 0
+        for _ in range(self.args.chunks):
+            items = []
+            for _ in range(self.args.chunk_items):
+                seq += 1
+                items.append(ChunkItem(seq=seq, chunk=f"[{self.id}] simulated output line {seq}\n" * 4))
+            await self._post("command-chunks", "/api/command-chunks", CommandChunkBatch(command_id=cid, chunks=items).model_dump_json().encode())
+            await asyncio.sleep(self.args.chunk_delay)
+        status = "failed" if random.random() < self.args.fail_ratio else "success"
+        await self._post("command-result", "/api/command-result", CommandResult(command_id=cid, status=status, duration=1).model_dump_json().encode())
+
+    async def run(self, stop: asyncio.Event) -> None:
+        await asyncio.sleep(random.random() * self.args.ramp)
+        beats = 0
+        while not stop.is_set():
+            await self.heartbeat()
+            beats += 1
+            if beats % self.args.poll_every == 0:
+                cmd = await self.poll()
+                if cmd:
+                    await self.execute(cmd)
+            await asyncio.sleep(self.args.interval * random.uniform(0.8, 1.2))
+
+
+async def login(client: httpx.AsyncClient, args: argparse.Namespace) -> Optional[str]:
+    if not args.user:
+        return None
+    r = await client.post("/api/auth/login", json={"username": args.user, "password": args.password})
+    r.raise_for_status()
+    return r.json()["token"]
+
+
+async def operator(client: httpx.AsyncClient, token: str, agents: list[str], args: argparse.Namespace, stats: Stats, stop: asyncio.Event, commands: asyncio.Queue) -> None:
+    headers = {"Authorization": f"Bearer {token}"}
+    while not stop.is_set():
+        await asyncio.sleep(1 / args.command_rate)
+        t0 = time.perf_counter()
+        try:
+            r = await client.post(f"/api/agents/{random.choice(agents)}/commands", json={"command": "sim", "commands": []}, headers=headers)
+            stats.record("enqueue", time.perf_counter() - t0, r.status_code < 400)
+            if r.status_code == 200 and commands.qsize() < 1000:
+                commands.put_nowait(r.json()["command_id"])
+        except httpx.HTTPError:
+            stats.record("enqueue", time.perf_counter() - t0, False)
+
+
+async def dashboard_reads(client: httpx.AsyncClient, token: str, args: argparse.Namespace, stats: Stats, stop: asyncio.Event) -> None:
+    headers = {"Authorization": f"Bearer {token}"}
+    etag = None
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        try:
+            r = await client.get("/api/agents", headers={**headers, **({"If-None-Match": etag} if etag else {})})
+            stats.record("agents-list", time.perf_counter() - t0, r.status_code < 400)
+            etag = r.headers.get("etag")
+            t0 = time.perf_counter()
+            r = await client.get("/api/metrics", headers=headers)
+            stats.record("metrics", time.perf_counter() - t0, r.status_code < 400)
+        except httpx.HTTPError:
+            stats.record("agents-list", time.perf_counter() - t0, False)
+        await asyncio.sleep(args.dashboard_interval)
+
+
+async def ws_observer(args: argparse.Namespace, token: str, stats: Stats, stop: asyncio.Event) -> None:
+    url = args.url.replace("http", "ws", 1).rstrip("/") + f"/ws?token={token}"
+    try:
+        async with websockets.connect(url, max_queue=None) as ws:
+            while not stop.is_set():
+                try:
+                    async with asyncio.timeout(1):
+                        await ws.recv()
+                    stats.events["ws_messages"] += 1
+                except asyncio.TimeoutError:
+                    pass
+    except Exception:
+        stats.events["ws_errors"] += 1
+
+
+async def sse_observer(client: httpx.AsyncClient, token: str, stats: Stats, stop: asyncio.Event, commands: asyncio.Queue) -> None:
+    while not stop.is_set():
+        try:
+            async with asyncio.timeout(1):
+                cid = await commands.get()
+        except asyncio.TimeoutError:
+            continue
+        try:
+            async with asyncio.timeout(30):
+                async with client.stream("GET", f"/api/commands/{cid}/stream", headers={"Authorization": f"Bearer {token}"}) as r:
+                    async for line in r.aiter_lines():
+                        if line.startswith("data:"):
+                            stats.events["sse_lines"] += 1
+                        if line.startswith("event: end") or stop.is_set():
+                            break
+        except (asyncio.TimeoutError, httpx.HTTPError):
+            stats.events["sse_timeouts"] += 1
+
+
+async def sample_rss(pid: int, stats: Stats, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        stats.rss_kb.append(int(line.split()[1]))
+        except OSError:
+            return
+        await asyncio.sleep(1)
+
+
+async def main_async(args: argparse.Namespace) -> dict[str, Any]:
+    stats = Stats()
+    stop = asyncio.Event()
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        token = await login(client, args)
+        agents = [SimAgent(f"{args.prefix}-{i:05d}", args, client, stats) for i in range(args.agents)]
+        tasks = [asyncio.create_task(a.run(stop)) for a in agents]
+        commands: asyncio.Queue = asyncio.Queue()
+        if args.server_pid:
+            tasks.append(asyncio.create_task(sample_rss(args.server_pid, stats, stop)))
+        if token:
+            if args.command_rate > 0:
+                tasks.append(asyncio.create_task(operator(client, token, [a.id for a in agents], args, stats, stop, commands)))
+            if args.dashboard_interval > 0:
+                tasks.append(asyncio.create_task(dashboard_reads(client, token, args, stats, stop)))
+            if websockets is not None:
+                tasks += [asyncio.create_task(ws_observer(args, token, stats, stop)) for _ in range(args.ws_observers)]
+            elif args.ws_observers:
+                print("websockets not installed: no WebSocket observers", file=sys.stderr)
+            tasks += [asyncio.create_task(sse_observer(client, token, stats, stop, commands)) for _ in range(args.sse_observers)]
+        t0 = time.perf_counter()
+        await asyncio.sleep(args.seconds)
+        stop.set()
+        elapsed = time.perf_counter() - t0
+        done, pending = await asyncio.wait(tasks, timeout=args.timeout + 5)
+        for t in pending:
+            t.cancel()
+    result = stats.report(elapsed)
+    result["config"] = {k: v for k, v in vars(args).items() if k not in ("psk", "password", "json")}
+    return result
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--psk", default=os.getenv("SERVER_PSK", ""))
+    ap.add_argument("--user", default=os.getenv("UI_USER"), help="UI user for enqueue/observers (optional)")
+    ap.add_argument("--password", default=os.getenv("UI_PASSWORD"))
+    ap.add_argument("--agents", type=int, default=1000)
+    ap.add_argument("--prefix", default="sim")
+    ap.add_argument("--seconds", type=float, default=30)
+    ap.add_argument("--ramp", type=float, default=5, help="spread agent start over N seconds")
+    ap.add_argument("--interval", type=float, default=10, help="heartbeat interval per agent (s)")
+    ap.add_argument("--poll-every", type=int, default=1, help="next-command poll every N heartbeats")
+    ap.add_argument("--change-ratio", type=float, default=0.05, help="share of heartbeats that change an app")
+    ap.add_argument("--apps", type=int, default=5)
+    ap.add_argument("--command-rate", type=float, default=5, help="commands enqueued per second")
+    ap.add_argument("--chunks", type=int, default=5, help="chunk batches per command")
+    ap.add_argument("--chunk-items", type=int, default=4, help="chunks per batch")
+    ap.add_argument("--chunk-delay", type=float, default=0.2)
+    ap.add_argument("--fail-ratio", type=float, default=0.02)
+    ap.add_argument("--ws-observers", type=int, default=5)
+    ap.add_argument("--sse-observers", type=int, default=5)
+    ap.add_argument("--dashboard-interval", type=float, default=5, help="seconds between /api/agents + /api/metrics reads; 0 disables")
+    ap.add_argument("--connections", type=int, default=1000)
+    ap.add_argument("--timeout", type=float, default=30)
+    ap.add_argument("--server-pid", type=int, default=0, help="sample this process's RSS")
+    ap.add_argument("--json", help="write machine-readable results to this file")
+    args = ap.parse_args()
+
+    result = asyncio.run(main_async(args))
+    print(f"{'endpoint':16s} {'req':>8s} {'rps':>8s} {'err%':>6s} {'p50 ms':>8s} {'p99 ms':>8s} {'max ms':>8s}")
+    for name, e in result["endpoints"].items():
+        print(f"{name:16s} {e['requests']:8d} {e['throughput_rps']:8.1f} {e['error_rate'] * 100:6.2f} {e['p50_ms']:8.2f} {e['p99_ms']:8.2f} {e['max_ms']:8.2f}")
+    print(f"observers: {result['observer_events']}  server RSS MB: {result['server_rss_mb']}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
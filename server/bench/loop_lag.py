@@ -0,0 +1,90 @@
+"""Benchmark: event-loop lag while async handlers do SQLite work.
+
+Concurrent simulated agents stream command output (the /api/command-chunk
+storage path: append chunk, extend lease, commit) and a monitor task
+measures how late a 10 ms timer fires. "before" runs the DB calls inline on
+the event loop against a default engine, as the handlers used to; "after"
+uses the WAL/pragma profile and ``run_db``'s bounded worker pool.
+
+    PYTHONPATH=server python server/bench/loop_lag.py --agents 200 --seconds 5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlmodel import SQLModel, Session, create_engine
+
+from app.config import settings
+from app.core.output import OutputStore
+from app.core.queue import extend_lease
+from app.db.session import make_engine
+
+
+def store_chunk(engine, store: OutputStore, command_id: str, data: str) -> None:
+    with Session(engine) as session:
+        store.append(session, command_id, data)
+        extend_lease(session, command_id, 1800)
+        session.commit()
+
+
+async def monitor(stop: asyncio.Event, lags: list[float], interval: float = 0.01) -> None:
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append((time.perf_counter() - t0 - interval) * 1000)
+
+
+async def run(mode: str, agents: int, seconds: float, tmp: str) -> None:
+    url = "sqlite:///" + os.path.join(tmp, f"{mode}.sqlite3")
+    engine = create_engine(url) if mode == "before" else make_engine(url)
+    SQLModel.metadata.create_all(engine)
+    store = OutputStore()
+    pool = ThreadPoolExecutor(max_workers=settings.db_pool_size)
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    lags: list[float] = []
+    done = 0
+    errors = 0
+
+    async def agent(i: int) -> None:
+        nonlocal done, errors
+        n = 0
+        while not stop.is_set():
+            n += 1
+            try:
+                if mode == "before":
+                    store_chunk(engine, store, f"cmd-{i}", f"line {n}\n")
+                else:
+                    await loop.run_in_executor(pool, store_chunk, engine, store, f"cmd-{i}", f"line {n}\n")
+                done += 1
+            except Exception:
+                errors += 1
+            await asyncio.sleep(0)
+
+    mon = asyncio.create_task(monitor(stop, lags))
+    tasks = [asyncio.create_task(agent(i)) for i in range(agents)]
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(mon, *tasks)
+    pool.shutdown()
+    lags.sort()
+    p = lambda q: lags[min(len(lags) - 1, int(q * len(lags)))] if lags else float("nan")  # noqa: E731
+    print(f"{mode:6s} chunks/s {done / seconds:8.0f}  errors {errors:4d}  loop lag ms p50 {p(0.5):7.2f} p99 {p(0.99):7.2f} max {lags[-1] if lags else 0:7.2f}  (samples {len(lags)}, mean {statistics.fmean(lags) if lags else 0:.2f})")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--agents", type=int, default=200)
+    ap.add_argument("--seconds", type=float, default=5.0)
+    args = ap.parse_args()
+    tmp = tempfile.mkdtemp()
+    for mode in ("before", "after"):
+        asyncio.run(run(mode, args.agents, args.seconds, tmp))
+
+
+if __name__ == "__main__":
+    main()
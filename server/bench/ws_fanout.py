@@ -0,0 +1,86 @@
+"""Benchmark: heartbeat-side cost of dashboard broadcast vs number of WS clients.
+
+Simulates dashboard connections whose ``send_text`` takes a configurable
+time (a fraction of them on a slow link) and measures how long the
+heartbeat handler spends broadcasting one ``agent_update``: the previous
+serial ``await ws.send_text`` loop against ``WsBroadcaster.publish``.
+
+    PYTHONPATH=server python server/bench/ws_fanout.py --clients 0,50,500
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+
+from app.core.broadcast import WsBroadcaster
+
+
+class SimulatedWs:
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.received = 0
+
+    async def send_text(self, text: str) -> None:
+        await asyncio.sleep(self.latency)
+        self.received += 1
+
+    async def close(self, code: int = 1000) -> None:
+        pass
+
+
+def _clients(n: int, slow_ratio: float, slow_latency: float) -> list[SimulatedWs]:
+    return [SimulatedWs(slow_latency if random.random() < slow_ratio else 0.0005) for _ in range(n)]
+
+
+def _message(i: int) -> dict:
+    return {"type": "agent_update", "agent": {"id": f"vm-{i % 50}", "status": "online", "apps_state": {"blog": {"status": "running"}}}}
+
+
+async def serial(clients: list[SimulatedWs], beats: int) -> list[float]:
+    timings = []
+    for i in range(beats):
+        t0 = time.perf_counter()
+        text = json.dumps(_message(i))
+        for ws in clients:
+            await ws.send_text(text)
+        timings.append((time.perf_counter() - t0) * 1000)
+    return timings
+
+
+async def queued(clients: list[SimulatedWs], beats: int) -> list[float]:
+    b = WsBroadcaster()
+    for ws in clients:
+        b.register(ws)
+    timings = []
+    for i in range(beats):
+        t0 = time.perf_counter()
+        b.publish(_message(i), key=("agent_update", f"vm-{i % 50}"))
+        timings.append((time.perf_counter() - t0) * 1000)
+        await asyncio.sleep(0.001)  # heartbeats arrive spread over time
+    tasks = [c.task for c in b.clients]
+    for c in list(b.clients):
+        b.unregister(c)
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return timings
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--clients", default="0,50,500")
+    ap.add_argument("--beats", type=int, default=50)
+    ap.add_argument("--slow-ratio", type=float, default=0.05)
+    ap.add_argument("--slow-latency", type=float, default=0.2)
+    args = ap.parse_args()
+    print(f"{'clients':>8} {'serial p50 ms':>14} {'queued p50 ms':>14} {'queued p99 ms':>14}")
+    for n in (int(x) for x in args.clients.split(",")):
+        clients = _clients(n, args.slow_ratio, args.slow_latency)
+        # the serial loop is very slow with slow clients: a few beats are enough
+        s = await serial(clients, max(1, min(args.beats, 5)))
+        q = sorted(await queued(clients, args.beats))
+        print(f"{n:>8} {statistics.median(s):>14.3f} {statistics.median(q):>14.3f} {q[int(len(q) * 0.99) - 1]:>14.3f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,22 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# settings are read at import time: point the app at a throwaway database first
+_tmp = tempfile.mkdtemp(prefix="fleet-tests-")
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(_tmp, "test.sqlite3"))
+for key, value in {"SERVER_PSK": "test-psk", "JWT_SECRET": "test-secret", "UI_USER": "admin", "UI_PASSWORD": "admin"}.items():
+    os.environ.setdefault(key, value)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+@pytest.fixture(scope="session")
+def client():
+    # the app's background tasks and events bind to one loop: start it once per run
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    with TestClient(app) as c:
+        yield c
@@ -0,0 +1,39 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlmodel import Session
+
+from app.config import settings
+from app.core.security import create_access_token
+from app.db.models import Agent
+from app.db.session import engine, init_db
+from app.main import _query_agent_ids
+
+T0 = datetime(2024, 1, 1, 12, 0, 0)  # naive UTC, as stored
+
+
+@pytest.fixture
+def prefix():
+    init_db()
+    prefix = f"list-{uuid.uuid4().hex[:8]}-"
+    with Session(engine) as session:
+        for i in range(3):
+            session.add(Agent(id=f"{prefix}{i}", last_seen=T0 + timedelta(hours=i)))
+        session.commit()
+    return prefix
+
+
+def test_last_seen_before_is_compared_in_utc(prefix):
+    # 14:30 at UTC+2 is 12:30 UTC: only the agent seen at 12:00 is older
+    before = datetime(2024, 1, 1, 14, 30, tzinfo=timezone(timedelta(hours=2)))
+    assert _query_agent_ids({"last_seen_before": before, "q": prefix}, "id", None, 0, None) == [f"{prefix}0"]
+    assert _query_agent_ids({"last_seen_before": before.replace(tzinfo=None), "q": prefix}, "id", None, 0, None) == [f"{prefix}0", f"{prefix}1", f"{prefix}2"]
+
+
+def test_cursor_with_another_sort_is_rejected(client, prefix):
+    auth = {"Authorization": f"Bearer {create_access_token(subject=settings.ui_user)}"}
+    r = client.get("/api/agents", params={"q": prefix, "sort": "-last_seen", "cursor": f"{prefix}1"}, headers=auth)
+    assert r.status_code == 400
+    r = client.get("/api/agents", params={"q": prefix, "sort": "id", "cursor": f"{prefix}0"}, headers=auth)
+    assert r.status_code == 200
@@ -0,0 +1,141 @@
+import asyncio
+import os
+
+import pytest
+
+from app.core.bus import LocalBus, RespBus, RespConnection, RespError, SqliteBus, make_bus
+
+
+async def wait_for(predicate, timeout: float = 2.0) -> None:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("condition not met in time")
+        await asyncio.sleep(0.01)
+
+
+@pytest.fixture(params=["local", "sqlite"] + (["redis"] if os.environ.get("TEST_REDIS_URL") else []))
+def make(request, tmp_path):
+    """Factory of started buses of one backend; buses of one test share their store."""
+    def factory():
+        if request.param == "local":
+            return LocalBus()
+        if request.param == "sqlite":
+            return SqliteBus(str(tmp_path / "bus.sqlite3"), poll_interval=0.01)
+        return RespBus(os.environ["TEST_REDIS_URL"], channel=f"fleetupdate-test-{tmp_path.name}")
+    return request.param, factory
+
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+
+async def started(bus, received=None):
+    async def handler(channel, data):
+        if received is not None:
+            received.append((channel, data))
+    await bus.start(handler)
+    return bus
+
+
+def test_counter_and_values(make):
+    _, factory = make
+
+    async def scenario():
+        bus = await started(factory())
+        try:
+            assert [await bus.incr("n", 60) for _ in range(3)] == [1, 2, 3]
+            await bus.set("k", "v", 60)
+            assert await bus.get("k") == "v"
+            await bus.delete("k", "n")
+            assert await bus.get("k") is None and await bus.incr("n", 60) == 1
+            await bus.set("short", "v", 0.05)
+            await asyncio.sleep(0.1)
+            assert await bus.get("short") is None
+        finally:
+            await bus.stop()
+
+    run(scenario)
+
+
+def test_claim_is_exclusive_until_released_or_expired(make):
+    _, factory = make
+
+    async def scenario():
+        bus = await started(factory())
+        try:
+            assert await bus.claim("job", 60) is True
+            assert await bus.claim("job", 60) is False
+            await bus.release("job")
+            assert await bus.claim("job", 0.05) is True
+            await asyncio.sleep(0.1)
+            assert await bus.claim("job", 60) is True
+        finally:
+            await bus.stop()
+
+    run(scenario)
+
+
+def test_shared_backends_span_workers(make):
+    kind, factory = make
+    if kind == "local":
+        pytest.skip("single process")
+
+    async def scenario():
+        got_a, got_b = [], []
+        a, b = await started(factory(), got_a), await started(factory(), got_b)
+        try:
+            assert await a.claim("detect", 60) is True
+            assert await b.claim("detect", 60) is False
+            await b.release("detect")  # not the holder: no effect
+            assert await b.claim("detect", 60) is False
+            assert await a.incr("rev", 60) == 1 and await b.incr("rev", 60) == 2
+            a.publish("offline", {"agents": ["vm-1"], "rev": 2})
+            await wait_for(lambda: got_b)
+            assert got_b == [("offline", {"agents": ["vm-1"], "rev": 2})]
+            assert got_a == []  # the publisher applies its own change
+        finally:
+            await a.stop()
+            await b.stop()
+
+    run(scenario)
+
+
+def test_sqlite_bus_does_not_replay_old_events(tmp_path):
+    path = str(tmp_path / "bus.sqlite3")
+
+    async def scenario():
+        a = await started(SqliteBus(path, poll_interval=0.01))
+        a.publish("wake", ["vm-1"])
+        await a.stop()
+        got = []
+        b = await started(SqliteBus(path, poll_interval=0.01), got)
+        try:
+            await asyncio.sleep(0.1)
+            return got
+        finally:
+            await b.stop()
+
+    assert run(scenario) == []
+
+
+def test_resp_codec_round_trip():
+    async def scenario():
+        conn = RespConnection("localhost", 6379)
+        conn.reader = asyncio.StreamReader()
+        conn.reader.feed_data(b"+OK\r\n:42\r\n$3\r\nabc\r\n$-1\r\n*3\r\n$7\r\nmessage\r\n$2\r\nch\r\n$2\r\n{}\r\n-ERR boom\r\n")
+        replies = [await conn.read() for _ in range(5)]
+        with pytest.raises(RespError):
+            await conn.read()
+        return replies
+
+    assert RespConnection.encode("SET", "k", 1) == b"*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$1\r\n1\r\n"
+    assert run(scenario) == ["OK", 42, b"abc", None, [b"message", b"ch", b"{}"]]
+
+
+def test_make_bus_picks_the_backend(tmp_path):
+    assert isinstance(make_bus("local"), LocalBus)
+    assert isinstance(make_bus(f"sqlite:///{tmp_path / 'b.sqlite3'}"), SqliteBus)
+    assert isinstance(make_bus("redis://:secret@cache:6380/2"), RespBus)
+    with pytest.raises(ValueError):
+        make_bus("amqp://broker")
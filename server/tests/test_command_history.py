@@ -0,0 +1,70 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlmodel import Session
+
+from app.db.models import Command
+from app.db.session import engine, init_db
+from app.main import _command_cursor, _query_commands
+
+T0 = datetime(2024, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def agent_id():
+    init_db()
+    agent_id = f"agent-{uuid.uuid4().hex[:8]}"
+    # 3 timestamps, several rows per timestamp: a page boundary will fall inside a tie
+    stamps = [T0] * 4 + [T0 + timedelta(seconds=1)] * 3 + [T0 + timedelta(seconds=2)] * 3
+    with Session(engine) as session:
+        for i, at in enumerate(stamps):
+            session.add(Command(command_id=f"{agent_id}-{i}", agent_id=agent_id, payload="{}", kind="noop", status="success", created_at=at))
+        session.commit()
+    return agent_id
+
+
+def pages(filters: dict, limit: int) -> list[list[str]]:
+    out, cursor = [], None
+    while True:
+        items, nxt = _query_commands(filters, _command_cursor(cursor), limit)
+        out.append([c["command_id"] for c in items])
+        if nxt is None:
+            return out
+        cursor = nxt
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 4, 10])
+def test_pages_cover_tied_timestamps_once(agent_id, limit):
+    seen = [cid for page in pages({"agent_id": agent_id}, limit) for cid in page]
+    # newest first, ties broken by id descending: exactly the insertion order reversed
+    assert seen == [f"{agent_id}-{i}" for i in reversed(range(10))]
+
+
+def test_cursor_points_at_last_row(agent_id):
+    items, nxt = _query_commands({"agent_id": agent_id}, None, 5)
+    at, last_id = _command_cursor(nxt)
+    assert at == T0 + timedelta(seconds=1) and items[-1]["created_at"] == at.isoformat()
+    rest, _ = _query_commands({"agent_id": agent_id}, (at, last_id), 100)
+    assert [c["command_id"] for c in rest] == [f"{agent_id}-{i}" for i in reversed(range(5))]
+
+
+def test_last_full_page_then_empty_page(agent_id):
+    assert pages({"agent_id": agent_id}, 5)[-1] == []
+
+
+def test_filters_apply_with_cursor(agent_id):
+    filters = {"agent_id": agent_id, "since": T0 + timedelta(seconds=1)}
+    assert [len(p) for p in pages(filters, 2)] == [2, 2, 2, 0]
+
+
+@pytest.mark.parametrize("cursor", ["garbage", "2024-01-01T12:00:00~x", "~5"])
+def test_invalid_cursor(cursor):
+    with pytest.raises(HTTPException) as exc:
+        _command_cursor(cursor)
+    assert exc.value.status_code == 400
+
+
+def test_no_cursor():
+    assert _command_cursor(None) is None and _command_cursor("") is None
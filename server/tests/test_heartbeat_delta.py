@@ -0,0 +1,65 @@
+import json
+import uuid
+
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.main import agent_states
+from app.utils.hmac import sign_bytes
+
+
+def beat(client: TestClient, payload: dict) -> dict:
+    body = json.dumps(payload).encode()
+    headers = {
+        "Content-Type": "application/json",
+        "X-Agent-Id": payload["agent_id"],
+        "X-Signature": sign_bytes(body, settings.server_psk),
+    }
+    r = client.post("/api/heartbeat", content=body, headers=headers)
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def full(agent_id: str) -> dict:
+    return {
+        "agent_id": agent_id,
+        "apps": {"web": {"current": "a1"}, "api": {"current": "b1"}},
+        "os_update": {"upgrades": 0},
+    }
+
+
+def test_delta_applies_against_acked_state(client):
+    agent_id = f"agent-{uuid.uuid4().hex[:8]}"
+    base = beat(client, full(agent_id))["state"]
+    ack = beat(client, {
+        "agent_id": agent_id,
+        "base": base,
+        "apps_changed": {"web": {"current": "a2"}},
+        "apps_removed": ["api"],
+        "os_update_changed": {"upgrades": 2},
+    })
+    st = agent_states.peek(agent_id)
+    assert ack["state"] == st.hash != base
+    assert set(st.apps) == {"web"} and st.apps["web"]["current"] == "a2"
+    assert st.os_update == {"upgrades": 2}
+
+
+def test_unchanged_delta_keeps_the_hash(client):
+    agent_id = f"agent-{uuid.uuid4().hex[:8]}"
+    base = beat(client, full(agent_id))["state"]
+    assert beat(client, {"agent_id": agent_id, "base": base})["state"] == base
+
+
+def test_base_mismatch_asks_for_resync(client):
+    agent_id = f"agent-{uuid.uuid4().hex[:8]}"
+    base = beat(client, full(agent_id))["state"]
+    ack = beat(client, {"agent_id": agent_id, "base": "0" * 16, "apps_removed": ["api"]})
+    assert ack["status"] == "resync"
+    # the rejected delta was not applied
+    assert agent_states.peek(agent_id).hash == base
+    assert set(agent_states.peek(agent_id).apps) == {"web", "api"}
+
+
+def test_unknown_agent_delta_asks_for_resync(client):
+    ack = beat(client, {"agent_id": f"agent-{uuid.uuid4().hex[:8]}", "base": "0" * 16})
+    assert ack["status"] == "resync"
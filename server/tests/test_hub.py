@@ -0,0 +1,97 @@
+import asyncio
+from contextlib import aclosing
+
+from app.core.hub import END, KEEPALIVE, CommandHub, CommandStream
+
+
+def storage(events: dict[int, str]):
+    """Backfill over a dict of stored chunks, paged like OutputStore.read."""
+    async def backfill(after: int, limit: int = 3):
+        return [(seq, events[seq]) for seq in sorted(events) if seq > after][:limit]
+    return backfill
+
+
+def test_ring_is_bounded_by_events_and_bytes():
+    st = CommandStream(max_events=3, max_bytes=10)
+    for seq in range(1, 6):
+        st.publish(seq, "ab")
+    assert [e[0] for e in st.ring] == [3, 4, 5]
+    st.publish(6, "x" * 8)
+    assert [e[0] for e in st.ring] == [5, 6] and st.bytes == 10
+
+
+def test_ring_ignores_resends_and_reports_gaps():
+    st = CommandStream(max_events=2, max_bytes=1000)
+    for seq in (1, 2, 2, 1, 3):
+        st.publish(seq, str(seq))
+    assert list(st.ring) == [(2, "2"), (3, "3")]
+    assert st.since(1) == ([(2, "2"), (3, "3")], False)
+    # event 1 is gone: the subscriber must catch up from storage
+    assert st.since(0) == ([(2, "2"), (3, "3")], True)
+    assert st.since(3) == ([], False)
+
+
+async def collect(agen, stop_after: int) -> list:
+    out = []
+    async with aclosing(agen):
+        async for ev in agen:
+            out.append(ev)
+            if ev == END or len(out) >= stop_after:
+                break
+    return out
+
+
+def test_late_subscriber_replays_storage_then_follows_live():
+    async def scenario():
+        hub = CommandHub(max_events=2)
+        stored = {1: "a", 2: "b", 3: "c", 4: "d"}
+        for seq, data in stored.items():
+            hub.publish("cmd", seq, data)
+        task = asyncio.create_task(collect(hub.follow("cmd", 0, storage(stored)), 10))
+        await asyncio.sleep(0)
+        stored[5] = "e"
+        hub.publish("cmd", 5, "e")
+        hub.finish("cmd")
+        return await task
+
+    assert asyncio.run(scenario()) == [(1, "a"), (2, "b"), (3, "c"), (4, "d"), (5, "e"), END]
+
+
+def test_slow_subscriber_catches_up_from_storage():
+    async def scenario():
+        hub = CommandHub(max_events=2)
+        stored: dict[int, str] = {}
+        agen = hub.follow("cmd", 0, storage(stored))
+        first = asyncio.create_task(agen.__anext__())
+        await asyncio.sleep(0)
+        # the subscriber is parked; a burst overruns its ring position
+        for seq in range(1, 8):
+            stored[seq] = str(seq)
+            hub.publish("cmd", seq, str(seq))
+        hub.finish("cmd")
+        return [await first] + await collect(agen, 20)
+
+    assert asyncio.run(scenario()) == [(seq, str(seq)) for seq in range(1, 8)] + [END]
+
+
+def test_finished_command_replays_without_a_stream():
+    async def is_final():
+        return True
+
+    async def scenario():
+        hub = CommandHub()
+        events = await collect(hub.follow("old", 1, storage({1: "a", 2: "b"}), is_final=is_final), 10)
+        return events, len(hub)
+
+    assert asyncio.run(scenario()) == ([(2, "b"), END], 0)
+
+
+def test_idle_subscriber_gets_keepalives_and_streams_are_evicted():
+    async def scenario():
+        hub = CommandHub(finished_ttl=0)
+        events = await collect(hub.follow("cmd", 0, storage({}), keepalive=0.01), 2)
+        assert hub.subscriber_count() == 0
+        hub.finish("cmd")
+        return events, hub.evict(), len(hub)
+
+    assert asyncio.run(scenario()) == ([KEEPALIVE, KEEPALIVE], 1, 0)
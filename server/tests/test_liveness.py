@@ -0,0 +1,64 @@
+from app.core.liveness import LivenessTracker
+
+
+def tracker() -> LivenessTracker:
+    return LivenessTracker(grace=3.0, min_timeout=60.0, default_interval=30.0)
+
+
+def test_deadline_uses_reported_interval_with_a_floor():
+    lt = tracker()
+    lt.beat("default", 0.0)
+    lt.beat("slow", 0.0, 100.0)
+    lt.beat("fast", 0.0, 5.0)
+    assert lt.deadlines == {"default": 90.0, "slow": 300.0, "fast": 60.0}
+    assert lt.next_deadline() == 60.0
+
+
+def test_expired_pops_in_deadline_order_and_stops_tracking():
+    lt = tracker()
+    lt.beat("a", 0.0, 100.0)
+    lt.beat("b", 10.0)
+    lt.beat("c", 20.0)
+    assert lt.expired(99.9) == []
+    assert lt.expired(110.0) == [("b", 10.0), ("c", 20.0)]
+    assert len(lt) == 1 and lt.expired(110.0) == []
+    assert lt.expired(300.0) == [("a", 0.0)]
+    assert len(lt) == 0 and lt.next_deadline() is None
+
+
+def test_beat_moves_the_deadline_without_a_new_heap_entry():
+    lt = tracker()
+    lt.beat("a", 0.0)
+    for t in range(1, 50):
+        lt.beat("a", float(t))
+    assert len(lt._heap) == 1
+    # the stale entry surfaces at 90 and is pushed back to the current deadline
+    assert lt.expired(100.0) == []
+    assert lt._heap == [(49.0 + 90.0, "a")]
+    assert lt.expired(139.0) == [("a", 49.0)]
+
+
+def test_older_beat_is_ignored():
+    lt = tracker()
+    lt.beat("a", 100.0)
+    lt.beat("a", 50.0, 40.0)  # late delivery from another worker: only the interval is kept
+    assert lt.last_seen["a"] == 100.0 and lt.deadlines["a"] == 190.0
+    lt.beat("a", 110.0)
+    assert lt.deadlines["a"] == 110.0 + 120.0
+
+
+def test_agent_comes_back_after_expiring():
+    lt = tracker()
+    lt.beat("a", 0.0)
+    assert lt.expired(90.0) == [("a", 0.0)]
+    lt.beat("a", 200.0)
+    assert len(lt) == 1 and lt.expired(289.0) == []
+    assert lt.expired(290.0) == [("a", 200.0)]
+
+
+def test_seed_gives_a_full_timeout_from_now_but_keeps_last_seen():
+    lt = tracker()
+    lt.seed([("a", 10.0, None), ("b", 20.0, 60.0)], now=1000.0)
+    assert lt.deadlines == {"a": 1090.0, "b": 1180.0}
+    assert lt.expired(1100.0) == [("a", 10.0)]
+    assert lt.expired(1180.0) == [("b", 20.0)]
@@ -0,0 +1,96 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlmodel import Session, SQLModel, select
+
+from app.core.archive import archive_reader
+from app.core.output import output_store
+from app.core.retention import Retention, RetentionPolicy
+from app.db.models import Command, CommandOutput
+from app.db.session import make_engine
+
+
+@pytest.fixture
+def engine(tmp_path):
+    eng = make_engine(f"sqlite:///{tmp_path / 'output.sqlite3'}")
+    SQLModel.metadata.create_all(eng)
+    yield eng
+    eng.dispose()
+
+
+def add_command(engine, status: str = "running", **fields) -> str:
+    command_id = str(uuid.uuid4())
+    with Session(engine) as session:
+        session.add(Command(command_id=command_id, agent_id="agent-o", payload="{}", status=status, **fields))
+        session.commit()
+    return command_id
+
+
+@pytest.fixture
+def archive_lookups(monkeypatch):
+    calls = []
+    load = archive_reader.load
+
+    def spy(session, command_id):
+        calls.append(command_id)
+        return load(session, command_id)
+
+    monkeypatch.setattr(archive_reader, "load", spy)
+    return calls
+
+
+def test_caught_up_reader_skips_the_archive(engine, archive_lookups):
+    live = add_command(engine)
+    done = add_command(engine, "success")
+    with Session(engine) as session:
+        output_store.append(session, live, "a")
+        output_store.append(session, done, "b")
+        session.commit()
+        assert output_store.read(session, live, after=1) == []
+        assert output_store.read(session, done, after=1) == []
+        # an active command without any output yet is not compacted either
+        assert output_store.read(session, add_command(engine), after=0) == []
+    assert archive_lookups == []
+
+
+def test_compacted_output_is_read_from_the_archive(engine, archive_lookups):
+    command_id = add_command(engine, "success", updated_at=datetime.utcnow() - timedelta(days=2))
+    with Session(engine) as session:
+        output_store.append(session, command_id, "a")
+        output_store.append(session, command_id, "b")
+        session.commit()
+    Retention(engine, RetentionPolicy()).archive(datetime.utcnow() - timedelta(hours=1))
+    with Session(engine) as session:
+        assert session.exec(select(CommandOutput).where(CommandOutput.command_id == command_id)).first() is None
+        assert output_store.read(session, command_id, after=1) == [(2, "b")]
+    assert archive_lookups == [command_id]
+
+
+def test_append_numbers_chunks_in_order(engine):
+    command_id = add_command(engine)
+    with Session(engine) as session:
+        assert [output_store.append(session, command_id, part) for part in "abc"] == [1, 2, 3]
+        session.commit()
+        assert output_store.materialize(session, command_id) == "abc"
+
+
+def test_append_many_is_idempotent(engine):
+    command_id = add_command(engine, attempt=1)
+    with Session(engine) as session:
+        assert output_store.append_many(session, command_id, [(1, "a"), (2, "b")], attempt=1) == [(1, "a"), (2, "b")]
+        # a resent batch overlapping the stored one only adds the new chunk
+        assert output_store.append_many(session, command_id, [(2, "b"), (3, "c")], attempt=1) == [(3, "c")]
+        assert output_store.append_many(session, command_id, [(1, "a"), (2, "b"), (3, "c")], attempt=1) == []
+        session.commit()
+        assert output_store.read(session, command_id) == [(1, "a"), (2, "b"), (3, "c")]
+
+
+def test_append_many_drops_superseded_attempts_and_rebases(engine):
+    command_id = add_command(engine, attempt=2, output_base=2)
+    with Session(engine) as session:
+        assert output_store.append_many(session, command_id, [(1, "old")], attempt=1) == []
+        # the second run's chunks go after the first run's output
+        assert output_store.append_many(session, command_id, [(1, "x"), (0, "ignored")], attempt=2) == [(3, "x")]
+        session.commit()
+        assert output_store.read(session, command_id) == [(3, "x")]
@@ -0,0 +1,145 @@
+import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+
+from app.config import settings
+from app.core.metrics import fleet_metrics
+from app.core.queue import claim_next, extend_lease, finish, requeue_expired
+from app.core.security import create_access_token
+from app.db.models import Command
+from app.db.session import engine, init_db
+from app.utils.hmac import sign_bytes
+
+
+@pytest.fixture(scope="module", autouse=True)
+def db():
+    init_db()
+
+
+def add_command(agent_id: str, status: str = "pending") -> str:
+    command_id = str(uuid.uuid4())
+    with Session(engine) as session:
+        session.add(Command(command_id=command_id, agent_id=agent_id, payload="{}", status=status))
+        session.commit()
+    return command_id
+
+
+def status_of(command_id: str) -> str:
+    with Session(engine) as session:
+        return session.exec(Command.__table__.select().where(Command.command_id == command_id)).first().status
+
+
+@pytest.mark.parametrize("status", ["running", "pending", "done", ""])
+def test_finish_rejects_non_final_status(status):
+    command_id = add_command("agent-q")
+    with Session(engine) as session, pytest.raises(ValueError):
+        finish(session, command_id, status)
+    assert status_of(command_id) == "pending"
+
+
+def test_finish_counts_a_result_once():
+    command_id = add_command("agent-q", "running")
+    with Session(engine) as session:
+        assert finish(session, command_id, "success") == 1
+        assert finish(session, command_id, "failed") == 0
+        session.commit()
+    assert status_of(command_id) == "success"
+
+
+def fresh_agent() -> str:
+    return f"agent-{uuid.uuid4().hex[:8]}"
+
+
+def test_claim_takes_oldest_pending_and_starts_an_attempt():
+    agent_id = fresh_agent()
+    first, second = add_command(agent_id), add_command(agent_id)
+    with Session(engine) as session:
+        cmd = claim_next(session, agent_id, 60)
+    assert cmd["command_id"] == first and cmd["attempt"] == 1
+    assert status_of(first) == "running" and status_of(second) == "pending"
+
+
+def test_concurrent_claims_hand_out_each_command_once():
+    agent_id = fresh_agent()
+    ids = {add_command(agent_id) for _ in range(20)}
+
+    def poll(_):
+        got = []
+        while True:
+            with Session(engine) as session:
+                cmd = claim_next(session, agent_id, 60)
+            if cmd is None:
+                return got
+            got.append(cmd["command_id"])
+
+    with ThreadPoolExecutor(8) as pool:
+        claimed = [cid for got in pool.map(poll, range(8)) for cid in got]
+    assert sorted(claimed) == sorted(ids)
+
+
+def lease_of(command_id: str) -> datetime | None:
+    with Session(engine) as session:
+        return session.exec(select(Command.lease_expires_at).where(Command.command_id == command_id)).one()
+
+
+def test_extend_lease_only_touches_running_commands():
+    agent_id = fresh_agent()
+    running, pending = add_command(agent_id, "running"), add_command(agent_id)
+    now = datetime.utcnow()
+    with Session(engine) as session:
+        extend_lease(session, running, 120, now=now)
+        extend_lease(session, pending, 120, now=now)
+        session.commit()
+    assert lease_of(running) == now + timedelta(seconds=120)
+    assert lease_of(pending) is None
+
+
+def test_requeue_expired_returns_lapsed_claims_to_pending():
+    agent_id = fresh_agent()
+    lapsed, alive = add_command(agent_id), add_command(agent_id)
+    t0 = datetime.utcnow()
+    with Session(engine) as session:
+        claim_next(session, agent_id, 10, now=t0)
+        claim_next(session, agent_id, 10, now=t0)
+        extend_lease(session, alive, 60, now=t0)
+        session.commit()
+        assert requeue_expired(session, now=t0 + timedelta(seconds=30)) >= 1
+    assert status_of(lapsed) == "pending" and lease_of(lapsed) is None
+    assert status_of(alive) == "running"
+    # the next claim is a new attempt of the same command
+    with Session(engine) as session:
+        cmd = claim_next(session, agent_id, 10)
+    assert cmd["command_id"] == lapsed and cmd["attempt"] == 2
+
+
+def post_result(client: TestClient, agent_id: str, payload: dict):
+    body = json.dumps(payload).encode()
+    headers = {"Content-Type": "application/json", "X-Agent-Id": agent_id, "X-Signature": sign_bytes(body, settings.server_psk)}
+    return client.post("/api/command-result", content=body, headers=headers)
+
+
+def test_result_endpoint_accepts_final_statuses_only(client):
+    command_id = add_command("agent-q", "running")
+    r = post_result(client, "agent-q", {"command_id": command_id, "status": "pending"})
+    assert r.status_code == 400
+    assert status_of(command_id) == "running"
+    r = post_result(client, "agent-q", {"command_id": command_id, "status": "timeout", "duration": 3})
+    assert r.status_code == 200
+    assert status_of(command_id) == "timeout"
+
+
+def test_enqueue_and_claim_count_on_the_loop(client):
+    agent_id = f"agent-{uuid.uuid4().hex[:8]}"
+    before = dict(fleet_metrics.counters)
+    auth = {"Authorization": f"Bearer {create_access_token(subject=settings.ui_user)}"}
+    r = client.post(f"/api/agents/{agent_id}/commands", json={"command": "noop"}, headers=auth)
+    assert r.status_code == 200 and r.json()["queued"]
+    r = client.get(f"/api/agents/{agent_id}/next-command", headers={"X-Agent-Id": agent_id})
+    assert status_of(r.json()["command"]["command_id"]) == "running"
+    assert fleet_metrics.counters["commands_enqueued"] == before.get("commands_enqueued", 0) + 1
+    assert fleet_metrics.counters["commands_claimed"] == before.get("commands_claimed", 0) + 1
@@ -0,0 +1,133 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func
+from sqlmodel import Session, SQLModel, select
+
+from app.core.output import output_store
+from app.core.retention import Retention, RetentionPolicy
+from app.db.models import Command, CommandArchive, CommandOutput, Deployment
+from app.db.session import make_engine
+
+NOW = datetime(2024, 6, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    eng = make_engine(f"sqlite:///{tmp_path / 'retention.sqlite3'}")
+    SQLModel.metadata.create_all(eng)
+    yield eng
+    eng.dispose()
+
+
+def add(engine, rows: list[dict]) -> None:
+    with Session(engine) as session:
+        for r in rows:
+            session.add(Command(payload="{}", **r))
+        session.commit()
+
+
+def remaining(engine) -> set[str]:
+    with Session(engine) as session:
+        return set(session.exec(select(Command.command_id)).all())
+
+
+def test_keep_days_removes_output_archive_and_deployments(engine):
+    old = NOW - timedelta(days=10)
+    add(engine, [
+        {"command_id": "old", "agent_id": "a", "kind": "noop", "status": "success", "created_at": old},
+        {"command_id": "new", "agent_id": "a", "kind": "noop", "status": "success", "created_at": NOW},
+    ])
+    with Session(engine) as session:
+        output_store.append(session, "old", "x")
+        session.add(CommandArchive(command_id="old", codec="none", data=b"[]", raw_bytes=2))
+        session.add(Deployment(agent_id="a", command_id="old", app_name="web", status="success"))
+        session.commit()
+    deleted = Retention(engine, RetentionPolicy(keep_days=1, keep_per_type=0)).prune(NOW)
+    assert deleted == 1 and remaining(engine) == {"new"}
+    with Session(engine) as session:
+        for model in (CommandOutput, CommandArchive, Deployment):
+            assert session.exec(select(func.count()).select_from(model)).one() == 0
+
+
+def test_keep_per_type_and_active_commands_survive(engine):
+    old = NOW - timedelta(days=10)
+    add(engine, [
+        {"command_id": f"noop-{i}", "agent_id": "a", "kind": "noop", "status": "success", "created_at": old + timedelta(seconds=i)}
+        for i in range(4)
+    ] + [
+        {"command_id": "reboot", "agent_id": "a", "kind": "reboot", "status": "failed", "created_at": old},
+        {"command_id": "pending", "agent_id": "a", "kind": "noop", "status": "pending", "created_at": old},
+    ])
+    Retention(engine, RetentionPolicy(keep_days=1, keep_per_type=2)).prune(NOW)
+    assert remaining(engine) == {"noop-2", "noop-3", "reboot", "pending"}
+
+
+def oracle(rows: list[dict], policy: RetentionPolicy) -> set[str]:
+    """Rows kept under the row_number() semantics, ties broken by insertion order."""
+    finished = [(i, r) for i, r in enumerate(rows) if r["status"] not in ("pending", "running")]
+    newest = sorted(finished, key=lambda t: (t[1]["created_at"], t[0]), reverse=True)
+    doomed = set()
+    for i, r in newest:
+        peers = [j for j, s in newest if s["agent_id"] == r["agent_id"]]
+        same = [j for j, s in newest if s["agent_id"] == r["agent_id"] and s["kind"] == r["kind"]]
+        expired = (policy.keep_days and r["created_at"] < NOW - timedelta(days=policy.keep_days)) or (
+            policy.max_per_agent and peers.index(i) >= policy.max_per_agent
+        )
+        if expired and not (policy.keep_per_type and same.index(i) < policy.keep_per_type):
+            doomed.add(r["command_id"])
+    return {r["command_id"] for r in rows} - doomed
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 3, 200])
+@pytest.mark.parametrize("keep_days,max_per_agent,keep_per_type", [(0, 3, 0), (0, 3, 1), (5, 0, 2), (5, 4, 1)])
+def test_batched_prune_matches_ranking(engine, batch_size, keep_days, max_per_agent, keep_per_type):
+    rows = []
+    for n in range(24):
+        agent = "ab"[n % 2]
+        # every other pair shares a timestamp: batch edges fall inside ties
+        at = NOW - timedelta(days=12 - n // 2)
+        rows.append({
+            "command_id": f"c{n}", "agent_id": agent, "kind": ("noop", "reboot", "apt")[n % 3],
+            "status": "running" if n == 7 else "success", "created_at": at,
+        })
+    add(engine, rows)
+    policy = RetentionPolicy(keep_days=keep_days, max_per_agent=max_per_agent, keep_per_type=keep_per_type, batch_size=batch_size)
+    Retention(engine, policy).prune(NOW)
+    assert remaining(engine) == oracle(rows, policy)
+
+
+def test_archive_compacts_output_and_keeps_it_readable(engine):
+    add(engine, [{"command_id": "done", "agent_id": "a", "kind": "noop", "status": "success", "updated_at": NOW - timedelta(days=2)}])
+    with Session(engine) as session:
+        for part in ("one\n", "two\n", "three\n"):
+            output_store.append(session, "done", part)
+        session.commit()
+    assert Retention(engine, RetentionPolicy()).archive(NOW - timedelta(hours=24)) == 1
+    with Session(engine) as session:
+        assert session.exec(select(func.count()).select_from(CommandOutput)).one() == 0
+        assert output_store.materialize(session, "done") == "one\ntwo\nthree\n"
+        assert output_store.read(session, "done", after=2) == [(3, "three\n")]
+
+
+def test_vacuum_converts_an_old_database_once(tmp_path):
+    path = tmp_path / "old.sqlite3"
+    # a file created before auto_vacuum was set: mode NONE
+    con = sqlite3.connect(path)
+    con.execute("CREATE TABLE filler (data BLOB)")
+    con.executemany("INSERT INTO filler VALUES (?)", [(b"x" * 4000,)] * 200)
+    con.commit()
+    con.execute("DELETE FROM filler")
+    con.commit()
+    con.close()
+    eng = make_engine(f"sqlite:///{path}")
+    try:
+        retention = Retention(eng, RetentionPolicy())
+        assert retention.vacuum() > 0
+        with eng.connect() as conn:
+            assert conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2
+        # later passes are incremental: nothing left to free
+        assert retention.vacuum() == 0
+    finally:
+        eng.dispose()
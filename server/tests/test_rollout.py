@@ -0,0 +1,169 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import update
+from sqlmodel import Session
+
+from app.core.rollout import RolloutRun, RolloutScheduler, RolloutSpec, Target, plan_waves
+from app.db.models import Command
+from app.db.session import engine, init_db
+
+AGENTS = [f"a{i:02d}" for i in range(10)]
+
+
+@pytest.mark.parametrize("waves, sizes", [
+    ([1, "100%"], [1, 9]),
+    ([2, "50%", "100%"], [2, 3, 5]),
+    (["10%", "10%", "60%"], [1, 5, 4]),  # a repeated percentage adds nothing; leftovers join a last wave
+    ([3, 3], [3, 3, 4]),
+    ([20], [10]),
+    ([0, "0%", "100%"], [10]),
+    ([], [10]),
+])
+def test_plan_waves(waves, sizes):
+    planned = plan_waves(AGENTS, waves)
+    assert [len(w) for w in planned] == sizes
+    assert [a for w in planned for a in w] == AGENTS
+
+
+def test_plan_waves_no_agents():
+    assert plan_waves([], [1, "100%"]) == []
+
+
+def test_failure_rate_counts_finished_targets_only():
+    run = RolloutRun("r", {}, RolloutSpec())
+    assert run.failure_rate() is None
+    for i, status in enumerate(["succeeded", "succeeded", "succeeded", "failed", "queued", "waiting"]):
+        run.add(Target(f"a{i}", None, 0, status))
+    assert run.failure_rate() == 0.25
+
+
+@pytest.fixture(scope="module", autouse=True)
+def db():
+    init_db()
+
+
+def scheduler() -> RolloutScheduler:
+    return RolloutScheduler(engine, asyncio.to_thread, notify=lambda agent_id: None, group_of=lambda agent_id: None)
+
+
+def commands(run: RolloutRun, wave: int) -> list[str]:
+    return [run.targets[a].command_id for a in run.waves[wave]]
+
+
+def test_failed_canary_pauses_the_rollout():
+    async def scenario():
+        s = scheduler()
+        run = await s.create(AGENTS, {"command": "noop"}, RolloutSpec(waves=[2, "100%"], failure_threshold=0.2, health_gate=False))
+        first, second = commands(run, 0)
+        await s.on_result(first, "success")
+        await s.on_result(second, "error")
+        return run
+
+    run = asyncio.run(scenario())
+    # 1 failure out of 2 finished is above 20%: wave 2 is never dispatched
+    assert run.state == "paused" and "50%" in run.reason
+    assert run.wave == 0
+    assert all(run.targets[a].status == "waiting" for a in run.waves[1])
+
+
+def test_failures_below_threshold_keep_going():
+    async def scenario():
+        s = scheduler()
+        run = await s.create(AGENTS, {"command": "noop"}, RolloutSpec(waves=[4, "100%"], failure_threshold=0.3, health_gate=False))
+        # the rate is checked on each result: the failure comes last, at 1/4
+        *ok, bad = commands(run, 0)
+        for cid in ok:
+            await s.on_result(cid, "success")
+        await s.on_result(bad, "error")
+        return run
+
+    run = asyncio.run(scenario())
+    assert run.state == "running" and run.failure_rate() == 0.25
+    assert all(run.targets[a].status == "queued" for a in run.waves[1])
+
+
+def test_unclaimed_canary_counts_as_a_failure():
+    async def scenario():
+        s = scheduler()
+        run = await s.create(AGENTS, {"command": "noop"}, RolloutSpec(waves=[1, "100%"], health_gate=False, claim_timeout=0.05))
+        await asyncio.sleep(0.3)
+        return run
+
+    run = asyncio.run(scenario())
+    canary = run.targets[run.waves[0][0]]
+    assert canary.status == "failed" and canary.detail == "not claimed within 0.05s"
+    assert run.state == "paused"
+
+
+def test_completed_run_is_retired():
+    async def scenario():
+        s = scheduler()
+        run = await s.create(AGENTS[:2], {"command": "noop"}, RolloutSpec(waves=["100%"], health_gate=False))
+        for cid in commands(run, 0):
+            await s.on_result(cid, "success")
+        return s, run
+
+    s, run = asyncio.run(scenario())
+    assert run.state == "completed"
+    assert run.id not in s.runs and not s._timers
+
+
+def set_status(command_id: str, status: str) -> None:
+    with Session(engine) as session:
+        session.execute(update(Command).where(Command.command_id == command_id).values(status=status, updated_at=datetime.utcnow()))
+        session.commit()
+
+
+def restart(rid: str) -> RolloutRun:
+    async def run():
+        s = scheduler()
+        await s.load()
+        return s.runs.get(rid) or await asyncio.to_thread(s.read, rid, False)
+
+    return asyncio.run(run())
+
+
+def test_restart_resumes_after_verifying_canary():
+    async def before():
+        s = scheduler()
+        run = await s.create(AGENTS[:4], {"command": "noop"}, RolloutSpec(waves=[1, "100%"]))
+        await s.on_result(commands(run, 0)[0], "success")
+        return run
+
+    run = asyncio.run(before())
+    assert run.targets[run.waves[0][0]].status == "verifying"
+    # the gate heartbeat is lost with the restart: the canary counts as succeeded
+    run = restart(run.id)
+    assert run.state == "running" and run.wave == 1
+    assert run.counts() == {"succeeded": 1, "queued": 3}
+
+
+def test_restart_applies_results_that_arrived_while_down():
+    async def before():
+        s = scheduler()
+        return await s.create(AGENTS[:4], {"command": "noop"}, RolloutSpec(waves=[2, "100%"], health_gate=False))
+
+    run = asyncio.run(before())
+    ok, bad = commands(run, 0)
+    set_status(ok, "success")
+    set_status(bad, "failed")
+    run = restart(run.id)
+    assert run.state == "paused" and run.wave == 0
+    assert run.targets[run.waves[0][1]].detail == "command failed"
+    # the settled targets and the pause were persisted
+    stored = restart(run.id)
+    assert stored.state == "paused" and stored.counts() == {"succeeded": 1, "failed": 1, "waiting": 2}
+
+
+def test_restart_dispatches_targets_held_by_max_in_flight():
+    async def before():
+        s = scheduler()
+        return await s.create(AGENTS[:3], {"command": "noop"}, RolloutSpec(waves=["100%"], max_in_flight=1, health_gate=False))
+
+    run = asyncio.run(before())
+    first = run.targets[run.waves[0][0]].command_id
+    set_status(first, "success")
+    run = restart(run.id)
+    assert run.counts() == {"succeeded": 1, "queued": 1, "waiting": 1}
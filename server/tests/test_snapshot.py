@@ -0,0 +1,88 @@
+import json
+import uuid
+from datetime import datetime, timedelta
+
+from app.config import settings
+from app.core.security import create_access_token
+from app.core.snapshot import FleetSnapshot, fleet_snapshot
+
+T0 = datetime(2024, 1, 1, 12, 0, 0)
+
+
+def fleet(n: int) -> FleetSnapshot:
+    snap = FleetSnapshot()
+    for i in range(n):
+        snap.update(f"vm-{i:02d}", last_seen=T0, os_update={"upgrades": i % 2})
+    return snap
+
+
+def test_pages_walk_ids_in_order():
+    snap = fleet(5)
+    seen, cursor = [], None
+    while True:
+        entries, cursor = snap.page(cursor, 2)
+        seen += [e.id for e in entries]
+        if cursor is None:
+            break
+    assert seen == [f"vm-{i:02d}" for i in range(5)]
+
+
+def test_render_is_valid_json_with_serve_time_uptime():
+    snap = fleet(2)
+    body = json.loads(snap.render(snap.page()[0], now=T0 + timedelta(seconds=90)))
+    assert [a["id"] for a in body] == ["vm-00", "vm-01"]
+    assert body[1]["outdated"] is True and body[0]["uptime_seconds"] == 90
+
+
+def test_since_returns_agents_changed_after_a_revision():
+    snap = fleet(3)
+    rev = snap.revision
+    snap.update("vm-01", status="offline")
+    snap.update("vm-00", status="offline")
+    snap.update("vm-01", status="online")
+    assert [e.id for e in snap.since(rev)] == ["vm-00", "vm-01"]
+    assert snap.since(snap.revision) == []
+
+
+def test_since_keeps_order_for_revisions_delivered_late():
+    snap = fleet(3)
+    snap.update("vm-00", status="offline", revision=10)
+    # allocated earlier on another worker, delivered after revision 10
+    snap.update("vm-02", status="offline", revision=9)
+    assert snap.revision == 10
+    assert [e.id for e in snap.since(8)] == ["vm-02", "vm-00"]
+    assert [e.id for e in snap.since(9)] == ["vm-00"]
+
+
+def test_loaded_agents_are_not_a_delta():
+    class Row:
+        id, last_seen, status, apps_state, os_update, agent_version = "vm-x", T0, "online", None, None, None
+
+    snap = FleetSnapshot()
+    snap.load([Row()])
+    assert snap.revision == 0 and snap.since(0) == [] and len(snap.page()[0]) == 1
+
+
+def test_touch_changes_the_etag_but_not_the_revision():
+    snap = fleet(1)
+    rev, etag = snap.revision, snap.etag
+    snap.touch("vm-00", T0 + timedelta(seconds=5))
+    assert snap.revision == rev and snap.etag != etag
+    assert snap.since(rev) == []
+
+
+def test_list_answers_304_until_the_fleet_changes(client):
+    auth = {"Authorization": f"Bearer {create_access_token(subject=settings.ui_user)}"}
+    agent_id = f"snap-{uuid.uuid4().hex[:8]}"
+    fleet_snapshot.update(agent_id, last_seen=datetime.utcnow())
+    r = client.get("/api/agents", headers=auth)
+    etag = r.headers["ETag"]
+    assert r.status_code == 200 and agent_id in [a["id"] for a in r.json()]
+    assert client.get("/api/agents", headers={**auth, "If-None-Match": etag}).status_code == 304
+    rev = int(r.headers["X-Fleet-Revision"])
+    fleet_snapshot.touch(agent_id, datetime.utcnow())
+    r = client.get("/api/agents", headers={**auth, "If-None-Match": etag})
+    assert r.status_code == 200 and r.headers["ETag"] != etag
+    fleet_snapshot.update(agent_id, status="offline")
+    r = client.get("/api/agents", params={"since": rev}, headers=auth)
+    assert [a["id"] for a in r.json()] == [agent_id]
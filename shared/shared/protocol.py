@@ -1,11 +1,21 @@
 from typing import Any, Dict, List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class Heartbeat(BaseModel):
     agent_id: str
-    apps: Dict[str, Dict[str, Any]]
+    apps: Dict[str, Dict[str, Any]] = Field(default_factory=dict)
     logs: Optional[List[str]] = None
+    agent_version: Optional[str] = None
+    poll_interval: Optional[int] = None  # seconds; sets the server's offline deadline
+    # Full beats only; absent means "keep the last reported os_update"
+    os_update: Optional[Dict[str, Any]] = None
+    # Delta beats: `base` is the state hash last acknowledged by the server.
+    # When set, `apps` is ignored and only the changes below are applied.
+    base: Optional[str] = None
+    apps_changed: Optional[Dict[str, Dict[str, Any]]] = None
+    apps_removed: Optional[List[str]] = None
+    os_update_changed: Optional[Dict[str, Any]] = None
 
 
 class CommandRequest(BaseModel):
@@ -22,4 +32,5 @@ class CommandResult(BaseModel):
     new_state: Optional[str] = None
     output: Optional[List[str]] = None
     duration: Optional[int] = None
+    exit_code: Optional[int] = None
     logs: Optional[str] = None